@@ -0,0 +1,38 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+
+
+def token_cache_key(key):
+    # No guardar el token en claro como parte de la clave
+    return 'botbrain:auth:token:' + hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_token_cache():
+    return caches[getattr(settings, 'BOTBRAIN_TOKEN_CACHE_ALIAS', 'default')]
+
+
+def invalidate_token(key):
+    get_token_cache().delete(token_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication que guarda la resolución token -> usuario durante
+    BOTBRAIN_TOKEN_CACHE_TIMEOUT segundos. Los aciertos no consultan la base.
+    Borrar el token (logout) o guardar el usuario invalida la entrada.
+    """
+
+    def authenticate_credentials(self, key):
+        cache = get_token_cache()
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        user, token = super().authenticate_credentials(key)
+        cache.set(cache_key, (user, token), getattr(settings, 'BOTBRAIN_TOKEN_CACHE_TIMEOUT', 30))
+        return user, token
+
@@ -1,3 +1,46 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from .authentication import CachedTokenAuthentication
+from .models import User
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='bot', email='bot@example.com', password='secret-pass-123')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_cache_hit_resolves_token_without_queries(self):
+        authentication = CachedTokenAuthentication()
+        # Fallo: authtoken_token JOIN custom_user
+        with self.assertNumQueries(1):
+            user, token = authentication.authenticate_credentials(self.token.key)
+        # Acierto: ninguna consulta
+        with self.assertNumQueries(0):
+            cached_user, cached_token = authentication.authenticate_credentials(self.token.key)
+        self.assertEqual((cached_user, cached_token), (user, token))
+
+    def test_profile_requests_stop_querying_the_token_table(self):
+        self.client.get(reverse('profile'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('profile'))
+        self.assertEqual(response.data['email'], 'bot@example.com')
+
+    def test_logout_invalidates_the_cached_token(self):
+        self.client.get(reverse('profile'))
+        response = self.client.post(reverse('logout'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Token.objects.filter(key=self.token.key).exists())
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
+
+    def test_deactivating_the_user_invalidates_the_cached_token(self):
+        self.client.get(reverse('profile'))
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get(reverse('profile')).status_code, 401)
@@ -1,6 +1,9 @@
 from django.contrib import admin
-from .models import Command, Raspberry, History
+from .models import Command, Raspberry, History, StatusCounter, DeviceCredential, ResultChunk
 
 admin.site.register(Command)
 admin.site.register(Raspberry)
 admin.site.register(History)
+admin.site.register(StatusCounter)
+admin.site.register(DeviceCredential)
+admin.site.register(ResultChunk)
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class BotsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'bots'
+
+    def ready(self):
+        from . import instrumentation, signals  # noqa: F401
+
+        instrumentation.install()
@@ -0,0 +1,114 @@
+import datetime
+import gzip
+import json
+import os
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import History, ResultChunk
+
+# Solo se archivan comandos terminados
+ARCHIVABLE_STATUSES = ['executed', 'failed', 'timed_out']
+
+ARCHIVE_FIELDS = [
+    'id', 'raspberry_id', 'command_id', 'status',
+    'result', 'result_size', 'result_truncated', 'attempts', 'priority', 'not_before',
+    'created_at', 'updated_at',
+]
+
+
+def get_archive_dir():
+    return Path(getattr(settings, 'BOTBRAIN_HISTORY_ARCHIVE_DIR', settings.BASE_DIR / 'archive'))
+
+
+def archive_path(directory, day):
+    """Un archivo por día de creación: history-AAAA-MM-DD.jsonl.gz"""
+    return Path(directory) / f'history-{day:%Y-%m-%d}.jsonl.gz'
+
+
+def _archive_day(value):
+    return timezone.localtime(value).date() if settings.USE_TZ else value.date()
+
+
+def archive_history(before, statuses=ARCHIVABLE_STATUSES, batch_size=500, directory=None):
+    """
+    Mueve a archivos JSONL comprimidos las filas de History creadas antes de
+    `before` con estado en `statuses`, y las borra en transacciones de
+    `batch_size` filas. Cada lote se escribe y sincroniza a disco antes de
+    borrarse; si el proceso se corta entre ambos pasos, la siguiente
+    ejecución vuelve a escribir esas filas y read_archive descarta el
+    duplicado. Devuelve cuántas filas se archivaron.
+    """
+    directory = Path(directory or get_archive_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    candidates = (
+        History.objects.filter(created_at__lt=before, status__in=statuses)
+        .order_by('created_at', 'id')
+        .values(*ARCHIVE_FIELDS)
+    )
+
+    archived = 0
+    while True:
+        rows = list(candidates[:batch_size])
+        if not rows:
+            return archived
+
+        ids = [row['id'] for row in rows]
+        output = {}
+        # La salida en vivo (ResultChunk) viaja con su fila
+        chunks = ResultChunk.objects.filter(history_id__in=ids).order_by('history_id', 'seq')
+        for history_id, data in chunks.values_list('history_id', 'data').iterator():
+            output.setdefault(history_id, []).append(data)
+
+        by_day = {}
+        for row in rows:
+            row['output'] = ''.join(output[row['id']]) if row['id'] in output else None
+            by_day.setdefault(_archive_day(row['created_at']), []).append(row)
+
+        for day, day_rows in by_day.items():
+            # gzip admite concatenar miembros: cada lote se agrega al archivo del día
+            with open(archive_path(directory, day), 'ab') as raw:
+                with gzip.GzipFile(fileobj=raw, mode='ab') as archive:
+                    for row in day_rows:
+                        archive.write(json.dumps(row, cls=DjangoJSONEncoder).encode() + b'\n')
+                raw.flush()
+                os.fsync(raw.fileno())
+
+        History.objects.prune(ids)
+        archived += len(rows)
+
+
+def read_archive(start, end, raspberry_slug=None, command_slug=None, status=None, directory=None):
+    """
+    Recorre las filas archivadas con created_at en [start, end), en el orden
+    en que se archivaron. Solo abre los archivos de los días del rango.
+    """
+    directory = Path(directory or get_archive_dir())
+    day = _archive_day(start)
+    last_day = _archive_day(end)
+    while day <= last_day:
+        path = archive_path(directory, day)
+        day += datetime.timedelta(days=1)
+        if not path.exists():
+            continue
+
+        seen = set()
+        with gzip.open(path, 'rt') as archive:
+            for line in archive:
+                row = json.loads(line)
+                if row['id'] in seen:
+                    continue
+                seen.add(row['id'])
+                created_at = datetime.datetime.fromisoformat(row['created_at'].replace('Z', '+00:00'))
+                if not start <= created_at < end:
+                    continue
+                if raspberry_slug and row['raspberry_id'] != raspberry_slug:
+                    continue
+                if command_slug and row['command_id'] != command_slug:
+                    continue
+                if status and row['status'] != status:
+                    continue
+                yield row
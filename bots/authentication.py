@@ -0,0 +1,99 @@
+from django.utils.crypto import constant_time_compare, salted_hmac
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.permissions import BasePermission
+
+from .models import DeviceCredential
+
+KEY_SALT = 'bots.authentication.DeviceKey'
+
+
+def make_device_key(raspberry_slug, generation):
+    """Clave del dispositivo: '<slug>.<generación>.<firma HMAC-SHA256>'"""
+    signature = salted_hmac(KEY_SALT, f'{raspberry_slug}:{generation}', algorithm='sha256').hexdigest()
+    return f'{raspberry_slug}.{generation}.{signature}'
+
+
+def verify_device_key(key):
+    """
+    Devuelve (raspberry_slug, generation) si la firma es válida, o None.
+    Solo usa el secreto del servidor: no consulta la base.
+    """
+    try:
+        raspberry_slug, generation, signature = key.rsplit('.', 2)
+        generation = int(generation)
+    except ValueError:
+        return None
+    expected = make_device_key(raspberry_slug, generation)
+    if not constant_time_compare(key, expected):
+        return None
+    return raspberry_slug, generation
+
+
+class DevicePrincipal:
+    """Usuario mínimo que representa a un Raspberry Pi autenticado con su clave"""
+    is_authenticated = True
+    is_anonymous = False
+    is_active = True
+    is_staff = False
+    is_superuser = False
+    pk = None
+
+    def __init__(self, raspberry_slug):
+        self.raspberry_slug = raspberry_slug
+
+    def __str__(self):
+        return f'device:{self.raspberry_slug}'
+
+
+class DeviceKeyAuthentication(BaseAuthentication):
+    """
+    Authorization: Device <clave>
+
+    La firma se verifica en memoria con comparación de tiempo constante; la
+    generación vigente se lee de la base en cada petición (una búsqueda por
+    clave única), así que rotar o revocar una credencial invalida las claves
+    anteriores en todos los workers al instante.
+    """
+    keyword = 'Device'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid device key header.')
+        try:
+            key = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed('Invalid device key header.')
+        return self.authenticate_credentials(key)
+
+    def authenticate_credentials(self, key):
+        verified = verify_device_key(key)
+        if verified is None:
+            raise exceptions.AuthenticationFailed('Invalid device key.')
+        raspberry_slug, generation = verified
+
+        # Sin caché por proceso: device_keys corre en otro proceso y su
+        # rotación debe verse en todos los workers de inmediato
+        credential = DeviceCredential.objects.filter(raspberry_id=raspberry_slug).first()
+        if credential is None or not credential.is_active or credential.generation != generation:
+            raise exceptions.AuthenticationFailed('Device key revoked or rotated.')
+        return DevicePrincipal(raspberry_slug), credential
+
+    def authenticate_header(self, request):
+        return self.keyword
+
+
+class IsDeviceOwnerOrAuthenticated(BasePermission):
+    """
+    Usuarios autenticados acceden a cualquier dispositivo; una clave de
+    dispositivo solo a las rutas de su propio slug.
+    """
+
+    def has_permission(self, request, view):
+        user = request.user
+        if isinstance(user, DevicePrincipal):
+            return view.kwargs.get('raspberry_slug') == user.raspberry_slug
+        return bool(user and user.is_authenticated)
@@ -0,0 +1,170 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Command, Raspberry
+
+# Distingue "no está en caché" de "en caché como inexistente" (None)
+MISSING = object()
+
+
+class LRUBackend:
+    """
+    Caché en proceso con desalojo LRU. Cada worker tiene la suya: las
+    invalidaciones de otro worker solo se ven al expirar `timeout`.
+    """
+
+    def __init__(self, maxsize=10000, timeout=60, miss_timeout=2):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.miss_timeout = miss_timeout
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._versions = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return MISSING
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.timeout if timeout is None else timeout))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_version(self, namespace):
+        return self._versions.get(namespace, 1)
+
+    def incr_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 1) + 1
+            # Las entradas de la versión anterior ya no se pueden alcanzar
+            prefix = f'{namespace}:'
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._versions.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Usa un alias de CACHES de Django. Con un backend compartido (Redis,
+    Memcached) las invalidaciones se ven en todos los workers de inmediato.
+    """
+
+    def __init__(self, alias='default', timeout=300, miss_timeout=2):
+        self.alias = alias
+        self.timeout = timeout
+        self.miss_timeout = miss_timeout
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(f'botbrain:catalog:{key}', MISSING)
+
+    def set(self, key, value, timeout=None):
+        self.cache.set(f'botbrain:catalog:{key}', value, self.timeout if timeout is None else timeout)
+
+    def get_version(self, namespace):
+        return self.cache.get_or_set(f'botbrain:catalog:{namespace}:version', 1, None)
+
+    def incr_version(self, namespace):
+        key = f'botbrain:catalog:{namespace}:version'
+        try:
+            self.cache.incr(key)
+        except ValueError:
+            self.cache.set(key, 2, None)
+
+    def clear(self):
+        pass
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        config = getattr(settings, 'BOTBRAIN_CATALOG_CACHE', {})
+        backend_class = import_string(config.get('BACKEND', 'bots.catalog.LRUBackend'))
+        _backend = backend_class(**config.get('OPTIONS', {}))
+    return _backend
+
+
+@receiver(setting_changed)
+def reset_backend(setting, **kwargs):
+    global _backend
+    if setting == 'BOTBRAIN_CATALOG_CACHE':
+        _backend = None
+
+
+class Catalog:
+    """
+    Caché de lectura por slug para tablas que cambian poco. Guardar o borrar
+    una fila incrementa la versión del catálogo (ver bots.signals), lo que
+    invalida todas sus entradas a la vez.
+    """
+
+    def __init__(self, model, namespace, field='slug'):
+        self.model = model
+        self.namespace = namespace
+        self.field = field
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, slug):
+        """Devuelve la instancia con ese slug, o None si no existe"""
+        backend = get_backend()
+        key = f'{self.namespace}:{backend.get_version(self.namespace)}:{slug}'
+        value = backend.get(key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        try:
+            value = self.model.objects.get(**{self.field: slug})
+        except self.model.DoesNotExist:
+            value = None
+        # También se guardan los inexistentes, para que los slugs basura no
+        # lleguen a la base, pero poco tiempo: la invalidación de otro worker
+        # al crear la fila no llega a esta caché
+        backend.set(key, value, backend.miss_timeout if value is None else None)
+        return value
+
+    def exists(self, slug):
+        return self.get(slug) is not None
+
+    def invalidate(self):
+        get_backend().incr_version(self.namespace)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+raspberries = Catalog(Raspberry, 'raspberry')
+commands = Catalog(Command, 'command')
+
+
+def stats():
+    return {catalog.namespace: catalog.stats() for catalog in (raspberries, commands)}
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+
+from accounts.authentication import CachedTokenAuthentication
+
+from . import catalog
+from .authentication import DeviceKeyAuthentication
+from .models import History
+from .push import subscribe
+
+logger = logging.getLogger(__name__)
+
+# Códigos de cierre propios (rango 4000-4999 reservado para aplicaciones)
+CLOSE_UNAUTHORIZED = 4401
+CLOSE_NOT_FOUND = 4404
+CLOSE_HEARTBEAT_TIMEOUT = 4408
+
+
+def _get_credentials(scope):
+    """Devuelve (esquema, clave) con esquema 'token' o 'device'"""
+    headers = dict(scope.get('headers', []))
+    authorization = headers.get(b'authorization', b'').decode('latin1').split()
+    if len(authorization) == 2 and authorization[0].lower() in ('token', 'device'):
+        return authorization[0].lower(), authorization[1]
+    # Algunos clientes WebSocket no permiten cabeceras personalizadas
+    query = parse_qs(scope.get('query_string', b'').decode())
+    if 'device_key' in query:
+        return 'device', query['device_key'][0]
+    return 'token', query.get('token', [None])[0]
+
+
+def _authenticate(credentials, raspberry_slug):
+    scheme, key = credentials
+    if not key:
+        return CLOSE_UNAUTHORIZED
+    try:
+        if scheme == 'device':
+            device, _ = DeviceKeyAuthentication().authenticate_credentials(key)
+            # La clave de un dispositivo solo abre su propio canal
+            if device.raspberry_slug != raspberry_slug:
+                return CLOSE_UNAUTHORIZED
+        else:
+            CachedTokenAuthentication().authenticate_credentials(key)
+    except AuthenticationFailed:
+        return CLOSE_UNAUTHORIZED
+    if not catalog.raspberries.exists(raspberry_slug):
+        return CLOSE_NOT_FOUND
+    return None
+
+
+class CommandSocket:
+    """
+    Canal WebSocket por Raspberry Pi. El servidor empuja los comandos en cuanto
+    se crean y el dispositivo responde los acks por la misma conexión.
+
+    Mensajes servidor -> dispositivo:
+        {"type": "command", "id": 1, "command": "estado_sistema"}
+        {"type": "ack", "command_id": 1, "status": "success" | "not_found"}
+        {"type": "ping"}
+    Mensajes dispositivo -> servidor:
+        {"type": "ack", "command_id": 1, "result": "...", "success": true}
+        {"type": "pong"}
+    """
+
+    def __init__(self, scope, receive, send, raspberry_slug):
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.raspberry_slug = raspberry_slug
+
+    async def send_json(self, data):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(data)})
+
+    async def close(self, code):
+        await self.send({'type': 'websocket.close', 'code': code})
+
+    async def __call__(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+
+        error = await sync_to_async(_authenticate)(_get_credentials(self.scope), self.raspberry_slug)
+        if error:
+            await self.close(error)
+            return
+        await self.send({'type': 'websocket.accept'})
+
+        async with subscribe(self.raspberry_slug) as connection:
+            # Entregar primero lo que quedó pendiente mientras estaba desconectado
+            connection.event.set()
+            await self.serve(connection)
+
+    async def serve(self, connection):
+        loop = asyncio.get_running_loop()
+        heartbeat = getattr(settings, 'BOTBRAIN_PUSH_HEARTBEAT', 30)
+        last_seen = loop.time()
+        receive_task = wake_task = None
+        try:
+            while True:
+                if receive_task is None:
+                    receive_task = asyncio.ensure_future(self.receive())
+                if wake_task is None:
+                    wake_task = asyncio.ensure_future(connection.event.wait())
+
+                done, _ = await asyncio.wait(
+                    {receive_task, wake_task}, timeout=heartbeat, return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if loop.time() - last_seen > 2 * heartbeat:
+                        await self.close(CLOSE_HEARTBEAT_TIMEOUT)
+                        break
+                    # Lo que vuelve a 'pending' sin aviso (el reaper corre en
+                    # otro proceso) se revisa en cada latido, como el long polling
+                    if await History.objects.claimable(self.raspberry_slug).aexists():
+                        await self.dispatch(connection)
+                    await self.send_json({'type': 'ping'})
+                    continue
+
+                if wake_task in done:
+                    wake_task = None
+                    connection.event.clear()
+                    await self.dispatch(connection)
+
+                if receive_task in done:
+                    message = receive_task.result()
+                    receive_task = None
+                    if message['type'] == 'websocket.disconnect':
+                        break
+                    last_seen = loop.time()
+                    await self.handle(message)
+        finally:
+            for task in (receive_task, wake_task):
+                if task is not None:
+                    task.cancel()
+
+    async def dispatch(self, connection):
+        """Reclama y empuja todos los comandos listos del dispositivo"""
+        while True:
+            claimed = await sync_to_async(History.objects.claim)(self.raspberry_slug, limit=10)
+            for history_id, command_slug in claimed:
+                await self.send_json({'type': 'command', 'id': history_id, 'command': command_slug})
+            if len(claimed) < 10:
+                break
+
+        # Los comandos diferidos no generan aviso al vencer: programar el despertar
+        next_scheduled = await sync_to_async(History.objects.next_scheduled)(self.raspberry_slug)
+        if next_scheduled is not None:
+            connection.wake_later(max((next_scheduled - timezone.now()).total_seconds(), 0))
+
+    async def handle(self, message):
+        try:
+            data = json.loads(message.get('text') or '')
+        except ValueError:
+            data = None
+        # JSON válido que no es un objeto ([1, 2], "x", 3) tampoco es un mensaje
+        if not isinstance(data, dict):
+            logger.warning(f"Mensaje inválido de {self.raspberry_slug}")
+            return
+
+        if data.get('type') != 'ack':
+            return
+
+        command_id = data.get('command_id')
+        result = data.get('result')
+        success = data.get('success', True)
+        if not isinstance(command_id, int) or not isinstance(result, str) or not isinstance(success, bool):
+            await self.send_json({'type': 'ack', 'command_id': command_id, 'status': 'invalid'})
+            return
+
+        found = await sync_to_async(History.objects.acknowledge)(self.raspberry_slug, command_id, result, success)
+        await self.send_json({
+            'type': 'ack',
+            'command_id': command_id,
+            'status': 'success' if found else 'not_found'
+        })
+
+
+async def command_socket_application(scope, receive, send, raspberry_slug):
+    await CommandSocket(scope, receive, send, raspberry_slug)()
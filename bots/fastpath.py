@@ -0,0 +1,190 @@
+import json
+import re
+from collections.abc import Mapping
+from functools import lru_cache
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from rest_framework import serializers
+from rest_framework.exceptions import ParseError
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from .instrumentation import rendering
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Ruta rápida de get-command y ack-command: las rutas más usadas por la flota
+# responden cuerpos de forma fija, ya codificados, sin serializers de DRF
+
+
+def _default(value):
+    # Lo que orjson no sabe codificar (textos traducibles, Decimal...)
+    return DjangoJSONEncoder().default(value)
+
+
+def dumps(data):
+    """JSON compacto en bytes; con orjson si está instalado"""
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode()
+
+
+def loads(body):
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer que usa orjson si está disponible (errores de autenticación y similares)"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return dumps(data)
+
+
+class FastJSONParser(JSONParser):
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return loads(stream.read() if stream is not None else b'')
+        except ValueError as e:
+            raise ParseError(f'JSON parse error - {e}')
+
+
+class FirstRendererNegotiation(DefaultContentNegotiation):
+    """Sin negociar el formato de respuesta: siempre el primer renderer"""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+class DeviceJSONResponse(HttpResponse):
+    """
+    Respuesta JSON ya codificada, sin pasar por los renderers de DRF.
+    Conserva `data` para quien la inspecciona después (long polling, pruebas).
+    """
+
+    def __init__(self, data, body=None, status=200, **kwargs):
+        if body is None:
+            with rendering():
+                body = dumps(data)
+        super().__init__(body, content_type='application/json', status=status, **kwargs)
+        self.data = data
+
+
+NO_PENDING_COMMANDS = {'message': 'No pending commands'}
+RASPBERRY_NOT_FOUND = {'message': 'Raspberry not found'}
+COMMAND_NOT_FOUND = {'message': 'Command not found for this Raspberry Pi'}
+ACK_SUCCESS = {'status': 'success'}
+
+_BODIES = {
+    id(payload): dumps(payload)
+    for payload in (NO_PENDING_COMMANDS, RASPBERRY_NOT_FOUND, COMMAND_NOT_FOUND, ACK_SUCCESS)
+}
+
+
+def constant_response(payload, status=200):
+    """Respuesta para uno de los cuerpos fijos de este módulo"""
+    return DeviceJSONResponse(payload, body=_BODIES[id(payload)], status=status)
+
+
+@lru_cache(maxsize=1024)
+def _encoded_slug(command_slug):
+    return dumps(command_slug)
+
+
+def command_entry(history_id, command_slug):
+    """Bytes de {"id": ..., "command": ...}, con el slug codificado una sola vez"""
+    return b'{"id":%d,"command":%s}' % (history_id, _encoded_slug(command_slug))
+
+
+def commands_response(claimed, many):
+    """Respuesta de get-command para [(id, command_slug), ...]"""
+    with rendering():
+        entries = [command_entry(history_id, command_slug) for history_id, command_slug in claimed]
+        body = b'[' + b','.join(entries) + b']' if many else entries[0]
+    data = [{'id': history_id, 'command': command_slug} for history_id, command_slug in claimed]
+    return DeviceJSONResponse(data if many else data[0], body=body)
+
+
+# Mismas reglas y mensajes que AckCommandSerializer
+_decimal_suffix = re.compile(r'\.0*\s*$')
+_surrogates = re.compile(r'[\ud800-\udfff]')
+
+
+def _error(field_class, key):
+    return str(field_class.default_error_messages[key])
+
+
+def _validate_command_id(value):
+    if value is None:
+        return None, _error(serializers.Field, 'null')
+    if isinstance(value, str) and len(value) > serializers.IntegerField.MAX_STRING_LENGTH:
+        return None, _error(serializers.IntegerField, 'max_string_length')
+    try:
+        return int(_decimal_suffix.sub('', str(value))), None
+    except (ValueError, TypeError):
+        return None, _error(serializers.IntegerField, 'invalid')
+
+
+def _validate_result(value):
+    if value is None:
+        return None, _error(serializers.Field, 'null')
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None, _error(serializers.CharField, 'invalid')
+    value = str(value).strip()
+    if not value:
+        return None, _error(serializers.CharField, 'blank')
+    if '\x00' in value:
+        return None, 'Null characters are not allowed.'
+    surrogate = _surrogates.search(value)
+    if surrogate:
+        return None, f'Surrogate characters are not allowed: U+{ord(surrogate.group()):X}.'
+    return value, None
+
+
+def _validate_success(value):
+    if value is None:
+        return None, _error(serializers.Field, 'null')
+    try:
+        if value in serializers.BooleanField.TRUE_VALUES:
+            return True, None
+        if value in serializers.BooleanField.FALSE_VALUES:
+            return False, None
+    except TypeError:
+        pass
+    return None, _error(serializers.BooleanField, 'invalid')
+
+
+def parse_ack(data):
+    """
+    Valida a mano el cuerpo de ack-command. Devuelve
+    ((command_id, result, success), None) o (None, errores al estilo DRF).
+    """
+    if not isinstance(data, Mapping):
+        message = _error(serializers.Serializer, 'invalid').format(datatype=type(data).__name__)
+        return None, {'non_field_errors': [message]}
+
+    values, errors = {}, {}
+    for field, validate in (('command_id', _validate_command_id), ('result', _validate_result)):
+        if field not in data:
+            errors[field] = [_error(serializers.Field, 'required')]
+            continue
+        values[field], error = validate(data[field])
+        if error:
+            errors[field] = [error]
+    values['success'] = True
+    if 'success' in data:
+        values['success'], error = _validate_success(data['success'])
+        if error:
+            errors['success'] = [error]
+
+    if errors:
+        return None, errors
+    return (values['command_id'], values['result'], values['success']), None
@@ -0,0 +1,42 @@
+import base64
+import zlib
+
+from django.conf import settings
+from django.db import models
+
+# Marca de los valores comprimidos; el resto se guarda como texto plano
+COMPRESSED_PREFIX = 'zlib:'
+
+
+def compress_text(value):
+    return COMPRESSED_PREFIX + base64.b64encode(zlib.compress(value.encode(), 6)).decode('ascii')
+
+
+def decompress_text(value):
+    return zlib.decompress(base64.b64decode(value[len(COMPRESSED_PREFIX):])).decode()
+
+
+class CompressedTextField(models.TextField):
+    """
+    TextField que comprime con zlib los valores de más de
+    BOTBRAIN_RESULT_COMPRESS_THRESHOLD caracteres. La columna sigue siendo
+    texto (base64 tras la marca), así que no hace falta migrar el tipo y las
+    filas antiguas sin comprimir se leen igual.
+
+    No sirve para filtrar por contenido: las búsquedas ven el valor comprimido.
+    """
+
+    def from_db_value(self, value, expression, connection):
+        if value is not None and value.startswith(COMPRESSED_PREFIX):
+            return decompress_text(value)
+        return value
+
+    def get_prep_value(self, value):
+        value = super().get_prep_value(value)
+        if value is None:
+            return value
+        threshold = getattr(settings, 'BOTBRAIN_RESULT_COMPRESS_THRESHOLD', 1024)
+        # Un texto que ya empieza con la marca se comprime siempre para no confundirlo
+        if len(value) > threshold or value.startswith(COMPRESSED_PREFIX):
+            return compress_text(value)
+        return value
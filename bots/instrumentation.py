@@ -0,0 +1,237 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Estadísticas de la petición en curso; viaja a los hilos de sync_to_async
+_current_request = ContextVar('botbrain_request_stats', default=None)
+
+# Consultas que se guardan como máximo para el log de peticiones lentas
+SLOW_REQUEST_MAX_QUERIES = 50
+SLOW_REQUEST_MAX_SQL_LENGTH = 1000
+
+request_count = metrics.counter(
+    'botbrain_http_requests_total',
+    'Peticiones HTTP atendidas, por vista, método y código de respuesta',
+    ['view', 'method', 'status']
+)
+request_duration = metrics.histogram(
+    'botbrain_http_request_duration_seconds',
+    'Tiempo hasta tener la respuesta (en streaming, hasta los encabezados)',
+    ['view', 'method']
+)
+request_queries = metrics.histogram(
+    'botbrain_http_db_queries',
+    'Consultas SQL por petición',
+    ['view'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100)
+)
+request_db_duration = metrics.histogram(
+    'botbrain_http_db_duration_seconds',
+    'Tiempo en la base de datos por petición',
+    ['view']
+)
+request_serialize_duration = metrics.histogram(
+    'botbrain_http_serialize_duration_seconds',
+    'Tiempo en serializer.data (to_representation de los serializers de DRF) por petición',
+    ['view']
+)
+request_render_duration = metrics.histogram(
+    'botbrain_http_render_duration_seconds',
+    'Tiempo en codificar el cuerpo JSON por petición (renderer de DRF o ruta rápida)',
+    ['view']
+)
+response_size = metrics.histogram(
+    'botbrain_http_response_size_bytes',
+    'Tamaño del cuerpo de las respuestas que no son streaming',
+    ['view'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+)
+
+
+class RequestStats:
+    __slots__ = ('queries', 'db_time', 'serialize_time', 'serializing', 'render_time', 'sql')
+
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        # Un serializer.data dentro de otro (campos de método) no se cuenta dos veces
+        self.serializing = False
+        self.render_time = 0.0
+        # (segundos, sql) de cada consulta, solo con el log de lentas activo
+        self.sql = [] if capture_sql else None
+
+
+@contextmanager
+def request_stats():
+    """
+    Instala un RequestStats para lo que corra dentro y lo entrega. Si ya hay
+    uno (el load test envuelve la aplicación ASGI) se reutiliza ese, así
+    quien envuelve ve las mismas cuentas que RequestMetricsMiddleware
+    """
+    stats = _current_request.get()
+    if stats is not None:
+        yield stats
+        return
+    stats = RequestStats(capture_sql=_slow_request_threshold() > 0)
+    token = _current_request.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_request.reset(token)
+
+
+@contextmanager
+def rendering():
+    """Suma a la petición en curso el tiempo de codificar su cuerpo"""
+    stats = _current_request.get()
+    if stats is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats.render_time += time.perf_counter() - started
+
+
+def record_query(execute, sql, params, many, context):
+    """execute_wrapper que suma las consultas a la petición en curso"""
+    stats = _current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.sql is not None and len(stats.sql) < SLOW_REQUEST_MAX_QUERIES:
+            stats.sql.append((elapsed, sql[:SLOW_REQUEST_MAX_SQL_LENGTH]))
+
+
+def _attach(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def _timed_serializer_data(data):
+    """Envuelve BaseSerializer.data para sumar su tiempo a la petición en curso"""
+
+    def timed(serializer):
+        stats = _current_request.get()
+        # Ya calculado (_data) o anidado: no hay trabajo nuevo que medir
+        if stats is None or stats.serializing or hasattr(serializer, '_data'):
+            return data(serializer)
+        stats.serializing = True
+        started = time.perf_counter()
+        try:
+            return data(serializer)
+        finally:
+            stats.serialize_time += time.perf_counter() - started
+            stats.serializing = False
+
+    timed.botbrain_timed = True
+    return timed
+
+
+def install():
+    """
+    Agrega record_query a cada conexión que se abra y a las ya abiertas en
+    este hilo, y mide serializer.data: Serializer.data y ListSerializer.data
+    pasan por BaseSerializer.data. Fuera de una petición instrumentada no
+    hace nada
+    """
+    connection_created.connect(_on_connection_created, dispatch_uid='bots.instrumentation')
+    for connection in connections.all(initialized_only=True):
+        _attach(connection)
+    if not getattr(BaseSerializer.data.fget, 'botbrain_timed', False):
+        BaseSerializer.data = property(_timed_serializer_data(BaseSerializer.data.fget))
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    _attach(connection)
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer que suma a la petición en curso el tiempo de codificar"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with rendering():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+def _slow_request_threshold():
+    # En segundos; 0 desactiva el log de peticiones lentas
+    return getattr(settings, 'BOTBRAIN_SLOW_REQUEST_THRESHOLD', 0)
+
+
+class RequestMetricsMiddleware:
+    """
+    Mide cada petición: latencia, consultas SQL y su tiempo, tiempo en los
+    serializers y en codificar el JSON, y tamaño de la respuesta, por vista
+    (nombre de la URL).
+    Con BOTBRAIN_SLOW_REQUEST_THRESHOLD registra el SQL de las peticiones
+    que lo superan.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with request_stats() as stats:
+            response = self.get_response(request)
+        self.finish(request, response, stats, started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with request_stats() as stats:
+            response = await self.get_response(request)
+        self.finish(request, response, stats, started)
+        return response
+
+    def finish(self, request, response, stats, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unresolved'
+
+        request_count.inc(view=view, method=request.method, status=response.status_code)
+        request_duration.observe(elapsed, view=view, method=request.method)
+        request_queries.observe(stats.queries, view=view)
+        request_db_duration.observe(stats.db_time, view=view)
+        if stats.serialize_time:
+            request_serialize_duration.observe(stats.serialize_time, view=view)
+        if stats.render_time:
+            request_render_duration.observe(stats.render_time, view=view)
+        if not response.streaming:
+            response_size.observe(len(response.content), view=view)
+
+        threshold = _slow_request_threshold()
+        if threshold > 0 and elapsed >= threshold:
+            queries = ''.join(f'\n  {seconds * 1000:.1f} ms  {sql}' for seconds, sql in stats.sql)
+            logger.warning(
+                'Petición lenta %s %s (%s): %.3f s, %d consultas en %.3f s%s',
+                request.method, request.path, view, elapsed, stats.queries, stats.db_time, queries
+            )
@@ -0,0 +1,254 @@
+import json
+import math
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from .instrumentation import request_stats
+
+# Cliente del Raspberry Pi: el simulador usa su misma sesión y protocolo
+sys.path.insert(0, str(settings.BASE_DIR / 'robot'))
+from blueman import Bot  # noqa: E402
+
+OPERATIONS = ['poll', 'ack', 'create', 'list']
+DEFAULT_MIX = {'poll': 60, 'ack': 25, 'create': 10, 'list': 5}
+OPERATION_HEADER = 'X-Loadtest-Op'
+
+
+def parse_mix(value):
+    """'poll=60,ack=25,create=10,list=5' -> {'poll': 60, ...}"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in OPERATIONS:
+            raise ValueError(f'Operación desconocida: {name}')
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise ValueError('La mezcla necesita al menos un peso positivo')
+    return mix
+
+
+def percentile(values, fraction):
+    """Percentil por rango más cercano sobre una lista ordenada"""
+    if not values:
+        return None
+    index = max(math.ceil(fraction * len(values)) - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+
+def label_operations(app, query_counts):
+    """
+    Envuelve la aplicación ASGI para sumar en `query_counts` las consultas SQL
+    de cada petición, por operación. Las cuenta la instrumentación de
+    /metrics (ver bots.instrumentation.request_stats)
+    """
+    header = OPERATION_HEADER.lower().encode()
+
+    async def labelled(scope, receive, send):
+        operation = dict(scope.get('headers', [])).get(header)
+        if operation is None:
+            return await app(scope, receive, send)
+        with request_stats() as stats:
+            try:
+                await app(scope, receive, send)
+            finally:
+                query_counts[operation.decode()] += stats.queries
+
+    return labelled
+
+
+class LocalServer:
+    """Servidor uvicorn en un hilo, sobre conf.asgi, para medir sin desplegar"""
+
+    def __init__(self, app):
+        import uvicorn
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            self.port = probe.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host='127.0.0.1', port=self.port, log_level='warning', access_log=False, lifespan='off'
+        ))
+        self.thread = threading.Thread(target=self.server.run, name='loadtest-server', daemon=True)
+
+    @property
+    def url(self):
+        # 'localhost' siempre está en ALLOWED_HOSTS
+        return f'http://localhost:{self.port}/api/bot'
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while not self.server.started:
+            if time.monotonic() > deadline or not self.thread.is_alive():
+                raise RuntimeError('El servidor local no arrancó')
+            time.sleep(0.05)
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.should_exit = True
+        self.thread.join(10)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, operation, seconds, ok):
+        with self._lock:
+            self.latencies[operation].append(seconds)
+            if not ok:
+                self.errors[operation] += 1
+
+
+class SimulatedDevice:
+    """
+    Un Raspberry Pi simulado: reclama y reconoce comandos con el protocolo de
+    robot/blueman.py (misma sesión con keep-alive y mismos endpoints), sin
+    ejecutar nada. También actúa como operador para create y list.
+    """
+
+    def __init__(self, server_url, raspberry_slug, token, operator_token, command_slug, auth_scheme='Token', batch_size=10):
+        self.bot = Bot(
+            server_url=server_url, token=token, raspberry_id=raspberry_slug,
+            batch_size=batch_size, auth_scheme=auth_scheme, max_parallel=1, spool_path=':memory:'
+        )
+        self.server_url = server_url
+        self.raspberry_slug = raspberry_slug
+        self.command_slug = command_slug
+        self.operator_headers = {'Authorization': f'Token {operator_token}'}
+        self.claimed = []
+
+    def request(self, recorder, operation, method, url, expected, headers=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = self.bot.session.request(
+                method, url, headers={OPERATION_HEADER: operation, **(headers or {})}, timeout=30, **kwargs
+            )
+        except Exception:
+            recorder.record(operation, time.perf_counter() - started, False)
+            return None
+        recorder.record(operation, time.perf_counter() - started, response.status_code in expected)
+        return response
+
+    def poll(self, recorder):
+        response = self.request(
+            recorder, 'poll', 'GET', f'{self.server_url}/raspberries/{self.raspberry_slug}/get-command/',
+            expected=(200, 404), params={'limit': self.bot.batch_size}
+        )
+        if response is not None and response.status_code == 200:
+            self.claimed.extend(command['id'] for command in response.json())
+
+    def ack(self, recorder):
+        if not self.claimed:
+            # Nada que reconocer todavía: un dispositivo real volvería a consultar
+            return self.poll(recorder)
+        command_id = self.claimed.pop(0)
+        self.request(
+            recorder, 'ack', 'POST', f'{self.server_url}/raspberries/{self.raspberry_slug}/ack-command/',
+            expected=(200,), json={'command_id': command_id, 'result': 'ok', 'success': True}
+        )
+
+    def create(self, recorder):
+        self.request(
+            recorder, 'create', 'POST', f'{self.server_url}/history/', expected=(201,),
+            headers=self.operator_headers,
+            json={'raspberry_slug': self.raspberry_slug, 'command_slug': self.command_slug}
+        )
+
+    def list(self, recorder):
+        self.request(
+            recorder, 'list', 'GET', f'{self.server_url}/history/list/', expected=(200,),
+            headers=self.operator_headers, params={'raspberry': self.raspberry_slug}
+        )
+
+    def run(self, recorder, mix, deadline, seed):
+        rng = random.Random(seed)
+        operations = list(mix)
+        weights = [mix[operation] for operation in operations]
+        while time.monotonic() < deadline:
+            getattr(self, rng.choices(operations, weights)[0])(recorder)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load(devices, duration, mix, seed=0):
+    """
+    Corre cada SimulatedDevice en su hilo durante `duration` segundos.
+    Devuelve (recorder, segundos transcurridos).
+    """
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + duration
+    threads = [
+        threading.Thread(target=device.run, args=(recorder, mix, deadline, seed + index), daemon=True)
+        for index, device in enumerate(devices)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return recorder, time.monotonic() - started
+
+
+def build_report(recorder, elapsed, query_counts=None, config=None):
+    """Resumen en JSON comparable entre commits; latencias en milisegundos"""
+    operations = {}
+    total = errors = 0
+    for operation in OPERATIONS:
+        latencies = sorted(recorder.latencies.get(operation, []))
+        if not latencies:
+            continue
+        count = len(latencies)
+        total += count
+        errors += recorder.errors[operation]
+        queries = query_counts.get(operation, 0) if query_counts is not None else None
+        operations[operation] = {
+            'requests': count,
+            'errors': recorder.errors[operation],
+            'error_rate': round(recorder.errors[operation] / count, 4),
+            'throughput_rps': round(count / elapsed, 2),
+            'latency_ms': {
+                'mean': round(statistics.fmean(latencies) * 1000, 2),
+                'p50': round(percentile(latencies, 0.50) * 1000, 2),
+                'p95': round(percentile(latencies, 0.95) * 1000, 2),
+                'p99': round(percentile(latencies, 0.99) * 1000, 2),
+                'max': round(latencies[-1] * 1000, 2),
+            },
+            'db_queries': queries,
+            'db_queries_per_request': round(queries / count, 2) if queries is not None else None,
+        }
+    return {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'config': config or {},
+        'elapsed_s': round(elapsed, 3),
+        'totals': {
+            'requests': total,
+            'errors': errors,
+            'error_rate': round(errors / total, 4) if total else 0,
+            'throughput_rps': round(total / elapsed, 2) if elapsed else 0,
+        },
+        'operations': operations,
+    }
+
+
+def dump_report(report, stream):
+    stream.write(json.dumps(report, indent=2, sort_keys=True) + '\n')
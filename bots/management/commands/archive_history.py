@@ -0,0 +1,42 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from bots.archive import ARCHIVABLE_STATUSES, archive_history, get_archive_dir
+from bots.models import History
+
+
+class Command(BaseCommand):
+    help = (
+        'Archiva en archivos JSONL comprimidos (uno por día) los comandos terminados '
+        'más antiguos que la ventana de retención y los borra de History en lotes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'BOTBRAIN_HISTORY_RETENTION_DAYS', 30),
+            help='Días de historial que se conservan en la base'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'BOTBRAIN_ARCHIVE_BATCH_SIZE', 500),
+            help='Filas por transacción de borrado'
+        )
+        parser.add_argument('--dir', help='Directorio de archivo; por defecto BOTBRAIN_HISTORY_ARCHIVE_DIR')
+        parser.add_argument('--dry-run', action='store_true', help='Solo informa cuántas filas se archivarían')
+
+    def handle(self, *args, days, batch_size, dir, dry_run, **options):
+        if days < 0 or batch_size < 1:
+            raise CommandError('--days no puede ser negativo y --batch-size debe ser positivo')
+
+        before = timezone.now() - datetime.timedelta(days=days)
+        if dry_run:
+            pending = History.objects.filter(created_at__lt=before, status__in=ARCHIVABLE_STATUSES).count()
+            self.stdout.write(f'Se archivarían {pending} filas anteriores a {before:%Y-%m-%d %H:%M}')
+            return
+
+        archived = archive_history(before, batch_size=batch_size, directory=dir)
+        self.stdout.write(self.style.SUCCESS(
+            f'Archivadas {archived} filas anteriores a {before:%Y-%m-%d %H:%M} en {dir or get_archive_dir()}'
+        ))
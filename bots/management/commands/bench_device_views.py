@@ -0,0 +1,123 @@
+import json
+import time
+from unittest import mock
+
+from django.core.management.base import BaseCommand
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts.models import User
+from bots import catalog, fastpath
+from bots.models import History
+from bots.serializers import AckCommandSerializer, AckResponseSerializer, CommandResponseSerializer
+from bots.views import AckCommandView, PendingCommandView
+
+
+class SerializerPendingCommandView(PendingCommandView):
+    """get-command como era antes de la ruta rápida: serializers, Response y negociación"""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    content_negotiation_class = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS
+
+    def get(self, request, raspberry_slug):
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            limit = int(limit)
+        claimed = History.objects.claim(raspberry_slug, limit=limit or 1)
+        if limit is None:
+            history_id, command_slug = claimed[0]
+            serializer = CommandResponseSerializer({'id': history_id, 'command': command_slug})
+        else:
+            serializer = CommandResponseSerializer([
+                {'id': history_id, 'command': command_slug} for history_id, command_slug in claimed
+            ], many=True)
+        return Response(serializer.data)
+
+
+class SerializerAckCommandView(AckCommandView):
+    """ack-command como era antes de la ruta rápida"""
+    renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    parser_classes = api_settings.DEFAULT_PARSER_CLASSES
+    content_negotiation_class = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS
+
+    def post(self, request, raspberry_slug):
+        ack_serializer = AckCommandSerializer(data=request.data)
+        if not ack_serializer.is_valid():
+            return Response({'message': 'Invalid data', 'errors': ack_serializer.errors}, status=status.HTTP_400_BAD_REQUEST)
+        data = ack_serializer.validated_data
+        History.objects.acknowledge(raspberry_slug, data['command_id'], data['result'], data['success'])
+        return Response(AckResponseSerializer({'status': 'success'}).data)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el CPU por petición de get-command y ack-command con la ruta rápida '
+        'frente a las vistas con serializers de DRF. Sustituye la base de datos y la '
+        'autenticación por respuestas fijas para medir solo el trabajo del framework.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000, help='Peticiones por ruta y variante')
+        parser.add_argument('--batch', type=int, default=10, help='Comandos por respuesta con ?limit')
+
+    def handle(self, *args, iterations, batch, **options):
+        factory = APIRequestFactory()
+        user = User(username='bench', is_active=True)
+        ack_body = json.dumps({'command_id': 1, 'result': 'Linux raspberrypi 6.1.21-v8+ aarch64\n' * 4, 'success': True})
+
+        def get_command(query=''):
+            def build():
+                request = factory.get(f'/api/bot/raspberries/pi-1/get-command/{query}')
+                force_authenticate(request, user=user)
+                return request
+            return build
+
+        def ack_command():
+            request = factory.post('/api/bot/raspberries/pi-1/ack-command/', ack_body, content_type='application/json')
+            force_authenticate(request, user=user)
+            return request
+
+        routes = {
+            'get-command': (get_command(), SerializerPendingCommandView, PendingCommandView),
+            f'get-command?limit={batch}': (get_command(f'?limit={batch}'), SerializerPendingCommandView, PendingCommandView),
+            'ack-command': (ack_command, SerializerAckCommandView, AckCommandView),
+        }
+        claimed = [(index + 1, 'estado_sistema') for index in range(batch)]
+
+        def claim(raspberry_slug, limit=1):
+            return claimed[:limit]
+
+        report = {'orjson': fastpath.orjson is not None, 'iterations': iterations, 'routes': {}}
+        with mock.patch.object(History.objects, 'claim', side_effect=claim), \
+                mock.patch.object(History.objects, 'acknowledge', return_value=True), \
+                mock.patch.object(catalog.raspberries, 'exists', return_value=True):
+            for name, (build, baseline_class, fast_class) in routes.items():
+                baseline = self.measure(baseline_class.as_view(), build, iterations)
+                fast = self.measure(fast_class.as_view(), build, iterations)
+                report['routes'][name] = {
+                    'serializers_us': round(baseline, 1),
+                    'fast_path_us': round(fast, 1),
+                    'saved_us': round(baseline - fast, 1),
+                    'saved_pct': round((baseline - fast) / baseline * 100, 1),
+                }
+
+        self.stdout.write(json.dumps(report, indent=2))
+
+    def measure(self, view, build, iterations):
+        """Microsegundos de CPU por petición, incluido el render de la respuesta"""
+        for _ in range(min(iterations, 200)):
+            self.call(view, build())
+        requests = [build() for _ in range(iterations)]
+        started = time.process_time()
+        for request in requests:
+            self.call(view, request)
+        return (time.process_time() - started) / iterations * 1e6
+
+    def call(self, view, request):
+        response = view(request, raspberry_slug='pi-1')
+        assert response.status_code == 200, response.status_code
+        if hasattr(response, 'render'):
+            response.render()
+        return response
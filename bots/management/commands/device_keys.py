@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+
+from bots.authentication import make_device_key
+from bots.models import DeviceCredential, Raspberry
+
+
+class Command(BaseCommand):
+    help = (
+        'Emite las claves de dispositivo de los Raspberry Pi indicados (o de toda '
+        'la flota). Con --rotate invalida las claves anteriores en bloque.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('raspberry_slugs', nargs='*', help='Slugs a incluir; por defecto toda la flota')
+        parser.add_argument('--rotate', action='store_true', help='Incrementa la generación antes de emitir')
+
+    def handle(self, *args, raspberry_slugs, rotate, **options):
+        raspberries = Raspberry.objects.order_by('slug')
+        if raspberry_slugs:
+            raspberries = raspberries.filter(slug__in=raspberry_slugs)
+            missing = set(raspberry_slugs) - set(raspberries.values_list('slug', flat=True))
+            if missing:
+                raise CommandError(f'Raspberry no encontrado: {", ".join(sorted(missing))}')
+
+        slugs = list(raspberries.values_list('slug', flat=True))
+        with transaction.atomic():
+            existing = set(DeviceCredential.objects.filter(raspberry_id__in=slugs).values_list('raspberry_id', flat=True))
+            DeviceCredential.objects.bulk_create([
+                DeviceCredential(raspberry_id=slug) for slug in slugs if slug not in existing
+            ])
+            if rotate:
+                # Un solo UPDATE para toda la flota
+                DeviceCredential.objects.filter(raspberry_id__in=existing).update(generation=F('generation') + 1)
+
+        credentials = DeviceCredential.objects.filter(raspberry_id__in=slugs).order_by('raspberry_id')
+        for raspberry_slug, generation in credentials.values_list('raspberry_id', 'generation'):
+            self.stdout.write(f'{raspberry_slug}\t{make_device_key(raspberry_slug, generation)}')
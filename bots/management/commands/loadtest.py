@@ -0,0 +1,132 @@
+import logging
+import os
+import secrets
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from bots import loadtest
+from bots.authentication import make_device_key
+from bots.models import Command as BotCommand, DeviceCredential, History, Raspberry
+
+
+class Command(BaseCommand):
+    help = (
+        'Simula una flota de Raspberry Pi contra el servidor (por defecto uno local en '
+        'proceso) y reporta latencias p50/p95/p99, throughput, consultas SQL y tasa de '
+        'errores por operación, en JSON. Crea sus propios dispositivos y usuario en la '
+        'base por defecto y al terminar borra solo lo que creó.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=20, help='Dispositivos simulados (un hilo cada uno)')
+        parser.add_argument('--duration', type=float, default=30, help='Segundos de carga')
+        parser.add_argument(
+            '--mix', default='poll=60,ack=25,create=10,list=5',
+            help='Pesos de las operaciones poll, ack, create y list'
+        )
+        parser.add_argument('--backlog', type=int, default=5, help='Comandos pendientes por dispositivo al empezar')
+        parser.add_argument(
+            '--url', help='API de un servidor ya corriendo (p. ej. http://host:8080/api/bot). '
+            'Los datos de prueba se crean en la base de este proceso, así que ese servidor '
+            'debe usar la misma base. Sin --url se levanta uno local y se cuentan sus consultas'
+        )
+        parser.add_argument('--device-keys', action='store_true', help='Autenticar los dispositivos con su clave propia')
+        parser.add_argument('--seed', type=int, default=0, help='Semilla de la mezcla de operaciones')
+        parser.add_argument('--output', help='Archivo donde escribir el reporte; por defecto la salida estándar')
+        parser.add_argument('--keep', action='store_true', help='No borrar los datos de prueba al terminar')
+        parser.add_argument(
+            '--allow-live-database', action='store_true',
+            help='Permitir correr contra una base que no es de pruebas (su nombre no empieza con test_)'
+        )
+
+    def handle(self, *args, devices, duration, mix, backlog, url, device_keys, seed, output, keep,
+               allow_live_database, **options):
+        try:
+            weights = loadtest.parse_mix(mix)
+        except ValueError as e:
+            raise CommandError(str(e))
+        if devices < 1 or duration <= 0:
+            raise CommandError('--devices y --duration deben ser positivos')
+        database = str(connection.settings_dict['NAME'])
+        if not os.path.basename(database).startswith('test_') and not allow_live_database:
+            raise CommandError(
+                f'La base {database} no parece de pruebas: el load test escribe en ella. '
+                'Usar --allow-live-database para correrlo igualmente.'
+            )
+
+        # Nombres propios de esta corrida: nunca toca filas que ya existían
+        prefix = f'loadtest-{secrets.token_hex(4)}'
+        slugs = [f'{prefix}-{index}' for index in range(devices)]
+        created, token = self.setup_fleet(prefix, slugs, backlog)
+        config = {
+            'devices': devices, 'duration_s': duration, 'mix': weights, 'backlog': backlog,
+            'server': url or 'local', 'device_keys': device_keys, 'seed': seed,
+        }
+        try:
+            if url:
+                recorder, elapsed = self.run(url, slugs, token, device_keys, weights, duration, seed)
+                report = loadtest.build_report(recorder, elapsed, config=config)
+            else:
+                from conf.asgi import application
+
+                query_counts = Counter()
+                with loadtest.LocalServer(loadtest.label_operations(application, query_counts)) as server:
+                    recorder, elapsed = self.run(server.url, slugs, token, device_keys, weights, duration, seed)
+                report = loadtest.build_report(recorder, elapsed, query_counts=query_counts, config=config)
+        finally:
+            if keep:
+                self.stderr.write(f'Datos de prueba conservados con el prefijo {prefix}')
+            else:
+                self.cleanup(created)
+
+        if output:
+            with open(output, 'w') as stream:
+                loadtest.dump_report(report, stream)
+            self.stderr.write(f'Reporte escrito en {output}')
+        else:
+            loadtest.dump_report(report, self.stdout)
+
+    def setup_fleet(self, prefix, slugs, backlog):
+        """Crea los dispositivos, sus credenciales y comandos, y un operador con token"""
+        # Si algo falla a mitad no quedan datos sueltos
+        with transaction.atomic():
+            command, command_created = BotCommand.objects.get_or_create(
+                slug='estado_sistema', defaults={'name': 'Estado del sistema'}
+            )
+            Raspberry.objects.bulk_create([Raspberry(name=f'Loadtest {slug}', slug=slug) for slug in slugs])
+            DeviceCredential.objects.bulk_create([DeviceCredential(raspberry_id=slug) for slug in slugs])
+            for slug in slugs:
+                for _ in range(backlog):
+                    History.objects.create(raspberry_id=slug, command=command)
+
+            user = User.objects.create(username=prefix, email=f'{prefix}@example.com')
+            token = Token.objects.create(user=user)
+        created = {'slugs': slugs, 'user': user, 'command': command if command_created else None}
+        return created, token.key
+
+    def run(self, url, slugs, token, device_keys, weights, duration, seed):
+        credentials = dict(DeviceCredential.objects.filter(raspberry_id__in=slugs).values_list('raspberry_id', 'generation'))
+        fleet = [
+            loadtest.SimulatedDevice(
+                url, slug,
+                token=make_device_key(slug, credentials[slug]) if device_keys else token,
+                operator_token=token, command_slug='estado_sistema',
+                auth_scheme='Device' if device_keys else 'Token'
+            )
+            for slug in slugs
+        ]
+        logging.getLogger('blueman').setLevel(logging.WARNING)
+        self.stderr.write(f'{len(fleet)} dispositivos contra {url} durante {duration} s...')
+        return loadtest.run_load(fleet, duration, weights, seed=seed)
+
+    def cleanup(self, created):
+        # Solo lo creado por esta corrida; el borrado en cascada y las señales
+        # ajustan History y los contadores
+        Raspberry.objects.filter(slug__in=created['slugs']).delete()
+        created['user'].delete()
+        if created['command'] is not None:
+            created['command'].delete()
@@ -0,0 +1,44 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from bots import metrics
+from bots.models import History
+
+
+class Command(BaseCommand):
+    help = (
+        "Devuelve a la cola los comandos 'sent' cuyo timeout venció sin ack, o los "
+        "marca 'timed_out' si agotaron sus intentos. Con --loop se queda corriendo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Repite cada --interval segundos')
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'BOTBRAIN_REAPER_INTERVAL', 30),
+            help='Segundos entre pasadas con --loop'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'BOTBRAIN_REAPER_BATCH_SIZE', 500),
+            help='Filas por transacción'
+        )
+        parser.add_argument(
+            '--metrics-file', default=getattr(settings, 'BOTBRAIN_REAPER_METRICS_FILE', ''),
+            help='Tras cada pasada escribe aquí botbrain_reaped_commands_total (textfile collector de node_exporter)'
+        )
+
+    def handle(self, *args, loop, interval, batch_size, metrics_file, **options):
+        while True:
+            reaped = History.objects.reap(batch_size=batch_size)
+            if metrics_file:
+                metrics.write_textfile(metrics_file, {metrics.reaped_commands.name: metrics.reaped_commands})
+            for (command_slug, outcome), count in sorted(reaped.items()):
+                if count:
+                    self.stdout.write(f'{command_slug}\t{outcome}\t{count}')
+            if not loop:
+                requeued = sum(count for (_, outcome), count in reaped.items() if outcome == 'requeued')
+                timed_out = sum(count for (_, outcome), count in reaped.items() if outcome == 'timed_out')
+                self.stdout.write(self.style.SUCCESS(f'Reencolados: {requeued}, timed_out: {timed_out}'))
+                return
+            time.sleep(interval)
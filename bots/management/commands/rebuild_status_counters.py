@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from bots.models import StatusCounter
+
+
+class Command(BaseCommand):
+    help = 'Reconstruye desde cero los contadores de estado a partir de History'
+
+    def handle(self, *args, **options):
+        StatusCounter.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Contadores reconstruidos: {StatusCounter.objects.count()} filas'
+        ))
@@ -0,0 +1,179 @@
+import math
+import os
+import tempfile
+import threading
+from collections import defaultdict
+
+# Métricas registradas en este proceso, por nombre. Cada worker tiene las
+# suyas: Prometheus las suma al consultar /metrics de todos
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+# Límites por defecto de los histogramas de latencia, en segundos
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class MetricCounter:
+    """Contador monotónico con etiquetas, seguro entre hilos y en proceso"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = defaultdict(float)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            self._values[self._key(labels)] += amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        """Lista de (etiquetas, valor) ordenada por etiquetas"""
+        with self._lock:
+            return [(dict(zip(self.labelnames, key)), value) for key, value in sorted(self._values.items())]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class MetricHistogram:
+    """Histograma con etiquetas y límites fijos, al estilo de Prometheus"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # Por etiquetas: [conteos por límite (no acumulados), suma, total]
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(label, '')) for label in self.labelnames)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            if key not in self._values:
+                self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            entry = self._values[key]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            return entry[2] if entry else 0
+
+    def samples(self):
+        """Lista de (etiquetas, [(límite, acumulado)...], suma, total) ordenada por etiquetas"""
+        with self._lock:
+            samples = []
+            for key, (counts, total_sum, total) in sorted(self._values.items()):
+                cumulative, running = [], 0
+                for bound, count in zip(self.buckets, counts):
+                    running += count
+                    cumulative.append((bound, running))
+                cumulative.append((math.inf, total))
+                samples.append((dict(zip(self.labelnames, key)), cumulative, total_sum, total))
+            return samples
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+def _register(cls, name, *args):
+    with _registry_lock:
+        if name not in REGISTRY:
+            REGISTRY[name] = cls(name, *args)
+        return REGISTRY[name]
+
+
+def counter(name, documentation, labelnames=()):
+    """Devuelve el contador `name`, creándolo la primera vez"""
+    return _register(MetricCounter, name, documentation, labelnames)
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    """Devuelve el histograma `name`, creándolo la primera vez"""
+    return _register(MetricHistogram, name, documentation, labelnames, buckets)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def render_prometheus(registry=None):
+    """Todas las métricas en el formato de texto de Prometheus (0.0.4)"""
+    registry = REGISTRY if registry is None else registry
+    lines = []
+    for name in sorted(registry):
+        metric = registry[name]
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.type}')
+        if metric.type == 'counter':
+            for labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+            continue
+        for labels, buckets, total_sum, total in metric.samples():
+            for bound, count in buckets:
+                lines.append(f'{name}_bucket{_format_labels({**labels, "le": _format_value(bound)})} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(total_sum)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {total}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, registry=None):
+    """
+    Escribe las métricas en `path` para el textfile collector de
+    node_exporter; los procesos sin /metrics (el reaper) se exportan así.
+    Reemplaza el archivo de una vez para que nunca se lea a medias
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.botbrain-metrics-')
+    try:
+        with os.fdopen(fd, 'w') as tmp:
+            tmp.write(render_prometheus(registry))
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+reaped_commands = counter(
+    'botbrain_reaped_commands_total',
+    'Comandos enviados sin ack que el reaper devolvió a la cola o marcó como timed_out',
+    ['command', 'outcome']
+)
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 15:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0002_remove_command_comm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['raspberry', 'status', 'created_at'], name='history_claim_idx'),
+        ),
+    ]
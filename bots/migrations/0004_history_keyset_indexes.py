@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0003_history_claim_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['created_at', 'id'], name='history_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['raspberry', 'created_at', 'id'], name='history_raspberry_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['command', 'created_at', 'id'], name='history_command_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['status', 'created_at', 'id'], name='history_status_created_idx'),
+        ),
+    ]
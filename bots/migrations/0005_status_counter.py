@@ -0,0 +1,45 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+def build_counters(apps, schema_editor):
+    History = apps.get_model('bots', 'History')
+    StatusCounter = apps.get_model('bots', 'StatusCounter')
+    rows = (
+        History.objects.order_by()
+        .values('raspberry_id', 'command_id', 'status')
+        .annotate(total=models.Count('id'))
+    )
+    StatusCounter.objects.bulk_create([
+        StatusCounter(
+            raspberry_slug=row['raspberry_id'], command_slug=row['command_id'],
+            status=row['status'], count=row['total']
+        )
+        for row in rows.iterator()
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0004_history_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('raspberry_slug', models.CharField(max_length=80)),
+                ('command_slug', models.CharField(max_length=80)),
+                ('status', models.CharField(max_length=30)),
+                ('count', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('raspberry_slug', 'command_slug', 'status'), name='status_counter_unique')],
+            },
+        ),
+        migrations.RunPython(build_counters, migrations.RunPython.noop),
+    ]
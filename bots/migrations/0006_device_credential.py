@@ -0,0 +1,25 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0005_status_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeviceCredential',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('generation', models.PositiveIntegerField(default=1)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('raspberry', models.OneToOneField(db_column='raspberry_slug', on_delete=django.db.models.deletion.CASCADE, related_name='credential', to='bots.raspberry', to_field='slug')),
+            ],
+        ),
+    ]
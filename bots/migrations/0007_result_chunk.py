@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0006_device_credential'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveIntegerField()),
+                ('stream', models.CharField(choices=[('stdout', 'stdout'), ('stderr', 'stderr')], default='stdout', max_length=6)),
+                ('data', models.TextField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('history', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='bots.history')),
+            ],
+            options={
+                'ordering': ['history', 'seq'],
+                'constraints': [models.UniqueConstraint(fields=('history', 'seq'), name='result_chunk_unique')],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:24
+
+import bots.fields
+from django.db import migrations, models
+
+
+def store_existing_results(apps, schema_editor):
+    # Reescribir los resultados existentes los comprime si superan el umbral;
+    # no se recortan para no perder datos. Por rangos de id: cada lote se lee
+    # completo antes de escribirlo, sin un cursor abierto sobre la misma tabla
+    History = apps.get_model('bots', 'History')
+    last_id = 0
+    while True:
+        batch = list(
+            History.objects.filter(id__gt=last_id).exclude(result=None)
+            .order_by('id').only('id', 'result')[:500]
+        )
+        if not batch:
+            break
+        for history in batch:
+            history.result_size = len(history.result)
+        History.objects.bulk_update(batch, ['result', 'result_size'])
+        last_id = batch[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0007_result_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='result_size',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='result_truncated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AlterField(
+            model_name='history',
+            name='result',
+            field=bots.fields.CompressedTextField(blank=True, null=True),
+        ),
+        migrations.RunPython(store_existing_results, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0008_history_result_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='command',
+            name='max_attempts',
+            field=models.PositiveSmallIntegerField(default=3),
+        ),
+        migrations.AddField(
+            model_name='command',
+            name='timeout',
+            field=models.PositiveIntegerField(default=600),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['status', 'updated_at'], name='history_reap_idx'),
+        ),
+    ]
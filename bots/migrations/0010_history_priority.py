@@ -0,0 +1,31 @@
+# Generated by Django 5.2.7 on 2026-10-18 16:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0009_command_timeouts'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='history',
+            name='history_claim_idx',
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='not_before',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='history',
+            name='priority',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['raspberry', 'status', '-priority', 'not_before', 'created_at'], name='history_claim_idx'),
+        ),
+    ]
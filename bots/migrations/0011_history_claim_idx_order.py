@@ -0,0 +1,21 @@
+# Generated by Django 5.2.7 on 2026-10-18 17:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bots', '0010_history_priority'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='history',
+            name='history_claim_idx',
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['raspberry', 'status', '-priority', 'created_at', 'id'], name='history_claim_idx'),
+        ),
+    ]
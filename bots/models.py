@@ -1,8 +1,24 @@
-from django.db import models
+import datetime
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import IntegrityError, connection, connections, models, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from . import metrics
+from .fields import CompressedTextField
+
+# Estados que deja un ack: repetirlo no vuelve a escribir la fila
+ACKNOWLEDGED_STATUSES = ('executed', 'failed')
 
 class Command(models.Model):
 	name = models.CharField(max_length=80)
 	slug = models.CharField(max_length=80, unique=True)
+	# Segundos que un comando puede quedar 'sent' sin ack antes de que el
+	# reaper lo devuelva a la cola (0 desactiva), y veces que se reintenta
+	timeout = models.PositiveIntegerField(default=600)
+	max_attempts = models.PositiveSmallIntegerField(default=3)
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
@@ -25,16 +41,390 @@ class Raspberry(models.Model):
 	class Meta:
 		ordering = ['name']
 		
+class DeviceCredential(models.Model):
+	"""
+	Credencial propia de un Raspberry Pi, independiente de las cuentas de
+	usuario. La clave se deriva por HMAC del slug y la generación (ver
+	bots.authentication); rotar es incrementar la generación.
+	"""
+	raspberry = models.OneToOneField(Raspberry, on_delete=models.CASCADE, to_field='slug', db_column='raspberry_slug', related_name='credential')
+	generation = models.PositiveIntegerField(default=1)
+	is_active = models.BooleanField(default=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return f"{self.raspberry_id} - gen {self.generation}"
+
+
+class HistoryQuerySet(models.QuerySet):
+	def ready(self, now=None):
+		"""Comandos pendientes cuyo not_before ya pasó (o no tienen)"""
+		now = now or timezone.now()
+		return self.filter(Q(not_before__isnull=True) | Q(not_before__lte=now), status='pending')
+
+	def claimable(self, raspberry_slug, now=None):
+		"""
+		Comandos listos de un Raspberry Pi en orden de reclamo: prioridad,
+		luego antigüedad. El orden coincide con history_claim_idx.
+		"""
+		return self.ready(now).filter(raspberry_id=raspberry_slug).order_by('-priority', 'created_at', 'id')
+
+	def next_scheduled(self, raspberry_slug, now=None):
+		"""Próximo not_before futuro de un Raspberry Pi, o None"""
+		now = now or timezone.now()
+		return (
+			self.filter(raspberry_id=raspberry_slug, status='pending', not_before__gt=now)
+			.order_by('not_before').values_list('not_before', flat=True).first()
+		)
+
+	def claim(self, raspberry_slug, limit=1):
+		"""
+		Reclama atómicamente hasta `limit` comandos listos de un Raspberry Pi,
+		marcándolos como enviados. Devuelve una lista de (id, command_slug).
+		"""
+		pending = self.claimable(raspberry_slug)
+
+		if connection.features.has_select_for_update_skip_locked:
+			# Otros workers saltan las filas bloqueadas en lugar de esperar
+			with transaction.atomic():
+				rows = list(pending.select_for_update(skip_locked=True).values_list('id', 'command_id')[:limit])
+				if rows:
+					self.filter(id__in=[row[0] for row in rows]).update(
+						status='sent', attempts=F('attempts') + 1, updated_at=timezone.now()
+					)
+					StatusCounter.objects.adjust(_transitions(raspberry_slug, rows, 'pending', 'sent'))
+			return rows
+
+		# UPDATE condicional: solo gana quien cambia el estado de 'pending' a 'sent'
+		claimed = []
+		while len(claimed) < limit:
+			candidates = list(pending.values_list('id', 'command_id')[:limit - len(claimed)])
+			if not candidates:
+				break
+			for history_id, command_slug in candidates:
+				won = self.filter(id=history_id, status='pending').update(
+					status='sent', attempts=F('attempts') + 1, updated_at=timezone.now()
+				)
+				if won:
+					claimed.append((history_id, command_slug))
+		if claimed:
+			StatusCounter.objects.adjust(_transitions(raspberry_slug, claimed, 'pending', 'sent'))
+		return claimed
+
+	def acknowledge(self, raspberry_slug, command_id, result, success=True):
+		"""
+		Marca como ejecutado (o fallido) un comando del Raspberry Pi.
+		Devuelve False si el comando no pertenece a ese dispositivo. Un ack
+		repetido de un comando ya terminado (reenvío del spool del bot) no
+		cambia nada.
+		"""
+		new_status = 'executed' if success else 'failed'
+		result, result_size, result_truncated = cap_result(result)
+		while True:
+			row = self.filter(id=command_id, raspberry_id=raspberry_slug).values_list('command_id', 'status').first()
+			if row is None:
+				return False
+			command_slug, previous = row
+			if previous in ACKNOWLEDGED_STATUSES:
+				return True
+			# Condicionado al estado leído para que los contadores no se desvíen;
+			# el UPDATE y el ajuste de contadores se confirman juntos
+			with transaction.atomic():
+				updated = self.filter(id=command_id, status=previous).update(
+					status=new_status, result=result, result_size=result_size,
+					result_truncated=result_truncated, updated_at=timezone.now()
+				)
+				if updated:
+					StatusCounter.objects.adjust({
+						(raspberry_slug, command_slug, previous): -1,
+						(raspberry_slug, command_slug, new_status): 1,
+					})
+			if updated:
+				return True
+
+	def acknowledge_many(self, raspberry_slug, results):
+		"""
+		Marca como ejecutados varios comandos del Raspberry Pi en una sola
+		transacción. `results` es un dict {command_id: (result, success)}.
+		Devuelve los ids que pertenecían al dispositivo; los ya terminados
+		cuentan como reconocidos pero no se reescriben.
+		"""
+		now = timezone.now()
+		changes = Counter()
+		with transaction.atomic():
+			histories = list(
+				self.select_for_update()
+				.filter(id__in=results, raspberry_id=raspberry_slug)
+				.only('id', 'command_id', 'status')
+			)
+			acknowledged = [history.id for history in histories]
+			histories = [history for history in histories if history.status not in ACKNOWLEDGED_STATUSES]
+			for history in histories:
+				result, success = results[history.id]
+				new_status = 'executed' if success else 'failed'
+				changes[(raspberry_slug, history.command_id, history.status)] -= 1
+				changes[(raspberry_slug, history.command_id, new_status)] += 1
+				history.status = new_status
+				history.result, history.result_size, history.result_truncated = cap_result(result)
+				history.updated_at = now
+			self.bulk_update(histories, ['status', 'result', 'result_size', 'result_truncated', 'updated_at'])
+			StatusCounter.objects.adjust(changes)
+		return acknowledged
+
+	def reap(self, now=None, batch_size=500):
+		"""
+		Busca los comandos 'sent' cuyo Command.timeout venció sin ack. Los que
+		no agotaron Command.max_attempts vuelven a 'pending'; el resto pasa a
+		'timed_out'. Devuelve un Counter {(command_slug, 'requeued' | 'timed_out'): n}.
+		"""
+		now = now or timezone.now()
+		reaped = Counter()
+		for command_slug, timeout, max_attempts in Command.objects.values_list('slug', 'timeout', 'max_attempts'):
+			if not timeout:
+				continue
+			# Recorre history_reap_idx (status, updated_at)
+			expired = self.filter(
+				status='sent', updated_at__lt=now - datetime.timedelta(seconds=timeout), command_id=command_slug
+			).order_by('updated_at', 'id')
+			while True:
+				with transaction.atomic():
+					if connection.features.has_select_for_update_skip_locked:
+						rows = list(expired.select_for_update(skip_locked=True).values_list('id', 'raspberry_id', 'attempts')[:batch_size])
+					else:
+						rows = list(expired.values_list('id', 'raspberry_id', 'attempts')[:batch_size])
+					if not rows:
+						break
+
+					changes = Counter()
+					message = f'Sin ack tras {max_attempts} intentos'
+					for outcome, new_status, fields in (
+						('requeued', 'pending', {}),
+						('timed_out', 'timed_out', {'result': message, 'result_size': len(message), 'result_truncated': False}),
+					):
+						batch = [row for row in rows if (row[2] < max_attempts) == (outcome == 'requeued')]
+						if not batch:
+							continue
+						if connection.features.has_select_for_update_skip_locked:
+							self.filter(id__in=[row[0] for row in batch]).update(status=new_status, updated_at=now, **fields)
+							changed = batch
+						else:
+							# UPDATE condicional por fila: un ack concurrente gana
+							changed = [
+								row for row in batch
+								if self.filter(id=row[0], status='sent').update(status=new_status, updated_at=now, **fields)
+							]
+						for _, raspberry_slug, _ in changed:
+							changes[(raspberry_slug, command_slug, 'sent')] -= 1
+							changes[(raspberry_slug, command_slug, new_status)] += 1
+						reaped[(command_slug, outcome)] += len(changed)
+					StatusCounter.objects.adjust(changes)
+
+		for (command_slug, outcome), count in reaped.items():
+			if count:
+				metrics.reaped_commands.inc(count, command=command_slug, outcome=outcome)
+		return reaped
+
+	def prune(self, ids):
+		"""
+		Borra las filas `ids` y su salida sin emitir una señal por fila; los
+		contadores se ajustan con un UPDATE por grupo. Devuelve cuántas se
+		borraron.
+		"""
+		ids = list(ids)
+		database = connections[self.db]
+		table = database.ops.quote_name(self.model._meta.db_table)
+		deleted = 0
+		with transaction.atomic(using=self.db):
+			rows = list(self.filter(id__in=ids).values_list('raspberry_id', 'command_id', 'status'))
+			changes = Counter()
+			for key in rows:
+				changes[key] -= 1
+			ResultChunk.objects.filter(history_id__in=ids).delete()
+			# DELETE directo: History tiene receptores de post_delete, así que
+			# delete() cargaría cada fila para emitirlos. En lotes para no pasar
+			# el límite de parámetros de SQLite
+			with database.cursor() as cursor:
+				for start in range(0, len(ids), 500):
+					batch = ids[start:start + 500]
+					placeholders = ', '.join(['%s'] * len(batch))
+					cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', batch)
+					deleted += cursor.rowcount
+			StatusCounter.objects.adjust(changes)
+		return deleted
+
+
+def cap_result(result):
+	"""
+	Recorta `result` a BOTBRAIN_RESULT_MAX_SIZE caracteres conservando el
+	principio y el final, con una marca en medio. Devuelve
+	(texto, tamaño original, recortado).
+	"""
+	if result is None:
+		return None, None, False
+	size = len(result)
+	max_size = getattr(settings, 'BOTBRAIN_RESULT_MAX_SIZE', 262144)
+	if not max_size or size <= max_size:
+		return result, size, False
+	marker = f'\n[... recortado: {size} caracteres en total ...]\n'
+	kept = max(max_size - len(marker), 0)
+	head = kept // 2
+	return result[:head] + marker + result[size - (kept - head):], size, True
+
+
+def _transitions(raspberry_slug, rows, old_status, new_status):
+	changes = Counter()
+	for _, command_slug in rows:
+		changes[(raspberry_slug, command_slug, old_status)] -= 1
+		changes[(raspberry_slug, command_slug, new_status)] += 1
+	return changes
+
+
 class History(models.Model):
 	raspberry = models.ForeignKey(Raspberry, on_delete=models.CASCADE, to_field='slug', db_column='raspberry_slug')
 	command = models.ForeignKey(Command, on_delete=models.CASCADE, to_field='slug', db_column='command_slug')
 	status = models.CharField(max_length=30, default='pending')
-	result = models.TextField(null=True, blank=True)
+	# Comprimido si es largo y recortado a BOTBRAIN_RESULT_MAX_SIZE (ver cap_result)
+	result = CompressedTextField(null=True, blank=True)
+	result_size = models.PositiveIntegerField(null=True, blank=True)
+	result_truncated = models.BooleanField(default=False)
+	# Veces que un dispositivo reclamó el comando (ver HistoryQuerySet.reap)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	# Mayor prioridad se reclama antes; not_before difiere el comando hasta esa hora
+	priority = models.SmallIntegerField(default=0)
+	not_before = models.DateTimeField(null=True, blank=True)
 	created_at = models.DateTimeField(auto_now_add=True)
 	updated_at = models.DateTimeField(auto_now=True)
 
+	objects = HistoryQuerySet.as_manager()
+
 	def __str__(self):
 		return self.raspberry.slug + " - " + self.created_at.strftime("%m/%d/%Y %H:%M:%S")
 
+	def save(self, *args, **kwargs):
+		result, result_size, result_truncated = cap_result(self.result)
+		# Un resultado ya recortado cabe en el límite: no perder su tamaño original
+		if result_truncated or not self.result_truncated:
+			self.result, self.result_size, self.result_truncated = result, result_size, result_truncated
+		update_fields = kwargs.get('update_fields')
+		if update_fields is not None and 'result' in update_fields:
+			kwargs['update_fields'] = {*update_fields, 'result_size', 'result_truncated'}
+		super().save(*args, **kwargs)
+
 	class Meta:
-		ordering = ['created_at']
\ No newline at end of file
+		ordering = ['created_at']
+		indexes = [
+			# Respalda la consulta de reclamo (HistoryQuerySet.claimable): mismo
+			# orden que su ORDER BY; not_before se filtra al recorrerlo
+			models.Index(fields=['raspberry', 'status', '-priority', 'created_at', 'id'], name='history_claim_idx'),
+			# Paginación por cursor de HistoryListView, con y sin filtros
+			models.Index(fields=['created_at', 'id'], name='history_created_idx'),
+			models.Index(fields=['raspberry', 'created_at', 'id'], name='history_raspberry_created_idx'),
+			models.Index(fields=['command', 'created_at', 'id'], name='history_command_created_idx'),
+			models.Index(fields=['status', 'created_at', 'id'], name='history_status_created_idx'),
+			# Comandos 'sent' vencidos que busca el reaper
+			models.Index(fields=['status', 'updated_at'], name='history_reap_idx'),
+		]
+
+
+class ResultChunk(models.Model):
+	"""
+	Trozo de la salida de un comando, enviado por el Raspberry Pi mientras el
+	comando corre. `seq` ordena los trozos y hace idempotente el reenvío.
+	"""
+	STREAM_CHOICES = [('stdout', 'stdout'), ('stderr', 'stderr')]
+
+	history = models.ForeignKey(History, on_delete=models.CASCADE, related_name='chunks')
+	seq = models.PositiveIntegerField()
+	stream = models.CharField(max_length=6, choices=STREAM_CHOICES, default='stdout')
+	data = models.TextField()
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		return f"{self.history_id} - {self.seq} ({self.stream})"
+
+	class Meta:
+		ordering = ['history', 'seq']
+		constraints = [
+			models.UniqueConstraint(fields=['history', 'seq'], name='result_chunk_unique'),
+		]
+
+
+class StatusCounterQuerySet(models.QuerySet):
+	def adjust(self, changes):
+		"""
+		Aplica deltas {(raspberry_slug, command_slug, status): delta} con un
+		UPDATE por grupo (comando, estado, delta), sin importar cuántos
+		dispositivos incluya.
+		"""
+		groups = defaultdict(list)
+		for (raspberry_slug, command_slug, status), delta in changes.items():
+			if delta:
+				groups[(command_slug, status, delta)].append(raspberry_slug)
+
+		now = timezone.now()
+		for (command_slug, status, delta), raspberry_slugs in groups.items():
+			counters = self.filter(command_slug=command_slug, status=status, raspberry_slug__in=raspberry_slugs)
+			updated = counters.update(count=F('count') + delta, updated_at=now)
+			if updated == len(raspberry_slugs):
+				continue
+
+			existing = set(counters.values_list('raspberry_slug', flat=True))
+			missing = [slug for slug in raspberry_slugs if slug not in existing]
+			try:
+				with transaction.atomic():
+					self.bulk_create([
+						StatusCounter(raspberry_slug=slug, command_slug=command_slug, status=status, count=delta)
+						for slug in missing
+					])
+			except IntegrityError:
+				# Otro proceso creó alguno de los contadores al mismo tiempo
+				for slug in missing:
+					self.filter(raspberry_slug=slug, command_slug=command_slug, status=status).update(
+						count=F('count') + delta, updated_at=now
+					)
+
+	def rebuild(self):
+		"""Recalcula todos los contadores a partir de la tabla History"""
+		rows = (
+			History.objects.order_by()
+			.values('raspberry_id', 'command_id', 'status')
+			.annotate(total=models.Count('id'))
+		)
+		with transaction.atomic():
+			self.all().delete()
+			self.bulk_create([
+				StatusCounter(
+					raspberry_slug=row['raspberry_id'], command_slug=row['command_id'],
+					status=row['status'], count=row['total']
+				)
+				for row in rows.iterator()
+			], batch_size=500)
+
+	def summary(self, by='raspberry_slug'):
+		"""Totales por estado agrupados por dispositivo o comando, en una consulta"""
+		return self.order_by().values(by, 'status').annotate(total=Sum('count'))
+
+
+class StatusCounter(models.Model):
+	"""
+	Contadores desnormalizados de History por dispositivo, comando y estado.
+	Los actualizan el reclamo, los acks y la creación de comandos; el comando
+	rebuild_status_counters los reconstruye desde cero.
+	"""
+	raspberry_slug = models.CharField(max_length=80)
+	command_slug = models.CharField(max_length=80)
+	status = models.CharField(max_length=30)
+	count = models.BigIntegerField(default=0)
+	updated_at = models.DateTimeField(auto_now=True)
+
+	objects = StatusCounterQuerySet.as_manager()
+
+	def __str__(self):
+		return f"{self.raspberry_slug} - {self.command_slug} - {self.status}: {self.count}"
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['raspberry_slug', 'command_slug', 'status'], name='status_counter_unique'),
+		]
+
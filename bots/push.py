@@ -0,0 +1,208 @@
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+from contextlib import asynccontextmanager
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from . import metrics
+from .models import History
+
+logger = logging.getLogger(__name__)
+
+wakeups = metrics.counter(
+    'botbrain_push_wakeups_total',
+    'Conexiones y long polls despertados por un aviso de comando nuevo'
+)
+
+
+class PushConnection:
+    """Conexión abierta de un Raspberry Pi que puede despertarse desde cualquier hilo"""
+
+    def __init__(self, raspberry_slug, loop):
+        self.raspberry_slug = raspberry_slug
+        self.loop = loop
+        self.event = asyncio.Event()
+        self._timer = None
+
+    def wake(self):
+        self.loop.call_soon_threadsafe(self.event.set)
+
+    def wake_later(self, delay):
+        """Despierta la conexión dentro de `delay` segundos (comandos con not_before)"""
+        self.cancel_wake()
+        self._timer = self.loop.call_later(delay, self.event.set)
+
+    def cancel_wake(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+class ConnectionRegistry:
+    """Registro en proceso de las conexiones abiertas, agrupadas por slug"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections = defaultdict(set)
+
+    def register(self, connection):
+        with self._lock:
+            self._connections[connection.raspberry_slug].add(connection)
+
+    def unregister(self, connection):
+        with self._lock:
+            connections = self._connections.get(connection.raspberry_slug)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self._connections[connection.raspberry_slug]
+
+    def slugs(self):
+        with self._lock:
+            return list(self._connections)
+
+    def notify(self, raspberry_slug):
+        with self._lock:
+            connections = list(self._connections.get(raspberry_slug, ()))
+        for connection in connections:
+            connection.wake()
+        if connections:
+            wakeups.inc(len(connections))
+        return len(connections)
+
+
+class InProcessBroker:
+    """
+    Reparte los avisos entre las conexiones de este proceso. Suficiente cuando
+    el servidor corre con un solo worker.
+    """
+
+    def __init__(self, registry):
+        self.registry = registry
+        self._task = None
+
+    def publish(self, raspberry_slug):
+        self.registry.notify(raspberry_slug)
+
+    def ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self.run())
+
+    async def run(self):
+        pass
+
+
+class DatabaseBroker(InProcessBroker):
+    """
+    Sustituto local de un broker externo para varios workers: además de los
+    avisos en proceso, cada worker revisa periódicamente la base compartida
+    buscando trabajo pendiente para los dispositivos conectados a él.
+    Es una sola consulta por worker e intervalo, sin importar cuántas
+    conexiones tenga abiertas.
+    """
+
+    async def run(self):
+        interval = getattr(settings, 'BOTBRAIN_PUSH_BROKER_INTERVAL', 1)
+        while True:
+            await asyncio.sleep(interval)
+            slugs = self.registry.slugs()
+            if not slugs:
+                continue
+            try:
+                pending = await sync_to_async(list)(
+                    History.objects.ready().filter(raspberry_id__in=slugs)
+                    .order_by()
+                    .values_list('raspberry_id', flat=True)
+                    .distinct()
+                )
+            except Exception as e:
+                logger.error(f"Error consultando comandos pendientes: {e}")
+                continue
+            for raspberry_slug in pending:
+                self.registry.notify(raspberry_slug)
+
+
+class RedisBroker(InProcessBroker):
+    """
+    Reparte los avisos entre workers por Pub/Sub de Redis (o un servidor
+    compatible) en BOTBRAIN_PUSH_REDIS_URL: cada worker publica en un canal
+    y todos reenvían lo recibido a sus conexiones. Necesita el paquete redis.
+    """
+
+    channel = 'botbrain:commands'
+
+    def __init__(self, registry):
+        super().__init__(registry)
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBroker necesita el paquete redis (pip install redis)')
+        self.url = getattr(settings, 'BOTBRAIN_PUSH_REDIS_URL', 'redis://localhost:6379/0')
+        self.client = redis.Redis.from_url(self.url)
+
+    def publish(self, raspberry_slug):
+        try:
+            self.client.publish(self.channel, raspberry_slug)
+        except Exception as e:
+            logger.error(f"Error publicando en Redis: {e}")
+            # Al menos las conexiones de este worker se enteran
+            super().publish(raspberry_slug)
+
+    async def run(self):
+        import redis.asyncio
+
+        while True:
+            client = redis.asyncio.Redis.from_url(self.url)
+            try:
+                async with client.pubsub() as pubsub:
+                    await pubsub.subscribe(self.channel)
+                    # Lo publicado mientras no había suscripción se perdió
+                    for raspberry_slug in self.registry.slugs():
+                        self.registry.notify(raspberry_slug)
+                    async for message in pubsub.listen():
+                        if message['type'] == 'message':
+                            self.registry.notify(message['data'].decode())
+            except Exception as e:
+                logger.error(f"Error en la suscripción a Redis: {e}")
+                await asyncio.sleep(1)
+            finally:
+                await client.aclose()
+
+
+registry = ConnectionRegistry()
+_broker = None
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        broker_class = import_string(getattr(settings, 'BOTBRAIN_PUSH_BROKER', 'bots.push.InProcessBroker'))
+        _broker = broker_class(registry)
+    return _broker
+
+
+def publish(raspberry_slug):
+    """Avisa a las conexiones abiertas de un Raspberry Pi que tiene trabajo nuevo"""
+    get_broker().publish(raspberry_slug)
+
+
+@asynccontextmanager
+async def subscribe(raspberry_slug):
+    """
+    Registra una PushConnection mientras dura el bloque; su `event` se activa
+    con cada aviso para el dispositivo. Quien espera debe limpiarlo.
+    """
+    connection = PushConnection(raspberry_slug, asyncio.get_running_loop())
+    registry.register(connection)
+    get_broker().ensure_started()
+    try:
+        yield connection
+    finally:
+        connection.cancel_wake()
+        registry.unregister(connection)
@@ -1,21 +1,39 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import History, Raspberry, Command
+from . import catalog
+from .models import History, Raspberry, Command, ResultChunk
+
+class CachedSlugRelatedField(serializers.SlugRelatedField):
+    """SlugRelatedField que resuelve el slug a través de un catálogo en caché"""
+
+    def __init__(self, catalog=None, **kwargs):
+        self.catalog = catalog
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str):
+            self.fail('invalid')
+        instance = self.catalog.get(data)
+        if instance is None:
+            self.fail('does_not_exist', slug_name=self.slug_field, value=data)
+        return instance
 
 class HistorySerializer(serializers.ModelSerializer):
     # Campos para mostrar información relacionada (solo lectura)
     raspberry_name = serializers.CharField(source='raspberry.name', read_only=True)
     command_name = serializers.CharField(source='command.name', read_only=True)
-    command_comm = serializers.CharField(source='command.comm', read_only=True)  # Nuevo campo
     
     # Campos para la creación (escritura)
-    raspberry_slug = serializers.SlugRelatedField(
+    raspberry_slug = CachedSlugRelatedField(
+        catalog=catalog.raspberries,
         queryset=Raspberry.objects.all(),
         slug_field='slug',
         write_only=True,
         source='raspberry'
     )
     
-    command_slug = serializers.SlugRelatedField(
+    command_slug = CachedSlugRelatedField(
+        catalog=catalog.commands,
         queryset=Command.objects.all(),
         slug_field='slug',  # Ahora usa el campo slug
         write_only=True,
@@ -27,18 +45,46 @@ class HistorySerializer(serializers.ModelSerializer):
         fields = [
             'id',
             'raspberry_slug', 'raspberry_name',
-            'command_slug', 'command_name', 'command_comm',
-            'status', 'result',
+            'command_slug', 'command_name',
+            'status', 'result', 'result_size', 'result_truncated', 'attempts',
+            'priority', 'not_before',
             'created_at', 'updated_at'
         ]
         read_only_fields = [
             'id', 'created_at', 'updated_at', 
-            'raspberry_name', 'command_name', 'command_comm'
+            'raspberry_name', 'command_name',
+            'result_size', 'result_truncated', 'attempts'
         ]
 
+class HistoryListSerializer(HistorySerializer):
+    """Sin el resultado: la lista no lee esa columna (ver HistoryListView)"""
+
+    class Meta(HistorySerializer.Meta):
+        fields = [field for field in HistorySerializer.Meta.fields if field != 'result']
+
+class RaspberrySelectorField(serializers.Field):
+    """Acepta una lista de slugs o el selector "all" """
+
+    def to_internal_value(self, data):
+        if data == 'all':
+            return data
+        if not isinstance(data, list) or not data:
+            raise serializers.ValidationError('Debe ser una lista de slugs o "all"')
+        if not all(isinstance(slug, str) and slug for slug in data):
+            raise serializers.ValidationError('Todos los slugs deben ser cadenas no vacías')
+        # Quitar duplicados conservando el orden
+        return list(dict.fromkeys(data))
+
+class HistoryFanOutSerializer(serializers.Serializer):
+    command_slug = serializers.CharField()
+    raspberry_slugs = RaspberrySelectorField()
+    # Mantenimiento masivo: prioridad baja y/o diferido con not_before
+    priority = serializers.IntegerField(required=False, default=0, min_value=-32768, max_value=32767)
+    not_before = serializers.DateTimeField(required=False, allow_null=True)
+
 class RaspberrySerializer(serializers.ModelSerializer):
-    # Campo calculado para contar histories asociados
-    history_count = serializers.SerializerMethodField()
+    # Anotado por la vista con Count('history') para evitar un COUNT por fila
+    history_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Raspberry
@@ -48,24 +94,18 @@ class RaspberrySerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'history_count']
     
-    def get_history_count(self, obj):
-        return obj.history_set.count()
-    
 class CommandSerializer(serializers.ModelSerializer):
-    # Campo calculado para contar usage
-    usage_count = serializers.SerializerMethodField()
+    # Anotado por la vista con Count('history') para evitar un COUNT por fila
+    usage_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = Command
         fields = [
-            'id', 'name', 'comm', 'slug',
+            'id', 'name', 'slug', 'timeout', 'max_attempts',
             'usage_count', 'created_at', 'updated_at'
         ]   
         read_only_fields = ['id', 'created_at', 'updated_at', 'usage_count']
     
-    def get_usage_count(self, obj):
-        return obj.history_set.count()
-    
 class PendingCommandSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     command = serializers.CharField(source='command.comm')
@@ -73,10 +113,29 @@ class PendingCommandSerializer(serializers.Serializer):
 class AckCommandSerializer(serializers.Serializer):
     command_id = serializers.IntegerField()
     result = serializers.CharField()
+    # False marca el comando como 'failed' en lugar de 'executed'
+    success = serializers.BooleanField(required=False, default=True)
+
+class ResultChunkSerializer(serializers.Serializer):
+    seq = serializers.IntegerField(min_value=0)
+    stream = serializers.ChoiceField(choices=ResultChunk.STREAM_CHOICES, default='stdout')
+    # La salida se guarda tal cual: sin recortar espacios ni saltos de línea
+    data = serializers.CharField(trim_whitespace=False)
+
+    def validate_data(self, value):
+        max_size = getattr(settings, 'BOTBRAIN_OUTPUT_CHUNK_MAX_SIZE', 65536)
+        if len(value) > max_size:
+            raise serializers.ValidationError(f'Cada trozo admite como máximo {max_size} caracteres')
+        return value
 
 class CommandResponseSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     command = serializers.CharField()
 
 class AckResponseSerializer(serializers.Serializer):
-    status = serializers.CharField(default='success')
\ No newline at end of file
+    status = serializers.CharField(default='success')
+
+class BulkAckResponseSerializer(serializers.Serializer):
+    status = serializers.CharField(default='success')
+    acknowledged = serializers.ListField(child=serializers.IntegerField())
+    not_found = serializers.ListField(child=serializers.IntegerField())
\ No newline at end of file
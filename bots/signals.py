@@ -0,0 +1,88 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import catalog, push
+from .models import Command, History, Raspberry, StatusCounter
+
+# Hay comandos nuevos en cola para `raspberry_slugs`. Se emite al confirmar la
+# transacción, así quien despierta ya puede reclamarlos
+commands_queued = Signal()
+
+
+def announce_queued(raspberry_slugs):
+    """Emite commands_queued al confirmar la transacción en curso"""
+    raspberry_slugs = list(dict.fromkeys(raspberry_slugs))
+    if raspberry_slugs:
+        transaction.on_commit(lambda: commands_queued.send(sender=History, raspberry_slugs=raspberry_slugs))
+
+
+@receiver(pre_save, sender=History)
+def remember_previous_status(sender, instance, **kwargs):
+    # Guardados del admin o del ORM que cambian el estado de una fila existente
+    if instance._state.adding or instance.pk is None:
+        instance._previous_counter_key = None
+        return
+    instance._previous_counter_key = (
+        sender.objects.filter(pk=instance.pk)
+        .values_list('raspberry_id', 'command_id', 'status')
+        .first()
+    )
+
+
+@receiver(post_save, sender=History)
+def count_saved_history(sender, instance, created, **kwargs):
+    current = (instance.raspberry_id, instance.command_id, instance.status)
+    if created:
+        StatusCounter.objects.adjust({current: 1})
+        return
+
+    previous = getattr(instance, '_previous_counter_key', None)
+    if previous and previous != current:
+        StatusCounter.objects.adjust({previous: -1, current: 1})
+
+
+@receiver(post_save, sender=History)
+def announce_saved_history(sender, instance, created, **kwargs):
+    # Inserciones por la API o el admin, y filas que el admin devuelve a 'pending'
+    if instance.status != 'pending':
+        return
+    previous = getattr(instance, '_previous_counter_key', None)
+    if created or (previous and previous[2] != 'pending'):
+        announce_queued([instance.raspberry_id])
+
+
+@receiver(commands_queued)
+def wake_waiting_devices(sender, raspberry_slugs, **kwargs):
+    for raspberry_slug in raspberry_slugs:
+        push.publish(raspberry_slug)
+
+
+@receiver(post_delete, sender=History)
+def count_deleted_history(sender, instance, **kwargs):
+    StatusCounter.objects.adjust({(instance.raspberry_id, instance.command_id, instance.status): -1})
+
+
+@receiver(post_delete, sender=Raspberry)
+def drop_raspberry_counters(sender, instance, **kwargs):
+    StatusCounter.objects.filter(raspberry_slug=instance.slug).delete()
+
+
+@receiver(post_delete, sender=Command)
+def drop_command_counters(sender, instance, **kwargs):
+    StatusCounter.objects.filter(command_slug=instance.slug).delete()
+
+
+@receiver(post_save, sender=Raspberry)
+@receiver(post_delete, sender=Raspberry)
+def invalidate_raspberry_catalog(sender, **kwargs):
+    # También al confirmar, por si otra petición recargó la caché antes del commit
+    catalog.raspberries.invalidate()
+    transaction.on_commit(catalog.raspberries.invalidate)
+
+
+@receiver(post_save, sender=Command)
+@receiver(post_delete, sender=Command)
+def invalidate_command_catalog(sender, **kwargs):
+    catalog.commands.invalidate()
+    transaction.on_commit(catalog.commands.invalidate)
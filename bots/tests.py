@@ -1,3 +1,1805 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+from unittest import mock
+import time
 
-# Create your tests here.
+import requests
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import AsyncClient, Client, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from conf.asgi import application
+from conf.routers import ReplicaRouter, replica_reads, replica_reads_active
+from . import catalog, fastpath
+from .archive import archive_history, read_archive
+from .authentication import make_device_key, verify_device_key
+from .fields import COMPRESSED_PREFIX
+from .loadtest import parse_mix, percentile
+from .instrumentation import request_count, request_queries, request_render_duration, request_serialize_duration, request_stats
+from .metrics import MetricHistogram, reaped_commands, render_prometheus
+from .serializers import AckCommandSerializer
+from .models import Command, DeviceCredential, History, Raspberry, ResultChunk, StatusCounter
+from .push import ConnectionRegistry, DatabaseBroker, PushConnection, registry, wakeups
+from .signals import commands_queued
+
+# Cliente del Raspberry Pi (robot/blueman.py): bots.loadtest agrega robot/ a sys.path
+import blueman  # noqa: E402
+
+
+def create_user(email='bot@example.com'):
+    return User.objects.create_user(username=email.split('@')[0], email=email, password='secret-pass-123')
+
+
+def authenticated_client(user):
+    token, _ = Token.objects.get_or_create(user=user)
+    client = APIClient()
+    client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+    return client
+
+
+class PendingCommandViewTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def test_returns_404_without_pending_commands(self):
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_claims_oldest_pending_command_and_marks_it_sent(self):
+        first = History.objects.create(raspberry=self.raspberry, command=self.command)
+        second = History.objects.create(raspberry=self.raspberry, command=self.command)
+
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'id': first.id, 'command': 'estado_sistema'})
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.status, 'sent')
+        self.assertEqual(second.status, 'pending')
+
+    def test_claim_touches_only_status_and_updated_at(self):
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        History.objects.claim('pi-1')
+        history = History.objects.create(raspberry=self.raspberry, command=self.command, result='previo')
+        # SELECT + UPDATE condicional + un UPDATE por contador (pending y sent)
+        with self.assertNumQueries(4):
+            claimed = History.objects.claim('pi-1')
+        self.assertEqual(claimed, [(history.id, 'estado_sistema')])
+        history.refresh_from_db()
+        self.assertEqual(history.result, 'previo')
+
+
+class BatchCommandTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.other = Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def test_limit_claims_pending_commands_in_order(self):
+        histories = [History.objects.create(raspberry=self.raspberry, command=self.command) for _ in range(3)]
+
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']), {'limit': 2})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data], [histories[0].id, histories[1].id])
+        self.assertEqual(
+            list(History.objects.order_by('id').values_list('status', flat=True)),
+            ['sent', 'sent', 'pending']
+        )
+
+    def test_invalid_limit_is_rejected(self):
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']), {'limit': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_ack_updates_all_rows_of_the_device(self):
+        first = History.objects.create(raspberry=self.raspberry, command=self.command, status='sent')
+        second = History.objects.create(raspberry=self.raspberry, command=self.command, status='sent')
+        foreign = History.objects.create(raspberry=self.other, command=self.command, status='sent')
+
+        response = self.client.post(reverse('ack-commands', args=['pi-1']), [
+            {'command_id': first.id, 'result': 'uno'},
+            {'command_id': second.id, 'result': 'dos'},
+            {'command_id': foreign.id, 'result': 'ajeno'},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.data['acknowledged']), [first.id, second.id])
+        self.assertEqual(response.data['not_found'], [foreign.id])
+        self.assertEqual(
+            dict(History.objects.values_list('id', 'result')),
+            {first.id: 'uno', second.id: 'dos', foreign.id: None}
+        )
+        foreign.refresh_from_db()
+        self.assertEqual(foreign.status, 'sent')
+
+    def test_bulk_ack_rejects_invalid_payload(self):
+        response = self.client.post(reverse('ack-commands', args=['pi-1']), {'command_id': 1}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class HistoryFanOutTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        Raspberry.objects.bulk_create(Raspberry(name=f'Pi {i}', slug=f'pi-{i}') for i in range(30))
+        self.url = reverse('history-fan-out')
+
+    def fan_out(self, raspberry_slugs, command_slug='estado_sistema'):
+        return self.client.post(self.url, {
+            'command_slug': command_slug, 'raspberry_slugs': raspberry_slugs
+        }, format='json')
+
+    def test_creates_one_row_per_device_and_reports_unknown_slugs(self):
+        response = self.fan_out(['pi-1', 'missing', 'pi-2', 'pi-1'])
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['failed'], [{'raspberry_slug': 'missing', 'error': 'Raspberry not found'}])
+        self.assertEqual(
+            sorted(History.objects.values_list('raspberry_id', flat=True)), ['pi-1', 'pi-2']
+        )
+
+    @override_settings(BOTBRAIN_FANOUT_BATCH_SIZE=7)
+    def test_all_selector_targets_the_whole_fleet_in_batches(self):
+        response = self.fan_out('all')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 30)
+        self.assertEqual(History.objects.filter(status='pending').count(), 30)
+
+    def test_query_count_does_not_grow_with_fleet_size(self):
+        self.fan_out(['pi-0'])  # Calienta la caché del catálogo de comandos
+        with CaptureQueriesContext(connection) as small:
+            self.fan_out(['pi-1', 'pi-2', 'pi-3'])
+        with CaptureQueriesContext(connection) as large:
+            self.fan_out([f'pi-{i}' for i in range(30)])
+        self.assertEqual(len(small), len(large))
+
+    def test_unknown_command_is_rejected(self):
+        response = self.fan_out('all', command_slug='missing')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(History.objects.exists())
+
+    def test_invalid_selector_is_rejected(self):
+        response = self.fan_out('some')
+        self.assertEqual(response.status_code, 400)
+
+
+class ListQueryCountTests(TestCase):
+    """Las listas deben costar un número constante de consultas sin importar cuántas filas haya"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = authenticated_client(create_user())
+        self.fleet_size = 0
+        # Deja el token en caché: cada petición cuesta solo sus propias consultas
+        self.client.get(reverse('raspberry-list'))
+
+    def grow_fleet(self, size):
+        for i in range(self.fleet_size, self.fleet_size + size):
+            raspberry = Raspberry.objects.create(name=f'Pi {i}', slug=f'pi-{i}')
+            command = Command.objects.create(name=f'Comando {i}', slug=f'comando-{i}')
+            History.objects.create(raspberry=raspberry, command=command)
+            History.objects.create(raspberry=raspberry, command=command)
+        self.fleet_size += size
+
+    def assertConstantQueries(self, url_name, num):
+        self.grow_fleet(1)
+        with self.assertNumQueries(num):
+            small = self.client.get(reverse(url_name))
+        self.grow_fleet(10)
+        with self.assertNumQueries(num):
+            large = self.client.get(reverse(url_name))
+        self.assertEqual(small.status_code, 200)
+        self.assertEqual(large.status_code, 200)
+        return large
+
+    # Los catálogos suman tres agregados para el ETag (ver ConditionalListMixin)
+    validator_queries = 3
+
+    def test_raspberry_list(self):
+        response = self.assertConstantQueries('raspberry-list', 1 + self.validator_queries)
+        self.assertEqual({item['history_count'] for item in response.data}, {2})
+
+    def test_command_list(self):
+        response = self.assertConstantQueries('command-list', 1 + self.validator_queries)
+        self.assertEqual({item['usage_count'] for item in response.data}, {2})
+
+    def test_history_list(self):
+        response = self.assertConstantQueries('history-list', 1)
+        self.assertEqual(response.data['results'][0]['raspberry_name'], 'Pi 10')
+        self.assertEqual(response.data['results'][0]['command_name'], 'Comando 10')
+
+    def test_history_detail(self):
+        self.grow_fleet(1)
+        history = History.objects.first()
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('history-detail', args=[history.id]))
+        self.assertEqual(response.data['raspberry_name'], 'Pi 0')
+
+
+class HistoryListPaginationTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.other = Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.histories = [
+            History.objects.create(raspberry=self.raspberry if i % 2 else self.other, command=self.command)
+            for i in range(45)
+        ]
+        # Mismo created_at para varias filas: el id desempata el cursor
+        History.objects.filter(id__in=[h.id for h in self.histories[10:20]]).update(
+            created_at=self.histories[10].created_at
+        )
+
+    def walk(self, params):
+        ids = []
+        response = self.client.get(reverse('history-list'), params)
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_default_page_is_latest_30(self):
+        response = self.client.get(reverse('history-list'))
+        self.assertEqual(len(response.data['results']), 30)
+        self.assertEqual(response.data['results'][0]['id'], self.histories[-1].id)
+        self.assertIsNotNone(response.data['next'])
+
+    def test_cursor_walks_every_row_once_newest_first(self):
+        ids = self.walk({'page_size': 7})
+        expected = list(
+            History.objects.order_by('-created_at', '-id').values_list('id', flat=True)
+        )
+        self.assertEqual(ids, expected)
+
+    def test_filters_apply_before_the_limit(self):
+        ids = self.walk({'raspberry': 'pi-1', 'status': 'pending', 'page_size': 5})
+        self.assertEqual(len(ids), 22)
+        self.assertEqual(
+            set(History.objects.filter(id__in=ids).values_list('raspberry_id', flat=True)), {'pi-1'}
+        )
+
+    def test_page_size_is_capped(self):
+        response = self.client.get(reverse('history-list'), {'page_size': 1000})
+        self.assertEqual(len(response.data['results']), 45)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('history-list'), {'cursor': 'nope'})
+        self.assertEqual(response.status_code, 404)
+
+
+class StatusCounterTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def counters(self):
+        return {
+            (c.raspberry_slug, c.command_slug, c.status): c.count
+            for c in StatusCounter.objects.exclude(count=0)
+        }
+
+    def test_counters_follow_the_command_lifecycle(self):
+        self.client.post(reverse('history-create'), {'raspberry_slug': 'pi-1', 'command_slug': 'estado_sistema'})
+        self.client.post(reverse('history-create'), {'raspberry_slug': 'pi-1', 'command_slug': 'estado_sistema'})
+        self.assertEqual(self.counters(), {('pi-1', 'estado_sistema', 'pending'): 2})
+
+        claimed = self.client.get(reverse('get-pending-commands', args=['pi-1']), {'limit': 2}).data
+        self.assertEqual(self.counters(), {('pi-1', 'estado_sistema', 'sent'): 2})
+
+        self.client.post(reverse('ack-command', args=['pi-1']), {
+            'command_id': claimed[0]['id'], 'result': 'ok'
+        }, format='json')
+        self.client.post(reverse('ack-commands', args=['pi-1']), [
+            {'command_id': claimed[1]['id'], 'result': 'boom', 'success': False}
+        ], format='json')
+        self.assertEqual(self.counters(), {
+            ('pi-1', 'estado_sistema', 'executed'): 1,
+            ('pi-1', 'estado_sistema', 'failed'): 1,
+        })
+        self.assertEqual(History.objects.get(id=claimed[1]['id']).status, 'failed')
+
+    def test_fan_out_admin_saves_and_deletes_update_counters(self):
+        self.client.post(reverse('history-fan-out'), {
+            'command_slug': 'estado_sistema', 'raspberry_slugs': 'all'
+        }, format='json')
+        history = History.objects.get(raspberry_id='pi-2')
+        history.status = 'executed'
+        history.save()
+        History.objects.filter(raspberry_id='pi-1').delete()
+
+        self.assertEqual(self.counters(), {('pi-2', 'estado_sistema', 'executed'): 1})
+
+    def test_summary_reads_counters_in_one_query(self):
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        History.objects.create(raspberry=self.raspberry, command=self.command, status='executed')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('raspberry-summary'))
+
+        self.assertEqual(response.data['totals'], {'pending': 1, 'sent': 0, 'executed': 1, 'failed': 0, 'timed_out': 0})
+        self.assertEqual(response.data['results'], [
+            {'raspberry_slug': 'pi-1', 'pending': 1, 'sent': 0, 'executed': 1, 'failed': 0, 'timed_out': 0}
+        ])
+
+        by_command = self.client.get(reverse('raspberry-summary'), {'by': 'command'}).data
+        self.assertEqual(by_command['results'][0]['command_slug'], 'estado_sistema')
+
+    def test_rebuild_matches_history(self):
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        History.objects.filter(raspberry=self.raspberry).update(status='sent')
+        StatusCounter.objects.create(raspberry_slug='ghost', command_slug='x', status='pending', count=5)
+
+        call_command('rebuild_status_counters', stdout=open(os.devnull, 'w'))
+
+        self.assertEqual(self.counters(), {('pi-1', 'estado_sistema', 'sent'): 1})
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        catalog.get_backend().clear()
+        self.user = create_user()
+        self.client = authenticated_client(self.user)
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def test_hits_skip_the_database(self):
+        self.assertEqual(catalog.raspberries.get('pi-1'), self.raspberry)
+        self.assertIsNone(catalog.raspberries.get('missing'))
+        hits = catalog.raspberries.hits
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.raspberries.get('pi-1'), self.raspberry)
+            self.assertIsNone(catalog.raspberries.get('missing'))
+            self.assertIsNone(catalog.raspberries.get('missing'))
+        self.assertEqual(catalog.raspberries.hits, hits + 3)
+
+    def test_misses_expire_quickly_for_rows_created_in_other_workers(self):
+        backend = catalog.LRUBackend(timeout=60, miss_timeout=0.05)
+        with mock.patch('bots.catalog.get_backend', return_value=backend):
+            self.assertIsNone(catalog.raspberries.get('pi-2'))
+            # Otro worker crea la fila: su invalidación no llega a esta caché
+            Raspberry.objects.bulk_create([Raspberry(name='Pi 2', slug='pi-2')])
+            self.assertIsNone(catalog.raspberries.get('pi-2'))
+            time.sleep(0.06)
+            self.assertIsNotNone(catalog.raspberries.get('pi-2'))
+            # Las filas existentes sí duran el timeout completo
+            Raspberry.objects.filter(slug='pi-2').update(name='Renombrado')
+            self.assertEqual(catalog.raspberries.get('pi-2').name, 'Pi 2')
+
+    def test_save_and_delete_invalidate(self):
+        catalog.raspberries.get('pi-1')
+        self.raspberry.name = 'Renombrado'
+        self.raspberry.save()
+        self.assertEqual(catalog.raspberries.get('pi-1').name, 'Renombrado')
+
+        self.assertIsNone(catalog.raspberries.get('pi-2'))
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.assertIsNotNone(catalog.raspberries.get('pi-2'))
+
+        self.raspberry.delete()
+        self.assertIsNone(catalog.raspberries.get('pi-1'))
+
+    def test_history_create_resolves_slugs_from_cache(self):
+        url = reverse('history-create')
+        data = {'raspberry_slug': 'pi-1', 'command_slug': 'estado_sistema'}
+        self.client.post(url, data)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(any('"bots_raspberry"' in q['sql'] or '"bots_command"' in q['sql'] for q in queries))
+
+    def test_unknown_raspberry_is_rejected_without_touching_history(self):
+        response = self.client.get(reverse('get-pending-commands', args=['missing']))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response.data['message'], 'Raspberry not found')
+
+    @override_settings(BOTBRAIN_CATALOG_CACHE={'BACKEND': 'bots.catalog.DjangoCacheBackend'})
+    def test_django_cache_backend(self):
+        catalog.commands.get('estado_sistema')
+        with self.assertNumQueries(0):
+            self.assertEqual(catalog.commands.get('estado_sistema'), self.command)
+        self.command.delete()
+        self.assertIsNone(catalog.commands.get('estado_sistema'))
+
+    def test_stats_endpoint_requires_admin(self):
+        self.assertEqual(self.client.get(reverse('catalog-cache-stats')).status_code, 403)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('catalog-cache-stats'))
+        self.assertEqual(set(response.data), {'raspberry', 'command'})
+
+
+class DeviceKeyTests(TestCase):
+    def setUp(self):
+        catalog.get_backend().clear()
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.credential = DeviceCredential.objects.create(raspberry=self.raspberry)
+
+    def device_client(self, key):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Device {key}')
+        return client
+
+    def issue_keys(self, *args):
+        out = io.StringIO()
+        call_command('device_keys', *args, stdout=out)
+        return dict(line.split('\t') for line in out.getvalue().splitlines())
+
+    def test_signature_is_verified_without_queries(self):
+        key = make_device_key('pi-1', 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(verify_device_key(key), ('pi-1', 1))
+            self.assertIsNone(verify_device_key(key[:-1] + ('0' if key[-1] != '0' else '1')))
+            self.assertIsNone(verify_device_key('pi-1.x.y'))
+
+    def test_device_key_can_poll_and_ack_its_own_routes(self):
+        history = History.objects.create(raspberry=self.raspberry, command=self.command)
+        client = self.device_client(make_device_key('pi-1', 1))
+
+        response = client.get(reverse('get-pending-commands', args=['pi-1']))
+        self.assertEqual(response.data['id'], history.id)
+        response = client.post(reverse('ack-command', args=['pi-1']), {
+            'command_id': history.id, 'result': 'ok'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_device_key_costs_one_credential_lookup(self):
+        client = self.device_client(make_device_key('pi-1', 1))
+        client.get(reverse('get-pending-commands', args=['pi-1']))
+        # La credencial por clave única y la búsqueda de comandos pendientes
+        with self.assertNumQueries(2):
+            response = client.get(reverse('get-pending-commands', args=['pi-1']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_device_key_is_scoped_to_its_device_routes(self):
+        client = self.device_client(make_device_key('pi-1', 1))
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-2'])).status_code, 403)
+        self.assertEqual(client.get(reverse('history-list')).status_code, 401)
+        self.assertEqual(client.get(reverse('profile')).status_code, 401)
+
+    def test_forged_and_inactive_keys_are_rejected(self):
+        forged = self.device_client('pi-1.1.' + '0' * 64)
+        self.assertEqual(forged.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 401)
+
+        self.credential.is_active = False
+        self.credential.save()
+        client = self.device_client(make_device_key('pi-1', 1))
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 401)
+
+    def test_bulk_rotation_invalidates_previous_keys(self):
+        old_key = make_device_key('pi-1', 1)
+        client = self.device_client(old_key)
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 404)
+
+        keys = self.issue_keys('--rotate')
+
+        self.assertEqual(set(keys), {'pi-1', 'pi-2'})
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 401)
+        rotated = self.device_client(keys['pi-1'])
+        self.assertEqual(rotated.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 404)
+        # pi-2 no tenía credencial: se crea en la generación 1
+        self.assertEqual(keys['pi-2'], make_device_key('pi-2', 1))
+
+    def test_rotation_from_another_process_applies_immediately(self):
+        client = self.device_client(make_device_key('pi-1', 1))
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 404)
+        # Como device_keys en su propio proceso: sin señales ni invalidación local
+        DeviceCredential.objects.filter(raspberry_id='pi-1').update(generation=2)
+        self.assertEqual(client.get(reverse('get-pending-commands', args=['pi-1'])).status_code, 401)
+
+    async def test_socket_accepts_device_key_for_its_own_channel(self):
+        key = make_device_key('pi-1', 1)
+        session = SocketSession('/api/bot/raspberries/pi-1/socket/', authorization=f'Device {key}')
+        self.assertEqual(await session.connect(), {'type': 'websocket.accept'})
+        await session.disconnect()
+
+        other = SocketSession('/api/bot/raspberries/pi-2/socket/', authorization=f'Device {key}')
+        self.assertEqual(await other.connect(), {'type': 'websocket.close', 'code': 4401})
+
+
+class ConcurrentClaimTests(TransactionTestCase):
+    def test_no_command_is_handed_out_twice(self):
+        raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        command = Command.objects.create(name='Estado', slug='estado_sistema')
+        History.objects.bulk_create(
+            History(raspberry=raspberry, command=command) for _ in range(50)
+        )
+
+        claimed_ids = []
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(8)
+
+        def poll():
+            try:
+                barrier.wait()
+                while True:
+                    claimed = History.objects.claim('pi-1')
+                    if not claimed:
+                        break
+                    with lock:
+                        claimed_ids.extend(history_id for history_id, _ in claimed)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=poll) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len(claimed_ids), 50)
+        self.assertEqual(len(set(claimed_ids)), 50)
+        self.assertFalse(History.objects.filter(status='pending').exists())
+
+
+@override_settings(BOTBRAIN_LONG_POLL_MAX_WAIT=5, BOTBRAIN_LONG_POLL_INTERVAL=0.05)
+class LongPollPendingCommandTests(TestCase):
+    def setUp(self):
+        self.token = Token.objects.create(user=create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.url = reverse('get-pending-commands', args=['pi-1'])
+
+    def poll(self, wait):
+        return AsyncClient().get(self.url, {'wait': wait}, headers={'Authorization': f'Token {self.token.key}'})
+
+    def test_without_wait_returns_immediately_and_advertises_support(self):
+        client = authenticated_client(self.token.user)
+        response = client.get(self.url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['X-Long-Poll-Max'], '5')
+
+    def test_unauthenticated_requests_are_not_held(self):
+        started = time.monotonic()
+        response = self.client.get(self.url, {'wait': 5})
+        self.assertEqual(response.status_code, 401)
+        self.assertLess(time.monotonic() - started, 1)
+
+    async def test_wait_returns_command_created_while_waiting(self):
+        async def create_later():
+            await asyncio.sleep(0.2)
+            return await History.objects.acreate(raspberry=self.raspberry, command=self.command)
+
+        response, history = await asyncio.gather(self.poll(wait=5), create_later())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'id': history.id, 'command': 'estado_sistema'})
+
+    async def test_wait_times_out_with_404(self):
+        started = time.monotonic()
+        response = await self.poll(wait=0.3)
+        self.assertEqual(response.status_code, 404)
+        self.assertGreaterEqual(time.monotonic() - started, 0.3)
+
+    async def test_non_finite_wait_is_not_held(self):
+        for wait in ('nan', 'inf', '-inf'):
+            started = time.monotonic()
+            response = await self.poll(wait=wait)
+            self.assertEqual(response.status_code, 404)
+            self.assertLess(time.monotonic() - started, 1, wait)
+
+    @override_settings(BOTBRAIN_POLL_RETRY_AFTER=10)
+    def test_idle_short_poll_carries_retry_after(self):
+        client = authenticated_client(self.token.user)
+        self.assertEqual(client.get(self.url)['Retry-After'], '10')
+
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        self.assertFalse(client.get(self.url).has_header('Retry-After'))
+
+    @override_settings(BOTBRAIN_POLL_RETRY_AFTER=1)
+    async def test_held_time_counts_towards_retry_after(self):
+        response = await self.poll(wait=1.1)
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('Retry-After'))
+
+
+class ConditionalListTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+
+    def test_matching_etag_gets_304_without_serializing(self):
+        for url_name in ('raspberry-list', 'command-list'):
+            response = self.client.get(reverse(url_name))
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['ETag'].startswith('"'))
+            self.assertIn('Last-Modified', response)
+            self.assertIn('public', response['Cache-Control'])
+            self.assertIn('max-age=0', response['Cache-Control'])
+            self.assertIn('Accept', response['Vary'])
+
+            with mock.patch('rest_framework.generics.ListAPIView.list') as full_list:
+                repeat = self.client.get(reverse(url_name), HTTP_IF_NONE_MATCH=response['ETag'])
+            full_list.assert_not_called()
+            self.assertEqual(repeat.status_code, 304)
+            self.assertEqual(repeat['ETag'], response['ETag'])
+            self.assertIn('Accept', repeat['Vary'])
+            self.assertEqual(repeat.content, b'')
+
+    def test_etag_changes_with_rows_and_counts(self):
+        url = reverse('raspberry-list')
+        etags = [self.client.get(url)['ETag']]
+
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        etags.append(self.client.get(url)['ETag'])
+        History.objects.filter(raspberry=self.raspberry).first().delete()
+        etags.append(self.client.get(url)['ETag'])
+        self.raspberry.name = 'Pi uno'
+        self.raspberry.save()
+        etags.append(self.client.get(url)['ETag'])
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[-1])
+
+        self.assertEqual(response.status_code, 200)
+        etags.append(response['ETag'])
+        self.assertEqual(len(set(etags)), len(etags))
+
+    def test_etag_changes_when_history_moves_between_raspberries(self):
+        url = reverse('raspberry-list')
+        other = Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        etag = self.client.get(url)['ETag']
+
+        history = History.objects.get()
+        history.raspberry = other
+        history.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        url = reverse('command-list')
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+    def test_requires_authentication_even_when_validators_match(self):
+        etag = self.client.get(reverse('command-list'))['ETag']
+        response = APIClient().get(reverse('command-list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 401)
+
+
+class CommandsQueuedSignalTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        Raspberry.objects.bulk_create(Raspberry(name=f'Pi {i}', slug=f'pi-{i}') for i in range(3))
+        self.announced = []
+        commands_queued.connect(self.record)
+        self.addCleanup(commands_queued.disconnect, self.record)
+
+    def record(self, sender, raspberry_slugs, **kwargs):
+        self.announced.append(raspberry_slugs)
+
+    def test_sent_on_commit_for_creations_through_api_and_orm(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('history-create'), {'raspberry_slug': 'pi-1', 'command_slug': 'estado_sistema'})
+            self.assertEqual(self.announced, [])
+        with self.captureOnCommitCallbacks(execute=True):
+            # Como un guardado desde el admin
+            History.objects.create(raspberry_id='pi-2', command=self.command)
+        self.assertEqual(self.announced, [['pi-1'], ['pi-2']])
+
+    def test_sent_once_for_a_fan_out_and_for_rows_returned_to_pending(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('history-fan-out'), {
+                'command_slug': 'estado_sistema', 'raspberry_slugs': ['pi-0', 'pi-1', 'pi-2']
+            }, format='json')
+        self.assertEqual(self.announced, [['pi-0', 'pi-1', 'pi-2']])
+
+        history = History.objects.filter(raspberry_id='pi-0').get()
+        history.status = 'failed'
+        with self.captureOnCommitCallbacks(execute=True):
+            history.save()
+        history.status = 'pending'
+        with self.captureOnCommitCallbacks(execute=True):
+            history.save()
+        self.assertEqual(self.announced[1:], [['pi-0']])
+
+
+@override_settings(BOTBRAIN_LONG_POLL_MAX_WAIT=10, BOTBRAIN_LONG_POLL_INTERVAL=30)
+class LongPollWakeupTests(TransactionTestCase):
+    devices = 20
+
+    async def test_waiting_devices_are_woken_by_inserts_under_load(self):
+        # Con la revisión periódica a 30 s solo el aviso puede entregar a tiempo
+        await Command.objects.acreate(name='Estado', slug='estado_sistema')
+        slugs = [f'pi-{i}' for i in range(self.devices)]
+        await Raspberry.objects.abulk_create(Raspberry(name=slug, slug=slug) for slug in slugs)
+        token = await sync_to_async(Token.objects.create)(user=await sync_to_async(create_user)())
+
+        async def poll(slug):
+            return await AsyncClient().get(
+                reverse('get-pending-commands', args=[slug]), {'wait': 10},
+                headers={'Authorization': f'Token {token.key}'}
+            )
+
+        woken = wakeups.value()
+        polls = [asyncio.ensure_future(poll(slug)) for slug in slugs]
+        deadline = time.monotonic() + 5
+        while len(registry.slugs()) < self.devices and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        self.assertEqual(len(registry.slugs()), self.devices)
+
+        started = time.monotonic()
+        for slug in slugs:
+            await History.objects.acreate(raspberry_id=slug, command_id='estado_sistema')
+        responses = await asyncio.gather(*polls)
+
+        self.assertEqual([response.status_code for response in responses], [200] * self.devices)
+        self.assertLess(time.monotonic() - started, 5)
+        self.assertGreaterEqual(wakeups.value() - woken, self.devices)
+        self.assertEqual(registry.slugs(), [])
+
+
+class SocketSession:
+    """Cliente ASGI mínimo para hablar con el canal WebSocket en las pruebas"""
+
+    def __init__(self, path, token=None, authorization=None):
+        self.inbox = asyncio.Queue()
+        self.outbox = asyncio.Queue()
+        if token:
+            authorization = f'Token {token}'
+        headers = [(b'authorization', authorization.encode())] if authorization else []
+        scope = {'type': 'websocket', 'path': path, 'headers': headers, 'query_string': b''}
+        self.task = asyncio.ensure_future(application(scope, self.inbox.get, self.outbox.put))
+
+    async def connect(self):
+        await self.inbox.put({'type': 'websocket.connect'})
+        return await asyncio.wait_for(self.outbox.get(), 2)
+
+    async def receive_json(self, timeout=2):
+        message = await asyncio.wait_for(self.outbox.get(), timeout)
+        return json.loads(message['text'])
+
+    async def send_json(self, data):
+        await self.inbox.put({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def disconnect(self):
+        await self.inbox.put({'type': 'websocket.disconnect', 'code': 1000})
+        await asyncio.wait_for(self.task, 2)
+
+
+class CommandSocketTests(TestCase):
+    path = '/api/bot/raspberries/pi-1/socket/'
+
+    def setUp(self):
+        self.token = Token.objects.create(user=create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def create_history_through_api(self):
+        client = authenticated_client(self.token.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('history-create'), {
+                'raspberry_slug': 'pi-1', 'command_slug': 'estado_sistema'
+            })
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+    async def test_rejects_connections_without_valid_token(self):
+        session = SocketSession(self.path, token='invalid')
+        message = await session.connect()
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 4401})
+
+    async def test_rejects_unknown_raspberry(self):
+        session = SocketSession('/api/bot/raspberries/missing/socket/', token=self.token.key)
+        message = await session.connect()
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 4404})
+
+    async def test_pushes_backlog_on_connect_and_accepts_acks(self):
+        history = await History.objects.acreate(raspberry=self.raspberry, command=self.command)
+        session = SocketSession(self.path, token=self.token.key)
+        self.assertEqual(await session.connect(), {'type': 'websocket.accept'})
+
+        self.assertEqual(await session.receive_json(), {'type': 'command', 'id': history.id, 'command': 'estado_sistema'})
+        await session.send_json({'type': 'ack', 'command_id': history.id, 'result': 'ok'})
+        self.assertEqual(await session.receive_json(), {'type': 'ack', 'command_id': history.id, 'status': 'success'})
+        await session.disconnect()
+
+        await history.arefresh_from_db()
+        self.assertEqual((history.status, history.result), ('executed', 'ok'))
+
+    async def test_ignores_messages_that_are_not_objects(self):
+        history = await History.objects.acreate(raspberry=self.raspberry, command=self.command)
+        session = SocketSession(self.path, token=self.token.key)
+        await session.connect()
+        self.assertEqual((await session.receive_json())['id'], history.id)
+        for text in ('[1,2]', '"x"', '3', 'null', '{'):
+            await session.inbox.put({'type': 'websocket.receive', 'text': text})
+        await session.send_json({'type': 'ack', 'command_id': history.id, 'result': 'ok'})
+        self.assertEqual(await session.receive_json(), {'type': 'ack', 'command_id': history.id, 'status': 'success'})
+        await session.disconnect()
+
+    async def test_pushes_commands_created_through_history_create_view(self):
+        session = SocketSession(self.path, token=self.token.key)
+        await session.connect()
+
+        history_id = await sync_to_async(self.create_history_through_api)()
+
+        self.assertEqual(await session.receive_json(), {'type': 'command', 'id': history_id, 'command': 'estado_sistema'})
+        await session.disconnect()
+        self.assertEqual(await History.objects.filter(id=history_id).values_list('status', flat=True).aget(), 'sent')
+
+    @override_settings(BOTBRAIN_PUSH_HEARTBEAT=0.05)
+    async def test_sends_heartbeats_and_closes_silent_connections(self):
+        session = SocketSession(self.path, token=self.token.key)
+        await session.connect()
+        self.assertEqual(await session.receive_json(), {'type': 'ping'})
+        message = await asyncio.wait_for(session.outbox.get(), 2)
+        while message['type'] == 'websocket.send':
+            message = await asyncio.wait_for(session.outbox.get(), 2)
+        self.assertEqual(message, {'type': 'websocket.close', 'code': 4408})
+
+
+    @override_settings(BOTBRAIN_PUSH_HEARTBEAT=0.1)
+    async def test_pushes_commands_the_reaper_requeued(self):
+        await Command.objects.filter(slug='estado_sistema').aupdate(timeout=60, max_attempts=2)
+        history = await History.objects.acreate(raspberry=self.raspberry, command=self.command)
+        session = SocketSession(self.path, token=self.token.key)
+        await session.connect()
+        self.assertEqual(await session.receive_json(), {'type': 'command', 'id': history.id, 'command': 'estado_sistema'})
+
+        # El reaper corre en otro proceso: no avisa a este canal
+        await History.objects.filter(id=history.id).aupdate(updated_at=timezone.now() - datetime.timedelta(minutes=5))
+        self.assertEqual((await sync_to_async(History.objects.reap)())[('estado_sistema', 'requeued')], 1)
+
+        pushed = {'type': 'command', 'id': history.id, 'command': 'estado_sistema'}
+        messages = []
+        while len(messages) < 10 and pushed not in messages:
+            messages.append(await session.receive_json())
+            await session.send_json({'type': 'pong'})
+        self.assertIn(pushed, messages)
+        await session.disconnect()
+        self.assertEqual(await History.objects.filter(id=history.id).values_list('status', flat=True).aget(), 'sent')
+
+
+@override_settings(BOTBRAIN_PUSH_BROKER_INTERVAL=0.05)
+class DatabaseBrokerTests(TestCase):
+    async def test_wakes_connections_with_pending_rows_created_elsewhere(self):
+        raspberry = await Raspberry.objects.acreate(name='Pi 1', slug='pi-1')
+        command = await Command.objects.acreate(name='Estado', slug='estado_sistema')
+        registry = ConnectionRegistry()
+        connection = PushConnection('pi-1', asyncio.get_running_loop())
+        registry.register(connection)
+        broker = DatabaseBroker(registry)
+        broker.ensure_started()
+        try:
+            # Otro worker inserta la fila sin pasar por este proceso
+            await History.objects.acreate(raspberry=raspberry, command=command)
+            await asyncio.wait_for(connection.event.wait(), 2)
+        finally:
+            broker._task.cancel()
+
+
+@override_settings(BOTBRAIN_OUTPUT_FOLLOW_INTERVAL=0.05)
+class CommandOutputTests(TestCase):
+    def setUp(self):
+        self.token = Token.objects.create(user=create_user())
+        self.client = authenticated_client(self.token.user)
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        self.command = Command.objects.create(name='Respaldo', slug='crear_respaldo')
+        self.history = History.objects.create(raspberry=self.raspberry, command=self.command, status='sent')
+        self.append_url = reverse('command-output', args=['pi-1', self.history.id])
+        self.read_url = reverse('history-output', args=[self.history.id])
+
+    async def read(self, **params):
+        response = await AsyncClient().get(
+            self.read_url, params, headers={'Authorization': f'Token {self.token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    def test_appends_chunks_and_ignores_resent_sequence_numbers(self):
+        chunks = [{'seq': 0, 'data': 'a/\n'}, {'seq': 1, 'data': 'error\n', 'stream': 'stderr'}]
+        self.assertEqual(self.client.post(self.append_url, chunks, format='json').data['received'], 2)
+        self.client.post(self.append_url, {'seq': 1, 'data': 'otro\n'}, format='json')
+
+        self.assertEqual(
+            list(ResultChunk.objects.values_list('seq', 'stream', 'data')),
+            [(0, 'stdout', 'a/\n'), (1, 'stderr', 'error\n')]
+        )
+
+    def test_rejects_chunks_for_other_devices_and_finished_commands(self):
+        other_url = reverse('command-output', args=['pi-2', self.history.id])
+        self.assertEqual(self.client.post(other_url, {'seq': 0, 'data': 'x'}, format='json').status_code, 404)
+
+        History.objects.acknowledge('pi-1', self.history.id, 'ok')
+        self.assertEqual(self.client.post(self.append_url, {'seq': 0, 'data': 'x'}, format='json').status_code, 409)
+
+    @override_settings(BOTBRAIN_OUTPUT_CHUNK_MAX_SIZE=4)
+    def test_rejects_oversized_chunks(self):
+        response = self.client.post(self.append_url, {'seq': 0, 'data': '12345'}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    async def test_streams_chunks_in_order_and_resumes_after_a_sequence_number(self):
+        for seq in (2, 0, 1):
+            await ResultChunk.objects.acreate(history=self.history, seq=seq, data=f'linea {seq}\n')
+
+        self.assertEqual(await self.read(), 'linea 0\nlinea 1\nlinea 2\n')
+        self.assertEqual(await self.read(after=0), 'linea 1\nlinea 2\n')
+
+    async def test_follow_tails_output_until_the_command_finishes(self):
+        await ResultChunk.objects.acreate(history=self.history, seq=0, data='inicio\n')
+
+        async def finish_later():
+            await asyncio.sleep(0.2)
+            await ResultChunk.objects.acreate(history=self.history, seq=1, data='fin\n')
+            await sync_to_async(History.objects.acknowledge)('pi-1', self.history.id, 'ok')
+
+        output, _ = await asyncio.gather(self.read(follow=1), finish_later())
+        self.assertEqual(output, 'inicio\nfin\n')
+
+    async def test_commands_without_chunks_stream_their_result(self):
+        await sync_to_async(History.objects.acknowledge)('pi-1', self.history.id, 'resultado completo')
+        self.assertEqual(await self.read(), 'resultado completo')
+
+
+@override_settings(BOTBRAIN_RESULT_COMPRESS_THRESHOLD=100, BOTBRAIN_RESULT_MAX_SIZE=1000)
+class HistoryResultStorageTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def create_sent(self):
+        return History.objects.create(raspberry=self.raspberry, command=self.command, status='sent')
+
+    def stored_result(self, history):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT result FROM bots_history WHERE id = %s', [history.id])
+            return cursor.fetchone()[0]
+
+    def test_long_results_are_compressed_transparently(self):
+        history = self.create_sent()
+        output = 'Mem: 1.0Gi 512Mi\n' * 40
+        History.objects.acknowledge('pi-1', history.id, output)
+
+        stored = self.stored_result(history)
+        self.assertTrue(stored.startswith(COMPRESSED_PREFIX))
+        self.assertLess(len(stored), len(output) / 4)
+        history.refresh_from_db()
+        self.assertEqual(history.result, output)
+        self.assertEqual(history.result_size, len(output))
+
+    def test_short_results_are_stored_as_plain_text(self):
+        history = self.create_sent()
+        History.objects.acknowledge('pi-1', history.id, 'ok')
+        self.assertEqual(self.stored_result(history), 'ok')
+
+    def test_oversized_results_keep_head_and_tail_and_record_the_full_size(self):
+        first, second = self.create_sent(), self.create_sent()
+        output = 'inicio' + 'x' * 5000 + 'final'
+        History.objects.acknowledge('pi-1', first.id, output)
+        History.objects.acknowledge_many('pi-1', {second.id: (output, False)})
+
+        for history in (first, second):
+            history.refresh_from_db()
+            self.assertTrue(history.result_truncated)
+            self.assertEqual(history.result_size, len(output))
+            self.assertLessEqual(len(history.result), 1000)
+            self.assertTrue(history.result.startswith('inicio'))
+            self.assertTrue(history.result.endswith('final'))
+
+            # Guardar de nuevo no pierde el tamaño original
+            history.save()
+            history.refresh_from_db()
+            self.assertEqual((history.result_size, history.result_truncated), (len(output), True))
+
+    def test_list_leaves_the_result_out_and_detail_returns_it(self):
+        history = self.create_sent()
+        History.objects.acknowledge('pi-1', history.id, 'salida')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('history-list'))
+        self.assertNotIn('result', response.data['results'][0])
+        self.assertEqual(response.data['results'][0]['result_size'], 6)
+        self.assertFalse(any(re.search(r'"result"(?!_)', query['sql']) for query in queries))
+
+        response = self.client.get(reverse('history-detail', args=[history.id]))
+        self.assertEqual(response.data['result'], 'salida')
+
+
+class HistoryArchiveTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        settings_override = override_settings(BOTBRAIN_HISTORY_ARCHIVE_DIR=self.directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.token = Token.objects.create(user=create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.now = timezone.now()
+
+    def create(self, days_ago, status='executed', **kwargs):
+        history = History.objects.create(raspberry=self.raspberry, command=self.command, status=status, **kwargs)
+        History.objects.filter(id=history.id).update(created_at=self.now - datetime.timedelta(days=days_ago))
+        return history
+
+    def test_moves_finished_rows_past_retention_to_daily_files(self):
+        old = [self.create(40, result=f'ok {i}') for i in range(3)]
+        failed = self.create(35, status='failed', result='error')
+        ResultChunk.objects.create(history=failed, seq=0, data='salida en vivo\n')
+        pending = self.create(40, status='pending')
+        recent = self.create(1)
+
+        archived = archive_history(self.now - datetime.timedelta(days=30), batch_size=2)
+
+        self.assertEqual(archived, 4)
+        self.assertEqual(set(History.objects.values_list('id', flat=True)), {pending.id, recent.id})
+        self.assertFalse(ResultChunk.objects.exists())
+        self.assertEqual(len(os.listdir(self.directory.name)), 2)
+        self.assertEqual(
+            dict(StatusCounter.objects.filter(count__gt=0).values_list('status', 'count')),
+            {'pending': 1, 'executed': 1}
+        )
+
+        rows = list(read_archive(self.now - datetime.timedelta(days=45), self.now))
+        self.assertEqual([row['id'] for row in rows], [history.id for history in old] + [failed.id])
+        self.assertEqual(rows[0]['result'], 'ok 0')
+        self.assertEqual((rows[0]['priority'], rows[0]['not_before']), (0, None))
+        self.assertEqual(rows[-1]['output'], 'salida en vivo\n')
+        self.assertEqual(archive_history(self.now - datetime.timedelta(days=30)), 0)
+
+    def test_keeps_priority_and_not_before(self):
+        not_before = (self.now - datetime.timedelta(days=39)).replace(microsecond=0)
+        history = self.create(40, priority=5, not_before=not_before)
+        archive_history(self.now - datetime.timedelta(days=30))
+        [row] = read_archive(self.now - datetime.timedelta(days=45), self.now)
+        self.assertEqual(row['id'], history.id)
+        self.assertEqual(row['priority'], 5)
+        self.assertEqual(datetime.datetime.fromisoformat(row['not_before'].replace('Z', '+00:00')), not_before)
+
+    def test_prune_deletes_only_existing_rows(self):
+        kept = self.create(1)
+        pruned = [self.create(40) for _ in range(2)]
+        ids = [history.id for history in pruned] + [kept.id + 1000]
+
+        self.assertEqual(History.objects.prune(iter(ids)), 2)
+        self.assertEqual(list(History.objects.values_list('id', flat=True)), [kept.id])
+        self.assertEqual(dict(StatusCounter.objects.values_list('status', 'count')), {'executed': 1})
+
+    def test_command_respects_retention_and_dry_run(self):
+        self.create(40)
+        self.create(10)
+
+        out = io.StringIO()
+        call_command('archive_history', '--days', '30', '--dry-run', stdout=out)
+        self.assertIn('Se archivarían 1 filas', out.getvalue())
+        self.assertEqual(History.objects.count(), 2)
+
+        call_command('archive_history', '--days', '30', stdout=io.StringIO())
+        self.assertEqual(History.objects.count(), 1)
+
+    async def test_archive_endpoint_streams_filtered_rows_as_json_lines(self):
+        await sync_to_async(self.create)(40, result='uno')
+        await sync_to_async(self.create)(40, status='failed', result='dos')
+        await sync_to_async(archive_history)(self.now - datetime.timedelta(days=30))
+
+        day = (self.now - datetime.timedelta(days=40)).date()
+        response = await AsyncClient().get(
+            reverse('history-archive'),
+            {'start': day.isoformat(), 'end': (day + datetime.timedelta(days=1)).isoformat(), 'status': 'failed'},
+            headers={'Authorization': f'Token {self.token.key}'}
+        )
+        self.assertEqual(response.status_code, 200)
+        body = b''.join([chunk async for chunk in response.streaming_content]).decode()
+        self.assertEqual([json.loads(line)['result'] for line in body.splitlines()], ['dos'])
+
+    def test_archive_endpoint_validates_the_range(self):
+        client = authenticated_client(self.token.user)
+        url = reverse('history-archive')
+        self.assertEqual(client.get(url, {'start': '2026-01-10', 'end': '2026-01-01'}).status_code, 400)
+        self.assertEqual(client.get(url, {'start': '2025-01-01', 'end': '2026-01-01'}).status_code, 400)
+        self.assertEqual(client.get(url, {'start': 'ayer'}).status_code, 400)
+
+
+class ReaperTests(TestCase):
+    def setUp(self):
+        reaped_commands.clear()
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema', timeout=60, max_attempts=2)
+
+    def claim_and_expire(self, seconds=120):
+        claimed = History.objects.claim('pi-1', limit=10)
+        History.objects.filter(status='sent').update(updated_at=timezone.now() - datetime.timedelta(seconds=seconds))
+        return claimed
+
+    def test_requeues_expired_commands_until_attempts_run_out(self):
+        history = History.objects.create(raspberry=self.raspberry, command=self.command)
+
+        self.claim_and_expire()
+        self.assertEqual(History.objects.reap()[('estado_sistema', 'requeued')], 1)
+        history.refresh_from_db()
+        self.assertEqual((history.status, history.attempts), ('pending', 1))
+
+        self.claim_and_expire()
+        self.assertEqual(History.objects.reap()[('estado_sistema', 'timed_out')], 1)
+        history.refresh_from_db()
+        self.assertEqual((history.status, history.attempts), ('timed_out', 2))
+        self.assertEqual(history.result, 'Sin ack tras 2 intentos')
+
+        self.assertEqual(
+            dict(StatusCounter.objects.filter(count__gt=0).values_list('status', 'count')),
+            {'timed_out': 1}
+        )
+        self.assertEqual(reaped_commands.value(command='estado_sistema', outcome='requeued'), 1)
+        self.assertEqual(reaped_commands.value(command='estado_sistema', outcome='timed_out'), 1)
+
+    def test_leaves_recent_and_disabled_commands_alone(self):
+        manual = Command.objects.create(name='Respaldo', slug='crear_respaldo', timeout=0)
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        History.objects.create(raspberry=self.raspberry, command=manual)
+
+        self.claim_and_expire(seconds=30)
+        self.assertEqual(sum(History.objects.reap().values()), 0)
+        History.objects.filter(status='sent').update(updated_at=timezone.now() - datetime.timedelta(days=1))
+        History.objects.reap()
+
+        self.assertEqual(
+            dict(History.objects.values_list('command_id', 'status')),
+            {'estado_sistema': 'pending', 'crear_respaldo': 'sent'}
+        )
+
+    def test_streamed_output_postpones_the_reaper(self):
+        history = History.objects.create(raspberry=self.raspberry, command=self.command)
+        self.claim_and_expire()
+        client = authenticated_client(create_user())
+        client.post(reverse('command-output', args=['pi-1', history.id]), {'seq': 0, 'data': 'sigo vivo'}, format='json')
+
+        self.assertEqual(sum(History.objects.reap().values()), 0)
+
+    def test_management_command_reports_counts(self):
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        self.claim_and_expire()
+        out = io.StringIO()
+        call_command('reap_commands', stdout=out)
+        self.assertIn('estado_sistema\trequeued\t1', out.getvalue())
+        self.assertIn('Reencolados: 1, timed_out: 0', out.getvalue())
+
+    def test_management_command_exports_metrics_file(self):
+        History.objects.create(raspberry=self.raspberry, command=self.command)
+        self.claim_and_expire()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'botbrain_reaper.prom')
+            call_command('reap_commands', metrics_file=path, stdout=io.StringIO())
+            with open(path) as exported:
+                text = exported.read()
+            self.assertEqual(os.listdir(directory), ['botbrain_reaper.prom'])
+        self.assertIn('# TYPE botbrain_reaped_commands_total counter', text)
+        self.assertIn('botbrain_reaped_commands_total{command="estado_sistema",outcome="requeued"} 1', text)
+        self.assertNotIn('botbrain_http_requests_total', text)
+
+
+class QueuePriorityTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+        self.urgent = Command.objects.create(name='Reiniciar', slug='reiniciar_servicios')
+
+    def test_urgent_commands_jump_the_queue_and_ties_keep_creation_order(self):
+        first = History.objects.create(raspberry=self.raspberry, command=self.command)
+        second = History.objects.create(raspberry=self.raspberry, command=self.command)
+        urgent = History.objects.create(raspberry=self.raspberry, command=self.urgent, priority=10)
+        low = History.objects.create(raspberry=self.raspberry, command=self.command, priority=-5)
+
+        claimed = History.objects.claim('pi-1', limit=10)
+        self.assertEqual([history_id for history_id, _ in claimed], [urgent.id, first.id, second.id, low.id])
+
+    def test_deferred_commands_wait_for_not_before(self):
+        now = timezone.now()
+        deferred = History.objects.create(
+            raspberry=self.raspberry, command=self.command, priority=10, not_before=now + datetime.timedelta(hours=1)
+        )
+        due = History.objects.create(raspberry=self.raspberry, command=self.command)
+
+        self.assertEqual(History.objects.claim('pi-1', limit=10), [(due.id, 'estado_sistema')])
+        self.assertEqual(History.objects.claim('pi-1'), [])
+        self.assertEqual(History.objects.next_scheduled('pi-1'), deferred.not_before)
+
+        History.objects.filter(id=deferred.id).update(not_before=now - datetime.timedelta(seconds=1))
+        self.assertEqual(History.objects.claim('pi-1'), [(deferred.id, 'estado_sistema')])
+
+    def test_claim_order_is_read_from_the_index(self):
+        plan = History.objects.claimable('pi-1').values_list('id', 'command_id')[:5].explain()
+        if connection.vendor == 'sqlite':
+            self.assertIn('history_claim_idx', plan)
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_fan_out_accepts_priority_and_not_before(self):
+        Raspberry.objects.create(name='Pi 2', slug='pi-2')
+        not_before = timezone.now() + datetime.timedelta(hours=2)
+        response = self.client.post(reverse('history-fan-out'), {
+            'command_slug': 'estado_sistema', 'raspberry_slugs': 'all',
+            'priority': -1, 'not_before': not_before.isoformat()
+        }, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            set(History.objects.values_list('priority', 'not_before')),
+            {(-1, not_before)}
+        )
+        self.assertEqual(self.client.get(reverse('get-pending-commands', args=['pi-2'])).status_code, 404)
+
+    async def test_push_channel_delivers_deferred_commands_when_due(self):
+        token = await sync_to_async(Token.objects.get)(user__email='bot@example.com')
+        history = await History.objects.acreate(
+            raspberry=self.raspberry, command=self.command,
+            not_before=timezone.now() + datetime.timedelta(seconds=0.3)
+        )
+        session = SocketSession('/api/bot/raspberries/pi-1/socket/', token=token.key)
+        await session.connect()
+        message = await session.receive_json(timeout=3)
+        self.assertEqual(message, {'type': 'command', 'id': history.id, 'command': 'estado_sistema'})
+        await session.disconnect()
+
+
+class ReplicaRouterTests(TestCase):
+    def test_only_marked_reads_go_to_replicas(self):
+        router = ReplicaRouter()
+        with mock.patch('conf.routers.get_replicas', return_value=['replica_0']):
+            self.assertEqual(router.db_for_read(History), 'default')
+            with replica_reads():
+                self.assertEqual(router.db_for_read(History), 'replica_0')
+                self.assertEqual(router.db_for_write(History), 'default')
+        with replica_reads():
+            # Sin réplicas configuradas todo va a la principal
+            self.assertEqual(router.db_for_read(History), 'default')
+
+    def test_list_endpoints_read_from_replicas_and_device_endpoints_do_not(self):
+        client = authenticated_client(create_user())
+        Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        seen = []
+
+        def record(router, model, **hints):
+            seen.append((model.__name__, replica_reads_active()))
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=record):
+            client.get(reverse('history-list'))
+            client.get(reverse('raspberry-list'))
+            self.assertTrue(seen and all(replica for _, replica in seen))
+            seen.clear()
+            client.get(reverse('get-pending-commands', args=['pi-1']))
+            self.assertTrue(seen and not any(replica for _, replica in seen))
+
+
+class LoadTestTests(TransactionTestCase):
+    def test_mix_and_percentiles(self):
+        self.assertEqual(parse_mix('poll=3,ack=1'), {'poll': 3.0, 'ack': 1.0})
+        with self.assertRaises(ValueError):
+            parse_mix('poll=1,borrar=2')
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 0.50), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertIsNone(percentile([], 0.5))
+
+    def test_fleet_against_local_server_reports_each_operation(self):
+        # Filas previas con nombres parecidos no se tocan
+        existing_user = create_user('loadtest@example.com')
+        Raspberry.objects.create(name='Pi previo', slug='loadtest-0')
+        output = io.StringIO()
+        call_command('loadtest', '--devices', '2', '--duration', '1', '--backlog', '2', stdout=output, stderr=io.StringIO())
+        report = json.loads(output.getvalue())
+
+        self.assertEqual(report['config']['devices'], 2)
+        self.assertGreater(report['totals']['requests'], 0)
+        self.assertEqual(report['totals']['errors'], 0)
+        poll = report['operations']['poll']
+        self.assertEqual(set(poll['latency_ms']), {'mean', 'p50', 'p95', 'p99', 'max'})
+        self.assertGreater(poll['db_queries'], 0)
+        # Se borra solo lo que creó la corrida
+        self.assertEqual(list(Raspberry.objects.values_list('slug', flat=True)), ['loadtest-0'])
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), [existing_user.username])
+        self.assertFalse(Command.objects.exists())
+
+    def test_refuses_live_database_without_flag(self):
+        with mock.patch.dict(connection.settings_dict, {'NAME': '/srv/botbrain/db.sqlite3'}):
+            with self.assertRaisesMessage(CommandError, '--allow-live-database'):
+                call_command('loadtest', '--devices', '1', '--duration', '1', stderr=io.StringIO())
+        self.assertFalse(Raspberry.objects.exists())
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        Raspberry.objects.create(name='Pi 1', slug='pi-1')
+
+    def test_histogram_exposition(self):
+        latency = MetricHistogram('test_latency_seconds', 'Latencia de prueba', ['view'], buckets=(0.1, 1))
+        latency.observe(0.05, view='a')
+        latency.observe(0.5, view='a')
+        latency.observe(3, view='a')
+        text = render_prometheus({latency.name: latency})
+        self.assertIn('# TYPE test_latency_seconds histogram', text)
+        self.assertIn('test_latency_seconds_bucket{view="a",le="0.1"} 1', text)
+        self.assertIn('test_latency_seconds_bucket{view="a",le="1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{view="a",le="+Inf"} 3', text)
+        self.assertIn('test_latency_seconds_sum{view="a"} 3.55', text)
+        self.assertIn('test_latency_seconds_count{view="a"} 3', text)
+
+    def test_requests_are_measured_per_view_and_exposed(self):
+        requests = request_count.value(view='history-list', method='GET', status=200)
+        measured = request_queries.count(view='history-list')
+        self.client.get(reverse('history-list'))
+        self.assertEqual(request_count.value(view='history-list', method='GET', status=200), requests + 1)
+        self.assertEqual(request_queries.count(view='history-list'), measured + 1)
+
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('botbrain_http_requests_total{view="history-list",method="GET",status="200"}', text)
+        self.assertIn('botbrain_http_db_queries_bucket{view="history-list"', text)
+        self.assertIn('botbrain_http_serialize_duration_seconds_count{view="history-list"}', text)
+        self.assertIn('botbrain_http_render_duration_seconds_count{view="history-list"}', text)
+        self.assertIn('botbrain_http_response_size_bytes_count{view="history-list"}', text)
+
+    async def test_async_long_poll_is_measured(self):
+        measured = request_queries.count(view='get-pending-commands')
+        token = await Token.objects.aget(user__username='bot')
+        response = await AsyncClient().get(
+            reverse('get-pending-commands', args=['pi-1']), headers={'Authorization': f'Token {token.key}'}
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(request_queries.count(view='get-pending-commands'), measured + 1)
+        # Las consultas dentro de sync_to_async también cuentan
+        queries = {labels['view']: total_sum for labels, _, total_sum, _ in request_queries.samples()}
+        self.assertGreater(queries['get-pending-commands'], 0)
+
+    def test_fast_path_encoding_counts_as_rendering(self):
+        History.objects.create(raspberry_id='pi-1', command=Command.objects.create(name='Estado', slug='estado_sistema'))
+        measured = request_render_duration.count(view='get-pending-commands')
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']), {'limit': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(request_render_duration.count(view='get-pending-commands'), measured + 1)
+
+    def test_serializer_work_is_timed(self):
+        measured = request_serialize_duration.count(view='raspberry-list')
+        with request_stats() as stats:
+            self.client.get(reverse('raspberry-list'))
+        self.assertEqual(request_serialize_duration.count(view='raspberry-list'), measured + 1)
+        self.assertGreater(stats.serialize_time, 0)
+
+    def test_nested_serializer_data_is_not_counted_twice(self):
+        class Inner(serializers.Serializer):
+            def to_representation(self, instance):
+                time.sleep(0.05)
+                return {}
+
+        class Outer(serializers.Serializer):
+            inner = serializers.SerializerMethodField()
+
+            def get_inner(self, instance):
+                return Inner(instance).data
+
+        with request_stats() as stats:
+            Outer({}).data
+        self.assertGreaterEqual(stats.serialize_time, 0.05)
+        self.assertLess(stats.serialize_time, 0.1)
+
+    def test_outer_request_stats_see_the_request_queries(self):
+        # Así cuenta el load test las consultas por operación
+        with request_stats() as stats:
+            self.client.get(reverse('raspberry-list'))
+        self.assertGreater(stats.queries, 0)
+        self.assertGreater(stats.render_time, 0)
+
+    @override_settings(BOTBRAIN_METRICS_TOKEN='scrape-secret')
+    def test_metrics_token(self):
+        scraper = Client()
+        self.assertEqual(scraper.get(reverse('metrics')).status_code, 401)
+        response = scraper.get(reverse('metrics'), headers={'Authorization': 'Bearer scrape-secret'})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(BOTBRAIN_SLOW_REQUEST_THRESHOLD=0.000001)
+    def test_slow_requests_log_their_sql(self):
+        with self.assertLogs('bots.instrumentation', 'WARNING') as logs:
+            self.client.get(reverse('raspberry-list'))
+        self.assertIn('raspberry-list', logs.output[0])
+        self.assertIn('bots_raspberry', logs.output[0])
+
+
+class DeviceFastPathTests(TestCase):
+    def setUp(self):
+        self.client = authenticated_client(create_user())
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def test_get_command_bodies_are_plain_json(self):
+        first = History.objects.create(raspberry=self.raspberry, command=self.command)
+        second = History.objects.create(raspberry=self.raspberry, command=self.command)
+
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']))
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(response.content), {'id': first.id, 'command': 'estado_sistema'})
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']), {'limit': 5})
+        self.assertEqual(json.loads(response.content), [{'id': second.id, 'command': 'estado_sistema'}])
+        response = self.client.get(reverse('get-pending-commands', args=['pi-1']))
+        self.assertEqual(json.loads(response.content), {'message': 'No pending commands'})
+
+    def test_ack_validation_matches_the_serializer(self):
+        url = reverse('ack-command', args=['pi-1'])
+        for body in (
+            {'command_id': 'x', 'result': ' '},
+            {'result': 'ok', 'success': 'quizá'},
+            {'command_id': None, 'result': 'a\x00b'},
+            [1, 2],
+        ):
+            serializer = AckCommandSerializer(data=body)
+            self.assertFalse(serializer.is_valid())
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.content), {'message': 'Invalid data', 'errors': serializer.errors})
+
+    def test_ack_accepts_json_and_form_bodies(self):
+        first, second = (History.objects.create(raspberry=self.raspberry, command=self.command) for _ in range(2))
+        url = reverse('ack-command', args=['pi-1'])
+        response = self.client.post(url, {'command_id': first.id, 'result': ' ok\n', 'success': False}, format='json')
+        self.assertEqual(json.loads(response.content), {'status': 'success'})
+        response = self.client.post(url, {'command_id': str(second.id), 'result': 'ok', 'success': 'true'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            list(History.objects.order_by('id').values_list('status', 'result')),
+            [('failed', 'ok'), ('executed', 'ok')]
+        )
+        response = self.client.post(url, {'command_id': 999, 'result': 'ok'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+    def test_malformed_json_is_a_client_error(self):
+        response = self.client.post(
+            reverse('ack-command', args=['pi-1']), '{"command_id": 1,', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_encoding_without_orjson(self):
+        payload = {'message': 'ñandú', 'errors': {'result': ['This field may not be blank.']}}
+        encoded = fastpath.dumps(payload)
+        with mock.patch.object(fastpath, 'orjson', None):
+            # El respaldo con json produce los mismos bytes compactos
+            self.assertEqual(fastpath.dumps(payload), encoded)
+            self.assertEqual(fastpath.loads(encoded), payload)
+        self.assertEqual(fastpath.command_entry(7, 'estado_sistema'), b'{"id":7,"command":"estado_sistema"}')
+
+    def test_benchmark_command(self):
+        output = io.StringIO()
+        call_command('bench_device_views', '--iterations', '20', stdout=output)
+        report = json.loads(output.getvalue())
+        self.assertEqual(set(report['routes']), {'get-command', 'get-command?limit=10', 'ack-command'})
+        for route in report['routes'].values():
+            self.assertGreater(route['serializers_us'], 0)
+            self.assertGreater(route['fast_path_us'], 0)
+
+
+class AckReplayTests(TestCase):
+    def setUp(self):
+        self.raspberry = Raspberry.objects.create(name='Pi 1', slug='pi-1')
+        self.command = Command.objects.create(name='Estado', slug='estado_sistema')
+
+    def test_replayed_acks_leave_finished_rows_untouched(self):
+        single, bulk = (History.objects.create(raspberry=self.raspberry, command=self.command) for _ in range(2))
+        self.assertTrue(History.objects.acknowledge('pi-1', single.id, 'primero'))
+        self.assertEqual(History.objects.acknowledge_many('pi-1', {bulk.id: ('primero', False)}), [bulk.id])
+        before = list(History.objects.order_by('id').values_list('status', 'result', 'updated_at'))
+
+        with self.assertNumQueries(1):
+            self.assertTrue(History.objects.acknowledge('pi-1', single.id, 'repetido', success=False))
+        self.assertEqual(History.objects.acknowledge_many('pi-1', {bulk.id: ('repetido', True)}), [bulk.id])
+
+        self.assertEqual(list(History.objects.order_by('id').values_list('status', 'result', 'updated_at')), before)
+        self.assertEqual(
+            dict(StatusCounter.objects.values_list('status', 'count')), {'pending': 0, 'executed': 1, 'failed': 1}
+        )
+
+    def test_failed_counter_adjustment_rolls_back_the_ack(self):
+        history = History.objects.create(raspberry=self.raspberry, command=self.command)
+        with mock.patch.object(StatusCounter.objects, 'adjust', side_effect=RuntimeError('sin base')):
+            with self.assertRaises(RuntimeError):
+                History.objects.acknowledge('pi-1', history.id, 'hecho')
+        history.refresh_from_db()
+        self.assertEqual(history.status, 'pending')
+        self.assertTrue(History.objects.acknowledge('pi-1', history.id, 'hecho'))
+        self.assertEqual(dict(StatusCounter.objects.values_list('status', 'count')), {'pending': 0, 'executed': 1})
+
+
+class PollSchedulerTests(SimpleTestCase):
+    def delays(self, scheduler, polls, **record):
+        delays = []
+        for _ in range(polls):
+            scheduler.record(False, **record)
+            delays.append(scheduler.next_delay())
+        return delays
+
+    def test_idle_backoff_grows_exponentially_up_to_the_maximum(self):
+        with mock.patch('blueman.random.uniform', side_effect=lambda low, high: high):
+            delays = self.delays(blueman.PollScheduler(base=2, maximum=300), 10)
+        self.assertEqual(delays, [2, 4, 8, 16, 32, 64, 128, 256, 300, 300])
+
+    def test_retry_after_is_a_floor_not_a_replacement(self):
+        with mock.patch('blueman.random.uniform', side_effect=lambda low, high: low):
+            delays = self.delays(blueman.PollScheduler(base=2, maximum=300), 10, retry_after=10)
+        self.assertEqual(delays[:4], [10, 10, 10, 10])
+        self.assertEqual(delays[-3:], [128, 150, 150])
+
+    def test_work_and_long_polls_skip_the_backoff(self):
+        scheduler = blueman.PollScheduler()
+        self.delays(scheduler, 5)
+        scheduler.record(True)
+        self.assertEqual(scheduler.next_delay(), 0)
+        scheduler.record(False, long_polled=True)
+        self.assertEqual(scheduler.next_delay(), 0)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(blueman.parse_retry_after('10'), 10)
+        self.assertEqual(blueman.parse_retry_after('-5'), 0)
+        self.assertIsNone(blueman.parse_retry_after(''))
+        self.assertIsNone(blueman.parse_retry_after('pronto'))
+        self.assertEqual(blueman.parse_retry_after('Mon, 01 Jan 2001 00:00:00 GMT'), 0)
+
+
+class FakeWebSocket:
+    """Socket de websocket-client: entrega `messages` y registra lo enviado"""
+
+    def __init__(self, bot, messages, reply_to_acks):
+        self.bot = bot
+        self.inbox = queue.Queue()
+        for message in messages:
+            self.inbox.put(json.dumps(message))
+        self.reply_to_acks = reply_to_acks
+        self.sent = []
+        self.spooled_when_sent = []
+
+    def recv(self):
+        message = self.inbox.get(timeout=5)
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    def send(self, text):
+        data = json.loads(text)
+        self.sent.append(data)
+        if data['type'] != 'ack':
+            return
+        self.spooled_when_sent.append(len(self.bot.spool))
+        if self.reply_to_acks:
+            self.inbox.put(json.dumps({'type': 'ack', 'command_id': data['command_id'], 'status': 'success'}))
+        # El servidor se reinicia justo después
+        self.inbox.put(ConnectionError('conexión cerrada'))
+
+    def close(self):
+        pass
+
+
+class BotPushAckTests(SimpleTestCase):
+    def run_push(self, reply_to_acks):
+        bot = blueman.Bot('http://testserver/api/bot', 'clave', 'pi-1', spool_path=':memory:')
+        bot.stream_output = False
+        bot.commands = {'eco': lambda: 'hola'}
+        ws = FakeWebSocket(bot, [{'type': 'command', 'id': 5, 'command': 'eco'}], reply_to_acks)
+        with mock.patch.object(blueman, 'websocket', mock.Mock(create_connection=mock.Mock(return_value=ws))):
+            with self.assertRaises(ConnectionError):
+                bot.run_push()
+        return bot, ws
+
+    def test_confirmed_push_acks_leave_the_spool(self):
+        bot, ws = self.run_push(reply_to_acks=True)
+        self.assertEqual(ws.sent, [{'type': 'ack', 'command_id': 5, 'result': 'hola', 'success': True}])
+        self.assertEqual(ws.spooled_when_sent, [1])
+        self.assertEqual(len(bot.spool), 0)
+
+    def test_unconfirmed_push_acks_are_resent_over_http(self):
+        bot, ws = self.run_push(reply_to_acks=False)
+        self.assertEqual(bot.spool.pending(10), [(5, 'hola', True)])
+        self.assertTrue(bot._results_ready.is_set())
+
+
+def bot_response(status_code, data=None):
+    """requests.Response del servidor; sin `data`, un cuerpo que no es JSON"""
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(data).encode() if data is not None else b'<h1>Not Found</h1>'
+    return response
+
+
+def make_bot(**kwargs):
+    bot = blueman.Bot('http://testserver/api/bot', 'clave', 'pi-1', spool_path=':memory:', **kwargs)
+    bot.stream_output = False
+    bot.session = mock.Mock()
+    return bot
+
+
+class ResultSpoolTests(SimpleTestCase):
+    def test_same_command_is_stored_once_and_replayed_oldest_first(self):
+        spool = blueman.ResultSpool(':memory:')
+        spool.add(1, 'primero', True)
+        spool.add(2, 'segundo', False)
+        spool.add(1, 'repetido', True)
+        self.assertEqual(len(spool), 2)
+        self.assertEqual(spool.pending(10), [(2, 'segundo', False), (1, 'repetido', True)])
+        spool.remove([2])
+        self.assertEqual(spool.pending(10), [(1, 'repetido', True)])
+
+    def test_survives_a_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'spool.sqlite3')
+            spool = blueman.ResultSpool(path)
+            spool.add(7, 'ok', True)
+            spool.mark_attempt([7])
+            spool._connection.close()
+            reopened = blueman.ResultSpool(path)
+            self.assertEqual(reopened.pending(10), [(7, 'ok', True)])
+            reopened._connection.close()
+
+
+class BotAckTests(SimpleTestCase):
+    def setUp(self):
+        self.bot = make_bot()
+        self.results = [(1, 'uno', True), (2, 'dos', False)]
+
+    def posted_urls(self):
+        return [call.args[0].rsplit('/', 2)[-2] for call in self.bot.session.post.call_args_list]
+
+    def test_bulk_ack_delivers_the_whole_batch(self):
+        self.bot.session.post.return_value = bot_response(200, {'status': 'success', 'not_found': []})
+        for command_id, result, success in self.results:
+            self.bot.spool.add(command_id, result, success)
+        self.assertTrue(self.bot.flush_spool())
+        self.assertEqual(self.posted_urls(), ['ack-commands'])
+        self.assertEqual(len(self.bot.spool), 0)
+
+    def test_missing_bulk_route_falls_back_to_single_acks(self):
+        self.bot.session.post.side_effect = [bot_response(404), bot_response(200, {}), bot_response(200, {})]
+        self.assertEqual(self.bot._send_command_results(self.results), [1, 2])
+        self.assertFalse(self.bot.bulk_ack_supported)
+        self.assertEqual(self.posted_urls(), ['ack-commands', 'ack-command', 'ack-command'])
+
+    def test_api_404_on_bulk_ack_is_retried_later(self):
+        self.bot.session.post.return_value = bot_response(404, {'message': 'Raspberry not found'})
+        for command_id, result, success in self.results:
+            self.bot.spool.add(command_id, result, success)
+        self.assertFalse(self.bot.flush_spool())
+        self.assertTrue(self.bot.bulk_ack_supported)
+        self.assertEqual(len(self.bot.spool), 2)
+
+    def test_invalid_entry_in_a_batch_is_isolated(self):
+        self.bot.session.post.side_effect = [bot_response(400, {}), bot_response(200, {}), bot_response(503, {})]
+        self.assertEqual(self.bot._send_command_results(self.results), [1])
+
+    def test_single_ack_404s(self):
+        self.bot.session.post.return_value = bot_response(404, {'message': blueman.COMMAND_NOT_FOUND})
+        self.assertTrue(self.bot._send_command_result(1, 'uno', True))
+        self.bot.session.post.return_value = bot_response(404, {'message': 'Raspberry not found'})
+        self.assertFalse(self.bot._send_command_result(1, 'uno', True))
+        self.bot.session.post.side_effect = requests.ConnectionError('sin red')
+        self.assertFalse(self.bot._send_command_result(1, 'uno', True))
+
+
+class BotConcurrencyTests(SimpleTestCase):
+    def setUp(self):
+        self.bot = make_bot(max_parallel=2)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.bot.commands = {'lento': lambda: 'listo' if self.release.wait(5) else 'nunca'}
+        self.reports = queue.Queue()
+
+    def report(self, command_id, result, success):
+        self.reports.put((command_id, result, success))
+
+    def test_free_slots_waits_for_a_running_command(self):
+        self.assertEqual(self.bot._free_slots(), 2)
+        self.bot._submit(1, 'lento', self.report)
+        self.bot._submit(2, 'lento', self.report)
+        free = queue.Queue()
+        waiter = threading.Thread(target=lambda: free.put(self.bot._free_slots()), daemon=True)
+        waiter.start()
+        with self.assertRaises(queue.Empty):
+            free.get(timeout=0.2)
+
+        self.release.set()
+        self.assertGreaterEqual(free.get(timeout=5), 1)
+        self.assertEqual({self.reports.get(timeout=5)[0] for _ in range(2)}, {1, 2})
+
+    def test_timed_out_command_is_reported_once(self):
+        self.bot.command_timeouts = {'lento': 0.1}
+        self.bot._submit(1, 'lento', self.report)
+        command_id, result, success = self.reports.get(timeout=5)
+        self.assertEqual((command_id, success), (1, False))
+        self.assertIn('Timeout', result)
+
+        # Cuando el comando termina de verdad no se reporta otra vez, pero libera su hueco
+        self.release.set()
+        with self.assertRaises(queue.Empty):
+            self.reports.get(timeout=0.3)
+        self.assertEqual(self.bot._free_slots(), 2)
+
+
+class OutputStreamTests(SimpleTestCase):
+    def setUp(self):
+        self.bot = make_bot()
+        self.posted = []
+
+        def post(url, json, timeout):
+            time.sleep(0.05)
+            self.posted.extend(json)
+            return bot_response(200, {'status': 'success'})
+
+        self.bot.session.post.side_effect = post
+
+    def test_concurrent_writes_arrive_in_order_without_waiting_for_the_network(self):
+        output = blueman.OutputStream(self.bot, 1, chunk_size=8, interval=0)
+        slowest = []
+
+        def pump(stream):
+            for index in range(20):
+                started = time.monotonic()
+                output.write(stream, f'{stream[3]}{index:02d}\n')
+                slowest.append(time.monotonic() - started)
+
+        pumps = [threading.Thread(target=pump, args=(stream,)) for stream in ('stdout', 'stderr')]
+        for thread in pumps:
+            thread.start()
+        for thread in pumps:
+            thread.join()
+        output.flush()
+
+        self.assertLess(max(slowest), 0.04)
+        self.assertEqual([chunk['seq'] for chunk in self.posted], list(range(output.seq)))
+        for stream in ('stdout', 'stderr'):
+            text = ''.join(chunk['data'] for chunk in self.posted if chunk['stream'] == stream)
+            self.assertEqual(text, ''.join(f'{stream[3]}{index:02d}\n' for index in range(20)))
+
+    def test_flush_sends_the_tail_and_a_rejection_stops_streaming(self):
+        output = blueman.OutputStream(self.bot, 1, chunk_size=1000, interval=60)
+        output._last_flush = time.monotonic()
+        output.write('stdout', 'sin enviar todavía\n')
+        self.assertEqual(self.posted, [])
+        output.flush()
+        self.assertEqual([chunk['data'] for chunk in self.posted], ['sin enviar todavía\n'])
+
+        self.bot.session.post.side_effect = None
+        self.bot.session.post.return_value = bot_response(404, {'message': 'Command not found for this Raspberry Pi'})
+        self.bot.session.post.reset_mock()
+        rejected = blueman.OutputStream(self.bot, 2)
+        rejected.write('stdout', 'a\n')
+        rejected.flush()
+        rejected.write('stdout', 'b\n')
+        rejected.flush()
+        self.assertEqual(self.bot.session.post.call_count, 1)
+        self.assertFalse(rejected.enabled)
@@ -3,10 +3,17 @@ from . import views
 
 urlpatterns = [
     path('history/', views.HistoryCreateView.as_view(), name='history-create'),
+    path('history/bulk/', views.HistoryFanOutView.as_view(), name='history-fan-out'),
     path('history/list/', views.HistoryListView.as_view(), name='history-list'),
+    path('history/archive/', views.HistoryArchiveView.as_view(), name='history-archive'),
     path('history/<int:pk>/', views.HistoryDetailView.as_view(), name='history-detail'),
+    path('history/<int:pk>/output/', views.HistoryOutputView.as_view(), name='history-output'),
     path('commands/list/', views.CommandListView.as_view(), name='command-list'),
+    path('cache/stats/', views.CatalogCacheStatsView.as_view(), name='catalog-cache-stats'),
     path('raspberries/list/', views.RaspberryListView.as_view(), name='raspberry-list'),
-    path('raspberries/<slug:raspberry_slug>/get-command/', views.PendingCommandView.as_view(), name='get-pending-commands'),
+    path('raspberries/summary/', views.RaspberrySummaryView.as_view(), name='raspberry-summary'),
+    path('raspberries/<slug:raspberry_slug>/get-command/', views.pending_command_view, name='get-pending-commands'),
     path('raspberries/<slug:raspberry_slug>/ack-command/', views.AckCommandView.as_view(), name='ack-command'),
+    path('raspberries/<slug:raspberry_slug>/ack-commands/', views.BulkAckCommandView.as_view(), name='ack-commands'),
+    path('raspberries/<slug:raspberry_slug>/commands/<int:command_id>/output/', views.CommandOutputView.as_view(), name='command-output'),
 ]
\ No newline at end of file
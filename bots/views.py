@@ -1,20 +1,180 @@
+import asyncio
+import datetime
+import hashlib
+import json
+import math
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date, quote_etag
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status, generics
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from django.shortcuts import get_object_or_404
-from .models import History, Raspberry, Command
-from .serializers import HistorySerializer,  RaspberrySerializer, CommandSerializer, PendingCommandSerializer, AckCommandSerializer, CommandResponseSerializer, AckResponseSerializer
-from rest_framework.permissions import IsAuthenticated
+from . import catalog, fastpath, metrics, push
+from .archive import read_archive
+from .pagination import KeysetPagination
+from .models import History, Raspberry, Command, ResultChunk, StatusCounter
+from .signals import announce_queued
+from .serializers import HistorySerializer, HistoryListSerializer, HistoryFanOutSerializer, RaspberrySerializer, CommandSerializer, AckCommandSerializer, BulkAckResponseSerializer, ResultChunkSerializer
+from rest_framework.permissions import IsAuthenticated, IsAdminUser
+from rest_framework.settings import api_settings
+from .authentication import DeviceKeyAuthentication, IsDeviceOwnerOrAuthenticated
+from conf.routers import replica_reads
+
+# Estados que siempre aparecen en el resumen, aunque estén en cero
+SUMMARY_STATUSES = ['pending', 'sent', 'executed', 'failed', 'timed_out']
+
+# Estados en los que el comando todavía puede producir salida
+RUNNING_STATUSES = ['pending', 'sent']
+
+# Las rutas del dispositivo aceptan además su clave propia (Authorization: Device ...)
+DEVICE_AUTHENTICATION_CLASSES = [*api_settings.DEFAULT_AUTHENTICATION_CLASSES, DeviceKeyAuthentication]
+
+class ReplicaReadMixin:
+    """Las lecturas de la vista van a una réplica si hay configuradas (ver conf.routers)"""
+    def dispatch(self, request, *args, **kwargs):
+        with replica_reads():
+            return super().dispatch(request, *args, **kwargs)
+
+class ConditionalListMixin:
+    """
+    ETag fuerte y Last-Modified para catálogos que cambian poco. Los
+    validadores salen de agregados baratos: filas y max(updated_at) del
+    modelo, más el total y el último cambio de StatusCounter y el último id
+    de History (los conteos por fila). Un If-None-Match que coincide recibe 304 sin
+    serializar. Last-Modified no refleja borrados de filas del catálogo; el
+    ETag sí.
+    """
+    validator_model = None
+
+    def get_validators(self):
+        catalog_state = self.validator_model.objects.aggregate(rows=Count('pk'), last=Max('updated_at'))
+        counter_state = StatusCounter.objects.aggregate(total=Sum('count'), last=Max('updated_at'))
+        last_history_id = History.objects.aggregate(last=Max('id'))['last']
+
+        # La representación (JSON o API navegable) también forma parte del ETag
+        state = [
+            self.request.accepted_renderer.media_type,
+            catalog_state['rows'], catalog_state['last'], counter_state['total'], counter_state['last'],
+            last_history_id,
+        ]
+        etag = quote_etag(hashlib.sha1(repr(state).encode()).hexdigest())
+        moments = [moment for moment in (catalog_state['last'], counter_state['last']) if moment]
+        last_modified = int(max(moments).timestamp()) if moments else None
+        return etag, last_modified
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_validators()
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+
+        response.headers['ETag'] = etag
+        if last_modified is not None:
+            response.headers['Last-Modified'] = http_date(last_modified)
+        # Un proxy compartido puede guardarla pese a Authorization, pero revalida
+        # (y así autentica) cada petición salvo que BOTBRAIN_LIST_MAX_AGE lo permita
+        patch_cache_control(
+            response, public=True, must_revalidate=True, max_age=getattr(settings, 'BOTBRAIN_LIST_MAX_AGE', 0)
+        )
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+def raspberry_not_found():
+    return Response(
+        {'message': 'Raspberry not found'},
+        status=status.HTTP_404_NOT_FOUND
+    )
 
 class HistoryCreateView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     queryset = History.objects.all()
     serializer_class = HistorySerializer
 
-class HistoryListView(generics.ListAPIView):
+class HistoryFanOutView(APIView):
     permission_classes = [IsAuthenticated]
-    queryset = History.objects.all().order_by("-created_at")[:30] #filter(status='pending')
-    serializer_class = HistorySerializer
+    def post(self, request):
+        """
+        Crea el mismo comando para muchos Raspberry Pi en una sola petición.
+        Los fallos por dispositivo se reportan sin abortar el resto del lote
+        """
+        serializer = HistoryFanOutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(
+                {'message': 'Invalid data', 'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        command_slug = serializer.validated_data['command_slug']
+        selector = serializer.validated_data['raspberry_slugs']
+        priority = serializer.validated_data['priority']
+        not_before = serializer.validated_data.get('not_before')
+
+        if not catalog.commands.exists(command_slug):
+            return Response(
+                {'message': f'Command not found: {command_slug}'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        # Resolver todos los slugs en una sola consulta
+        raspberries = Raspberry.objects.order_by()
+        if selector != 'all':
+            raspberries = raspberries.filter(slug__in=selector)
+        found = set(raspberries.values_list('slug', flat=True))
+
+        if selector == 'all':
+            targets = sorted(found)
+            failed = []
+        else:
+            targets = [slug for slug in selector if slug in found]
+            failed = [
+                {'raspberry_slug': slug, 'error': 'Raspberry not found'}
+                for slug in selector if slug not in found
+            ]
+
+        created = []
+        batch_size = getattr(settings, 'BOTBRAIN_FANOUT_BATCH_SIZE', 500)
+        for start in range(0, len(targets), batch_size):
+            batch = targets[start:start + batch_size]
+            try:
+                with transaction.atomic():
+                    History.objects.bulk_create([
+                        History(raspberry_id=slug, command_id=command_slug, priority=priority, not_before=not_before)
+                        for slug in batch
+                    ])
+                    # bulk_create no emite post_save: contadores en un solo UPDATE por lote
+                    StatusCounter.objects.adjust({(slug, command_slug, 'pending'): 1 for slug in batch})
+                created.extend(batch)
+            except Exception as e:
+                failed.extend({'raspberry_slug': slug, 'error': str(e)} for slug in batch)
+
+        # bulk_create no emite post_save: avisar explícitamente a quien espera
+        announce_queued(created)
+
+        return Response(
+            {'command_slug': command_slug, 'created': len(created), 'failed': failed},
+            status=status.HTTP_201_CREATED if created else status.HTTP_400_BAD_REQUEST
+        )
+
+class HistoryListView(ReplicaReadMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    # Los filtros se aplican antes del límite; KeysetPagination ordena y corta.
+    # El resultado solo se lee en HistoryDetailView
+    queryset = History.objects.select_related('raspberry', 'command').defer('result')
+    serializer_class = HistoryListSerializer
+    pagination_class = KeysetPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -22,12 +182,12 @@ class HistoryListView(generics.ListAPIView):
         # Filtrar por raspberry si se proporciona
         raspberry_slug = self.request.query_params.get('raspberry')
         if raspberry_slug:
-            queryset = queryset.filter(raspberry__slug=raspberry_slug)
+            queryset = queryset.filter(raspberry_id=raspberry_slug)
             
         # Filtrar por comando si se proporciona
         command_slug = self.request.query_params.get('command')
         if command_slug:
-            queryset = queryset.filter(command__slug=command_slug)
+            queryset = queryset.filter(command_id=command_slug)
             
         # Filtrar por status si se proporciona
         status = self.request.query_params.get('status')
@@ -38,91 +198,427 @@ class HistoryListView(generics.ListAPIView):
 
 class HistoryDetailView(generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
-    queryset = History.objects.all()
+    queryset = History.objects.select_related('raspberry', 'command')
     serializer_class = HistorySerializer
 
-class RaspberryListView(generics.ListAPIView):
+async def stream_output(history_id, after=-1, follow=False):
+    """
+    Emite los trozos de salida con seq > `after` en orden. Con `follow` sigue
+    esperando trozos nuevos mientras el comando corre. Comandos sin trozos
+    (bots antiguos) emiten su resultado completo al terminar.
+    """
+    interval = getattr(settings, 'BOTBRAIN_OUTPUT_FOLLOW_INTERVAL', 1)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + getattr(settings, 'BOTBRAIN_OUTPUT_FOLLOW_MAX_WAIT', 600)
+    emitted = after >= 0
+    while True:
+        # El estado se lee antes que los trozos: si ya terminó, no llegan más
+        row = await History.objects.filter(id=history_id).values_list('status', 'result').afirst()
+        if row is None:
+            return
+        status_value, result = row
+        while True:
+            chunks = [
+                chunk async for chunk in
+                ResultChunk.objects.filter(history_id=history_id, seq__gt=after)
+                .order_by('seq').values_list('seq', 'data')[:100]
+            ]
+            for after, data in chunks:
+                emitted = True
+                yield data
+            if len(chunks) < 100:
+                break
+
+        if status_value in RUNNING_STATUSES and follow and loop.time() < deadline:
+            await asyncio.sleep(interval)
+            continue
+        if not emitted and result and status_value not in RUNNING_STATUSES:
+            yield result
+        return
+
+class HistoryOutputView(APIView):
     permission_classes = [IsAuthenticated]
-    queryset = Raspberry.objects.all()
+    def get(self, request, pk):
+        """
+        Salida del comando como texto plano en streaming, sin cargarla entera
+        en memoria. ?after=N reanuda tras el trozo N; ?follow=1 sigue la
+        salida en vivo hasta que el comando termina
+        """
+        try:
+            after = int(request.query_params.get('after', -1))
+        except ValueError:
+            return Response(
+                {'message': 'after must be an integer'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not History.objects.filter(pk=pk).exists():
+            return Response(
+                {'message': 'History not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        follow = request.query_params.get('follow') in ('1', 'true')
+        response = StreamingHttpResponse(
+            stream_output(pk, after=after, follow=follow),
+            content_type='text/plain; charset=utf-8'
+        )
+        # Evita que un proxy (nginx) acumule la respuesta antes de enviarla
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+def _parse_moment(value):
+    """Fecha (AAAA-MM-DD) o fecha y hora ISO; sin zona se toma la del servidor"""
+    if not value:
+        return None
+    try:
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            moment = day and datetime.datetime.combine(day, datetime.time.min)
+    except ValueError:
+        return None
+    if moment is not None and timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+async def stream_archive(rows):
+    """Emite las filas como JSON por línea, leyendo los archivos fuera del event loop"""
+    next_batch = sync_to_async(lambda: list(islice(rows, 500)), thread_sensitive=False)
+    while True:
+        batch = await next_batch()
+        if not batch:
+            return
+        yield ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in batch)
+
+class HistoryArchiveView(APIView):
+    permission_classes = [IsAuthenticated]
+    def get(self, request):
+        """
+        Historial archivado entre ?start y ?end (fechas o fechas y horas ISO,
+        end excluido), como JSON por línea. Acepta los mismos filtros que la
+        lista: raspberry, command y status
+        """
+        start = _parse_moment(request.query_params.get('start'))
+        end = _parse_moment(request.query_params.get('end'))
+        if start is None or end is None or start >= end:
+            return Response(
+                {'message': 'start and end must be dates or ISO datetimes with start < end'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        max_days = getattr(settings, 'BOTBRAIN_ARCHIVE_MAX_RANGE_DAYS', 31)
+        if end - start > datetime.timedelta(days=max_days):
+            return Response(
+                {'message': f'The range cannot exceed {max_days} days'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        rows = read_archive(
+            start, end,
+            raspberry_slug=request.query_params.get('raspberry'),
+            command_slug=request.query_params.get('command'),
+            status=request.query_params.get('status')
+        )
+        return StreamingHttpResponse(stream_archive(rows), content_type='application/x-ndjson')
+
+class RaspberryListView(ReplicaReadMixin, ConditionalListMixin, generics.ListAPIView):
+    permission_classes = [IsAuthenticated]
+    queryset = Raspberry.objects.annotate(history_count=Count('history'))
     serializer_class = RaspberrySerializer
+    validator_model = Raspberry
 
-class CommandListView(generics.ListAPIView):
+class RaspberrySummaryView(ReplicaReadMixin, APIView):
     permission_classes = [IsAuthenticated]
-    queryset = Command.objects.all()
-    serializer_class = CommandSerializer
+    def get(self, request):
+        """
+        Resumen de la flota: comandos por estado para cada Raspberry Pi (o para
+        cada comando con ?by=command), leído de los contadores desnormalizados
+        """
+        by = 'command_slug' if request.query_params.get('by') == 'command' else 'raspberry_slug'
 
-class PendingCommandView(APIView):
+        summary = {}
+        totals = dict.fromkeys(SUMMARY_STATUSES, 0)
+        for row in StatusCounter.objects.summary(by):
+            entry = summary.setdefault(row[by], dict.fromkeys(SUMMARY_STATUSES, 0))
+            entry[row['status']] = entry.get(row['status'], 0) + row['total']
+            totals[row['status']] = totals.get(row['status'], 0) + row['total']
+
+        return Response({
+            'group_by': by,
+            'totals': totals,
+            'results': [{by: key, **counts} for key, counts in sorted(summary.items())],
+        })
+
+class CommandListView(ReplicaReadMixin, ConditionalListMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
+    queryset = Command.objects.annotate(usage_count=Count('history'))
+    serializer_class = CommandSerializer
+    validator_model = Command
+
+class DeviceFastPathMixin:
+    """
+    get-command y ack-command son las rutas más usadas por la flota: un solo
+    renderer sin negociación, JSON con orjson si está instalado y respuestas
+    ya codificadas (ver bots.fastpath)
+    """
+    renderer_classes = [fastpath.FastJSONRenderer]
+    parser_classes = [fastpath.FastJSONParser, FormParser, MultiPartParser]
+    content_negotiation_class = fastpath.FirstRendererNegotiation
+
+
+class PendingCommandView(DeviceFastPathMixin, APIView):
+    authentication_classes = DEVICE_AUTHENTICATION_CLASSES
+    permission_classes = [IsDeviceOwnerOrAuthenticated]
     def get(self, request, raspberry_slug):
         """
-        Obtiene el primer comando pendiente para el Raspberry Pi
+        Obtiene el primer comando pendiente para el Raspberry Pi. Con ?limit=N
+        reclama hasta N comandos en orden y devuelve una lista
+        """
+        limit = request.query_params.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = 0
+            if limit < 1:
+                return fastpath.DeviceJSONResponse(
+                    {'message': 'limit must be a positive integer'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            limit = min(limit, getattr(settings, 'BOTBRAIN_CLAIM_MAX_BATCH', 50))
+
+        if not catalog.raspberries.exists(raspberry_slug):
+            return fastpath.constant_response(fastpath.RASPBERRY_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+
+        try:
+            # Reclamo atómico: dos polls concurrentes nunca reciben la misma fila
+            claimed = History.objects.claim(raspberry_slug, limit=limit or 1)
+
+            if not claimed:
+                return fastpath.constant_response(fastpath.NO_PENDING_COMMANDS, status=status.HTTP_404_NOT_FOUND)
+
+            return fastpath.commands_response(claimed, many=limit is not None)
+
+        except Exception as e:
+            return fastpath.DeviceJSONResponse(
+                {'message': f'Error: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+class AckCommandView(DeviceFastPathMixin, APIView):
+    authentication_classes = DEVICE_AUTHENTICATION_CLASSES
+    permission_classes = [IsDeviceOwnerOrAuthenticated]
+    def post(self, request, raspberry_slug):
+        """
+        Reconoce la ejecución de un comando. Valida el cuerpo como
+        AckCommandSerializer, sin instanciarlo
         """
+        if not catalog.raspberries.exists(raspberry_slug):
+            return fastpath.constant_response(fastpath.RASPBERRY_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
+
         try:
-            pending_command = History.objects.filter(
-                raspberry__slug=raspberry_slug,
-                status='pending'
-            ).first()
-            
-            if not pending_command:
-                return Response(
-                    {'message': 'No pending commands'}, 
-                    status=status.HTTP_404_NOT_FOUND
+            ack, errors = fastpath.parse_ack(request.data)
+            if errors:
+                return fastpath.DeviceJSONResponse(
+                    {'message': 'Invalid data', 'errors': errors},
+                    status=status.HTTP_400_BAD_REQUEST
                 )
 
-            serializer = CommandResponseSerializer({
-                'id': pending_command.id,
-                'command': pending_command.command.slug
-            })
+            command_id, result, success = ack
+            if not History.objects.acknowledge(raspberry_slug, command_id, result, success):
+                return fastpath.constant_response(fastpath.COMMAND_NOT_FOUND, status=status.HTTP_404_NOT_FOUND)
 
-            # Marcar como enviado
-            pending_command.status = 'sent'
-            pending_command.save()
+            return fastpath.constant_response(fastpath.ACK_SUCCESS)
 
-            return Response(serializer.data)
-            
+        except ParseError:
+            raise
         except Exception as e:
-            return Response(
-                {'message': f'Error: {str(e)}'}, 
+            return fastpath.DeviceJSONResponse(
+                {'message': f'Error updating command status: {str(e)}'},
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class AckCommandView(APIView):
-    permission_classes = [IsAuthenticated]
+
+class BulkAckCommandView(APIView):
+    authentication_classes = DEVICE_AUTHENTICATION_CLASSES
+    permission_classes = [IsDeviceOwnerOrAuthenticated]
     def post(self, request, raspberry_slug):
         """
-        Reconoce la ejecución de un comando
+        Reconoce la ejecución de varios comandos en una sola transacción.
+        Recibe una lista de {command_id, result}
         """
+        if not catalog.raspberries.exists(raspberry_slug):
+            return raspberry_not_found()
+
         try:
-            ack_serializer = AckCommandSerializer(data=request.data)
+            ack_serializer = AckCommandSerializer(data=request.data, many=True)
             if not ack_serializer.is_valid():
                 return Response(
                     {'message': 'Invalid data', 'errors': ack_serializer.errors},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            
-            command_id = ack_serializer.validated_data['command_id']
-            result = ack_serializer.validated_data['result']
 
-            command_history = get_object_or_404(
-                History, 
-                id=command_id,
-                raspberry__slug=raspberry_slug
+            results = {
+                ack['command_id']: (ack['result'], ack['success'])
+                for ack in ack_serializer.validated_data
+            }
+            acknowledged = History.objects.acknowledge_many(raspberry_slug, results)
+
+            response_serializer = BulkAckResponseSerializer({
+                'status': 'success',
+                'acknowledged': acknowledged,
+                'not_found': sorted(set(results) - set(acknowledged))
+            })
+            return Response(response_serializer.data)
+
+        except Exception as e:
+            return Response(
+                {'message': f'Error updating command status: {str(e)}'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-            command_history.status = 'executed'
-            command_history.result = result
-            command_history.save()
+class CommandOutputView(APIView):
+    authentication_classes = DEVICE_AUTHENTICATION_CLASSES
+    permission_classes = [IsDeviceOwnerOrAuthenticated]
+    def post(self, request, raspberry_slug, command_id):
+        """
+        Agrega trozos de salida a un comando en ejecución. Recibe un trozo
+        {seq, data, stream} o una lista; reenviar un seq ya guardado no
+        tiene efecto
+        """
+        chunk_serializer = ResultChunkSerializer(data=request.data, many=isinstance(request.data, list))
+        if not chunk_serializer.is_valid():
+            return Response(
+                {'message': 'Invalid data', 'errors': chunk_serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        chunks = chunk_serializer.validated_data
+        if isinstance(chunks, dict):
+            chunks = [chunks]
 
-            response_serializer = AckResponseSerializer({'status': 'success'})
-            return Response(response_serializer.data)
-            
-        except History.DoesNotExist:
+        history_status = (
+            History.objects.filter(id=command_id, raspberry_id=raspberry_slug)
+            .values_list('status', flat=True).first()
+        )
+        if history_status is None:
             return Response(
-                {'message': 'Command not found for this Raspberry Pi'}, 
+                {'message': 'Command not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        except Exception as e:
+        if history_status not in RUNNING_STATUSES:
             return Response(
-                {'message': f'Error updating command status: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
\ No newline at end of file
+                {'message': 'Command already finished'},
+                status=status.HTTP_409_CONFLICT
+            )
+
+        ResultChunk.objects.bulk_create(
+            [ResultChunk(history_id=command_id, **chunk) for chunk in chunks],
+            ignore_conflicts=True
+        )
+        # Un comando que sigue produciendo salida está vivo: aplaza el reaper
+        History.objects.filter(id=command_id, status='sent').update(updated_at=timezone.now())
+        return Response({'status': 'success', 'received': len(chunks)})
+
+
+class CatalogCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+    def get(self, request):
+        """
+        Aciertos y fallos de la caché de catálogos de este worker
+        """
+        return Response(catalog.stats())
+
+
+def metrics_view(request):
+    """
+    Métricas de este worker en el formato de texto de Prometheus. Con
+    BOTBRAIN_METRICS_TOKEN exige Authorization: Bearer <token>
+    """
+    token = getattr(settings, 'BOTBRAIN_METRICS_TOKEN', '')
+    if token and not constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _long_poll_settings():
+    max_wait = getattr(settings, 'BOTBRAIN_LONG_POLL_MAX_WAIT', 30)
+    interval = getattr(settings, 'BOTBRAIN_LONG_POLL_INTERVAL', 1)
+    return max_wait, interval
+
+
+def _retry_after(elapsed):
+    """
+    Segundos que el bot debe esperar antes de volver a consultar, contados
+    desde que empezó la consulta anterior; el tiempo retenido ya cuenta
+    """
+    interval = getattr(settings, 'BOTBRAIN_POLL_RETRY_AFTER', 10)
+    return math.ceil(interval - elapsed)
+
+
+def _parse_wait(value, max_wait):
+    try:
+        wait = float(value)
+    except (TypeError, ValueError):
+        return 0
+    # nan pasaría el recorte y dejaría la petición retenida para siempre
+    if not math.isfinite(wait):
+        return 0
+    return min(max(wait, 0), max_wait)
+
+
+_pending_command_view = PendingCommandView.as_view()
+
+
+def _no_pending_commands(response):
+    # Un 404 por dispositivo inexistente no merece esperar
+    return (
+        response.status_code == status.HTTP_404_NOT_FOUND
+        and response.data.get('message') == 'No pending commands'
+    )
+
+
+async def pending_command_view(request, raspberry_slug):
+    """
+    Punto de entrada de get-command. Con ?wait=N mantiene la petición abierta
+    hasta N segundos esperando un comando pendiente (long polling)
+    """
+    max_wait, interval = _long_poll_settings()
+    wait = _parse_wait(request.GET.get('wait'), max_wait)
+
+    # La primera pasada autentica y reclama a través de la vista DRF
+    response = await sync_to_async(_pending_command_view)(request, raspberry_slug=raspberry_slug)
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    deadline = started + wait
+    if wait and _no_pending_commands(response):
+        # Despierta con el aviso de commands_queued; la revisión periódica cubre
+        # lo que llega a otro worker sin broker compartido y los not_before
+        async with push.subscribe(raspberry_slug) as connection:
+            # Lo creado entre la primera pasada y la suscripción no generó aviso
+            ready = await History.objects.claimable(raspberry_slug).aexists()
+            while True:
+                if ready:
+                    response = await sync_to_async(_pending_command_view)(request, raspberry_slug=raspberry_slug)
+                    if not _no_pending_commands(response):
+                        break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(connection.event.wait(), min(interval, remaining))
+                except asyncio.TimeoutError:
+                    # Consulta barata sobre el índice; solo se reclama cuando hay trabajo
+                    ready = await History.objects.claimable(raspberry_slug).aexists()
+                else:
+                    connection.event.clear()
+                    ready = True
+
+    # Anuncia al bot que el servidor soporta long polling
+    response['X-Long-Poll-Max'] = str(max_wait)
+    if _no_pending_commands(response):
+        # Sin trabajo: el servidor marca el ritmo de consultas de la flota
+        retry_after = _retry_after(loop.time() - started)
+        if retry_after > 0:
+            response['Retry-After'] = str(retry_after)
+    return response
+
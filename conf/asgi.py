@@ -3,14 +3,39 @@ ASGI config for conf project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP requests go to Django; WebSocket connections are routed to the command
+push channel in ``bots.consumers``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
 import os
+import re
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
+# Lo lee conf.settings: bajo ASGI las conexiones no se reutilizan por defecto
+os.environ.setdefault('BOTBRAIN_ASGI', '1')
+
+django_application = get_asgi_application()
+
+# Importar después de inicializar Django
+from bots.consumers import command_socket_application  # noqa: E402
+
+websocket_routes = [
+    (re.compile(r'^/api/bot/raspberries/(?P<raspberry_slug>[-a-zA-Z0-9_]+)/socket/$'), command_socket_application),
+]
+
 
-application = get_asgi_application()
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        for pattern, handler in websocket_routes:
+            match = pattern.match(scope['path'])
+            if match:
+                return await handler(scope, receive, send, **match.groupdict())
+        await receive()
+        await send({'type': 'websocket.close', 'code': 4404})
+        return
+    return await django_application(scope, receive, send)
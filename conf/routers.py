@@ -0,0 +1,51 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES if alias.startswith('replica_')]
+
+
+def replica_reads_active():
+    return _replica_reads.get()
+
+
+@contextmanager
+def replica_reads():
+    """Dentro del bloque, las lecturas del ORM van a una réplica (si hay)"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Escrituras, y por defecto también lecturas, a 'default'. Solo las lecturas
+    marcadas con replica_reads() (las listas) se reparten entre réplicas, así
+    que el reclamo y los acks nunca leen datos con retraso de replicación.
+    """
+
+    def db_for_read(self, model, **hints):
+        if replica_reads_active():
+            replicas = get_replicas()
+            if replicas:
+                return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Todas las bases tienen los mismos datos
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Las réplicas reciben el esquema por replicación
+        return db == 'default'
@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from bots.views import metrics_view
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('accounts.urls')),
     path('api/bot/', include('bots.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -4,14 +4,283 @@ import subprocess
 import time
 import logging
 import os
-from typing import Dict, Any
+import json
+import codecs
+import signal
+import random
+import sqlite3
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+try:
+    # Opcional: pip install websocket-client para recibir comandos por push
+    import websocket
+except ImportError:
+    websocket = None
+
+# Respuestas 404 del servidor que no cambian al reintentar: el comando no
+# existe para este dispositivo. "Raspberry not found" sí puede ser pasajero
+# (caché de catálogos del servidor) y no descarta el resultado
+COMMAND_NOT_FOUND = "Command not found for this Raspberry Pi"
+
+
+def response_message(response: requests.Response) -> Optional[str]:
+    """Campo message de una respuesta JSON del servidor, o None"""
+    try:
+        data = response.json()
+    except ValueError:
+        return None
+    return data.get("message") if isinstance(data, dict) else None
+
+
+class PollScheduler:
+    """Decide cuánto esperar entre consultas a get-command.
+
+    Mientras llegan comandos se consulta de inmediato; en reposo la espera
+    crece exponencialmente hasta `maximum`. Las esperas llevan jitter para
+    que dispositivos arrancados a la vez no consulten al unísono. Un
+    Retry-After del servidor es un mínimo: el backoff propio sigue creciendo
+    por encima de él.
+    """
+
+    def __init__(self, base: float = 2, maximum: float = 300, factor: float = 2, jitter: float = 0.2):
+        self.base = base
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.idle_polls = 0
+        self.retry_after = None
+        self.long_polled = False
+
+    def record(self, got_work: bool, long_polled: bool = False, retry_after: Optional[float] = None) -> None:
+        """Registra el resultado de una consulta"""
+        self.idle_polls = 0 if got_work else self.idle_polls + 1
+        self.long_polled = long_polled
+        self.retry_after = retry_after
+
+    def initial_delay(self) -> float:
+        """Desfase aleatorio al arrancar"""
+        return random.uniform(0, self.base)
+
+    def next_delay(self) -> float:
+        if self.idle_polls == 0 or self.long_polled:
+            # Hubo trabajo, o el servidor ya retuvo la petición
+            backoff = 0
+        else:
+            delay = min(self.maximum, self.base * self.factor ** (self.idle_polls - 1))
+            # Jitter "equal": entre la mitad y el total de la espera
+            backoff = delay / 2 + random.uniform(0, delay / 2)
+        if self.retry_after is not None:
+            # Nunca antes de lo que pidió el servidor
+            return max(self.retry_after * random.uniform(1, 1 + self.jitter), backoff)
+        return backoff
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After en segundos o como fecha HTTP"""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResultSpool:
+    """Cola en disco (SQLite) de resultados pendientes de reportar.
+
+    Un resultado se guarda antes de enviarlo y solo se borra cuando el
+    servidor lo confirma, así un corte de red o un reinicio del Pi no lo
+    pierden. La clave es command_id: guardar dos veces el mismo comando deja
+    una sola fila y reenviar un ack ya aplicado no cambia nada en el servidor.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "command_id INTEGER PRIMARY KEY, result TEXT NOT NULL, success INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+
+    def add(self, command_id: int, result: str, success: bool) -> None:
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (command_id, result, success, created_at) VALUES (?, ?, ?, ?)",
+                (command_id, result, int(success), time.time())
+            )
+
+    def pending(self, limit: int) -> List[Tuple[int, str, bool]]:
+        """Los resultados más antiguos primero"""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT command_id, result, success FROM results ORDER BY created_at LIMIT ?", (limit,)
+            ).fetchall()
+        return [(command_id, result, bool(success)) for command_id, result, success in rows]
+
+    def remove(self, command_ids: List[int]) -> None:
+        if not command_ids:
+            return
+        with self._lock:
+            self._connection.executemany("DELETE FROM results WHERE command_id = ?", [(i,) for i in command_ids])
+
+    def mark_attempt(self, command_ids: List[int]) -> None:
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE results SET attempts = attempts + 1 WHERE command_id = ?", [(i,) for i in command_ids]
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class OutputStream:
+    """Envía al servidor la salida de un comando en trozos mientras corre.
+
+    Agrupa lo escrito hasta `chunk_size` caracteres o `interval` segundos. Es
+    de mejor esfuerzo: si el servidor no acepta la salida (versión antigua,
+    comando ya cerrado) deja de enviar y el resultado final sigue llegando
+    por el ack.
+    """
+
+    def __init__(self, bot: "Bot", command_id: int, chunk_size: int = 16384, interval: float = 1.0):
+        self.bot = bot
+        self.command_id = command_id
+        self.chunk_size = chunk_size
+        self.interval = interval
+        self.enabled = True
+        self.seq = 0
+        self._buffer = []
+        self._size = 0
+        self._last_flush = 0.0
+        # Trozos numerados que esperan su POST, en orden de seq. Los envía un
+        # hilo propio: quien escribe (el lector del pipe) nunca espera a la red
+        self._pending = []
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        self._sender = None
+
+    def write(self, stream: str, data: str) -> None:
+        if not self.enabled or not data:
+            return
+        with self._lock:
+            if self._buffer and self._buffer[-1][0] == stream:
+                self._buffer[-1][1].append(data)
+            else:
+                self._buffer.append((stream, [data]))
+            self._size += len(data)
+            if self._size < self.chunk_size and time.monotonic() - self._last_flush < self.interval:
+                return
+            self._take_buffer()
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._send_pending, name=f"salida-{self.command_id}", daemon=True)
+                self._sender.start()
+        self._wake.set()
+
+    def flush(self) -> None:
+        """Envía lo que queda y espera al hilo de envío; al terminar el comando"""
+        with self._lock:
+            self._take_buffer()
+            self._closed = True
+            sender = self._sender
+        if sender is None:
+            self._send_pending()
+        else:
+            self._wake.set()
+            sender.join()
+
+    def _take_buffer(self) -> None:
+        # Con self._lock tomado: pasa lo escrito a la cola de envío
+        for stream, parts in self._buffer:
+            data = "".join(parts)
+            for start in range(0, len(data), self.chunk_size):
+                self._pending.append({"seq": self.seq, "stream": stream, "data": data[start:start + self.chunk_size]})
+                self.seq += 1
+        self._buffer = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+
+    def _send_pending(self) -> None:
+        while True:
+            with self._lock:
+                chunks, self._pending = self._pending, []
+                closed = self._closed
+            if chunks and self.enabled:
+                self._post(chunks)
+            elif closed:
+                return
+            else:
+                self._wake.wait()
+                self._wake.clear()
+
+    def _post(self, chunks: list) -> None:
+        try:
+            response = self.bot.session.post(
+                f"{self.bot.SERVER_URL}/raspberries/{self.bot.RASPBERRY_ID}/commands/{self.command_id}/output/",
+                json=chunks,
+                timeout=10
+            )
+            if response.status_code != 200:
+                self.enabled = False
+                self.bot.logger.warning(f"Salida en vivo del comando {self.command_id} desactivada: {response.status_code}")
+        except Exception as e:
+            self.bot.logger.error(f"Error enviando salida del comando {self.command_id}: {e}")
+
 
 class Bot:
-    def __init__(self, server_url: str, token: str, raspberry_id: str):
+    def __init__(self, server_url: str, token: str, raspberry_id: str, long_poll_wait: int = 30, batch_size: int = 10,
+                 auth_scheme: str = "Token", max_parallel: int = 4, command_timeout: float = 300,
+                 spool_path: str = "blueman_spool.sqlite3"):
         self.SERVER_URL = server_url
         self.SERVER_TOKEN = token
         self.RASPBERRY_ID = raspberry_id
+        # "Token" para cuentas de usuario, "Device" para la clave propia del dispositivo
+        self.AUTH_SCHEME = auth_scheme
+        # Segundos que el servidor puede retener get-command (0 desactiva el long polling)
+        self.long_poll_wait = long_poll_wait
+        self.long_poll_supported = None
+        # Comandos reclamados por consulta y reportados en un solo ack
+        self.batch_size = batch_size
+        self.bulk_ack_supported = True
+        # Canal WebSocket; si falla se vuelve al polling HTTP
+        self.use_push = websocket is not None
+        self.push_heartbeat = 30
+        # Comandos ejecutándose a la vez y tiempo máximo (segundos) de cada uno
+        self.max_parallel = max_parallel
+        self.command_timeout = command_timeout
+        self.command_timeouts = {
+            "crear_respaldo": 1800,
+        }
+        # La salida completa va en vivo al servidor; en memoria y en el ack
+        # solo queda el final
+        self.stream_output = True
+        self.result_tail_size = 65536
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="comando")
+        self._in_flight = 0
+        self._in_flight_changed = threading.Condition()
+        self._local = threading.local()
+        # Resultados sin confirmar; se reenvían en lotes cuando vuelve la red
+        self.spool = ResultSpool(spool_path)
+        self._results_ready = threading.Event()
+        self._reporter = None
+        self.scheduler = PollScheduler()
         self._setup_logging()
+        self.session = self._create_session()
         
         # Diccionario que mapea nombres de comandos a métodos
         self.commands = {
@@ -31,64 +300,272 @@ class Bot:
     def _get_headers(self) -> Dict[str, str]:
         return {
             "Accept": "application/json", 
-            "Authorization": f"Token {self.SERVER_TOKEN}"
+            "Accept-Encoding": "gzip, deflate",
+            "Authorization": f"{self.AUTH_SCHEME} {self.SERVER_TOKEN}"
         }
 
-    def check_commands(self) -> None:
-        """Consulta el servidor por comandos pendientes"""
+    def _create_session(self) -> requests.Session:
+        """Sesión con conexiones persistentes (keep-alive) reutilizadas entre peticiones"""
+        session = requests.Session()
+        # Hilos de comandos y el reportero comparten el pool sin abrir sockets nuevos
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_parallel + 2)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers.update(self._get_headers())
+        return session
+
+    def _free_slots(self) -> int:
+        """Espera a que haya al menos un hueco libre y devuelve cuántos hay"""
+        with self._in_flight_changed:
+            while self._in_flight >= self.max_parallel:
+                self._in_flight_changed.wait()
+            return self.max_parallel - self._in_flight
+
+    def check_commands(self) -> bool:
+        """Consulta el servidor por comandos pendientes y registra el
+        resultado en el planificador.
+
+        Devuelve True si se recibieron comandos.
+        """
         try:
-            headers = self._get_headers()
-            response = requests.get(
+            # Reclamar solo lo que se puede empezar a ejecutar ya
+            params = {"limit": min(self.batch_size, self._free_slots())}
+            if self.long_poll_wait and self.long_poll_supported is not False:
+                params["wait"] = self.long_poll_wait
+            response = self.session.get(
                 f"{self.SERVER_URL}/raspberries/{self.RASPBERRY_ID}/get-command/", 
-                headers=headers
+                params=params,
+                timeout=self.long_poll_wait + 10
             )
             
             self.logger.info(f"Status code: {response.status_code}")
+
+            waited = "wait" in params
+            if waited:
+                # Servidores antiguos ignoran ?wait y no envían la cabecera
+                self.long_poll_supported = "X-Long-Poll-Max" in response.headers
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if self._reporter is not None and len(self.spool):
+                # Volvió la red: no esperar al backoff del reportero
+                self._results_ready.set()
             
             if response.status_code == 200:
                 command_data = response.json()
+                # Servidores sin ?limit devuelven un solo comando
+                if isinstance(command_data, dict):
+                    command_data = [command_data]
                 if command_data:
-                    self.execute_command(command_data)
-            elif response.status_code != 200:
+                    self.execute_commands(command_data)
+                    self.scheduler.record(True)
+                    return True
+            elif response.status_code != 404:
                 self.logger.warning(f"Respuesta inesperada: {response.status_code}")
+                self.scheduler.record(False, retry_after=retry_after)
+                return False
+
+            self.scheduler.record(False, long_polled=waited and bool(self.long_poll_supported), retry_after=retry_after)
+            return False
                 
         except Exception as e:
             self.logger.error(f"Error checking commands: {e}")
+            self.scheduler.record(False)
+            return False
 
-    def execute_command(self, command_data: Dict[str, Any]) -> None:
-        """Ejecuta un comando recibido del servidor"""
-        command_id = command_data['id']
-        command_name = command_data['command']
-        
+    def execute_commands(self, commands_data: List[Dict[str, Any]]) -> None:
+        """Lanza un lote de comandos en paralelo; los resultados se reportan en lotes al terminar"""
+        self._start_reporter()
+        for command_data in commands_data:
+            self._submit(command_data['id'], command_data['command'], self._queue_result)
+
+    def _submit(self, command_id: int, command_name: str, report: Callable[[int, str, bool], None]) -> None:
+        """Ejecuta el comando en el pool y lo reporta al terminar o al vencer su timeout"""
+        timeout = self.command_timeouts.get(command_name, self.command_timeout)
+        lock = threading.Lock()
+        reported = []
+
+        def finish(result: str, success: bool) -> None:
+            with lock:
+                if reported:
+                    return
+                reported.append(True)
+            report(command_id, result, success)
+
+        def on_timeout() -> None:
+            self.logger.error(f"Comando {command_id} superó {timeout} segundos")
+            finish(f"Timeout: el comando superó {timeout} segundos", False)
+
+        def task() -> None:
+            try:
+                result, success = self._run_command(command_id, command_name, timeout)
+            finally:
+                timer.cancel()
+                with self._in_flight_changed:
+                    self._in_flight -= 1
+                    self._in_flight_changed.notify_all()
+            finish(result, success)
+
+        with self._in_flight_changed:
+            self._in_flight += 1
+        timer = threading.Timer(timeout, on_timeout)
+        timer.daemon = True
+        timer.start()
+        self._executor.submit(task)
+
+    def _run_command(self, command_id: int, command_name: str, timeout: Optional[float] = None) -> Tuple[str, bool]:
+        """Ejecuta el método asociado al comando y devuelve (resultado, éxito)"""
         self.logger.info(f"Ejecutando comando ID {command_id}: {command_name}")
+        # Los subprocesos del comando heredan el tiempo restante y envían su
+        # salida al servidor (ver _check_output)
+        self._local.deadline = time.monotonic() + timeout if timeout else None
+        self._local.output = OutputStream(self, command_id) if self.stream_output else None
         
-        if command_name in self.commands:
-            try:
-                result = self.commands[command_name]()
-                success = True
-                self.logger.info(f"Comando {command_id} ejecutado exitosamente")
-            except Exception as e:
-                result = f"Error ejecutando comando: {str(e)}"
+        try:
+            if command_name in self.commands:
+                try:
+                    result = self.commands[command_name]()
+                    success = True
+                    self.logger.info(f"Comando {command_id} ejecutado exitosamente")
+                except Exception as e:
+                    result = f"Error ejecutando comando: {str(e)}"
+                    success = False
+                    self.logger.error(f"Error ejecutando comando {command_id}: {str(e)}")
+            else:
+                result = f"Comando no reconocido: {command_name}"
                 success = False
-                self.logger.error(f"Error ejecutando comando {command_id}: {str(e)}")
-        else:
-            result = f"Comando no reconocido: {command_name}"
-            success = False
-            self.logger.warning(f"Comando no reconocido: {command_name}")
+                self.logger.warning(f"Comando no reconocido: {command_name}")
+        finally:
+            if self._local.output is not None:
+                self._local.output.flush()
+            self._local.deadline = None
+            self._local.output = None
         
-        self._send_command_result(command_id, result, success)
+        return result, success
+
+    def _check_output(self, command: str, text: bool = False, stderr: Any = None, timeout: Optional[float] = None) -> Any:
+        """Como subprocess.check_output(shell=True), pero:
+
+        - limitado al tiempo que le queda al comando en curso,
+        - envía stdout/stderr en vivo al servidor mientras el proceso corre,
+        - devuelve solo los últimos `result_tail_size` caracteres de stdout.
+        """
+        deadline = getattr(self._local, "deadline", None)
+        if deadline is not None:
+            timeout = max(deadline - time.monotonic(), 0.1)
+        output = getattr(self._local, "output", None)
+
+        process = subprocess.Popen(
+            command, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE if stderr is None else stderr,
+            # Grupo propio: el timeout mata también a los hijos del shell
+            start_new_session=True
+        )
+        timed_out = threading.Event()
+
+        def kill() -> None:
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+        killer = threading.Timer(timeout, kill) if timeout else None
+        if killer:
+            killer.daemon = True
+            killer.start()
+
+        def pump(pipe, stream: str, tail: Optional[deque] = None) -> None:
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")
+            size = 0
+            for line in iter(pipe.readline, b""):
+                data = decoder.decode(line)
+                if output is not None:
+                    output.write(stream, data)
+                if tail is not None:
+                    tail.append(data)
+                    size += len(data)
+                    while size > self.result_tail_size and len(tail) > 1:
+                        size -= len(tail.popleft())
+            pipe.close()
+
+        tail = deque()
+        stderr_reader = None
+        if process.stderr is not None:
+            stderr_reader = threading.Thread(target=pump, args=(process.stderr, "stderr"), daemon=True)
+            stderr_reader.start()
+        try:
+            pump(process.stdout, "stdout", tail)
+            returncode = process.wait()
+            if stderr_reader:
+                stderr_reader.join()
+        finally:
+            if killer:
+                killer.cancel()
+
+        result = "".join(tail)
+        if len(result) > self.result_tail_size:
+            result = "[...]\n" + result[-self.result_tail_size:]
+        if not text:
+            result = result.encode()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(command, timeout, output=result)
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, command, output=result)
+        return result
+
+    def _queue_result(self, command_id: int, result: str, success: bool) -> None:
+        # Primero al disco; el reportero lo borra cuando el servidor confirma
+        self.spool.add(command_id, result, success)
+        self._results_ready.set()
+
+    def _start_reporter(self) -> None:
+        if self._reporter is None or not self._reporter.is_alive():
+            self._reporter = threading.Thread(target=self._report_results, name="reportero", daemon=True)
+            self._reporter.start()
+            # Lo que quedó en la cola de una ejecución anterior
+            self._results_ready.set()
+
+    def _report_results(self) -> None:
+        """Vacía la cola en lotes; sin red reintenta con backoff"""
+        retry_delay = None
+        while True:
+            self._results_ready.wait(retry_delay)
+            self._results_ready.clear()
+            # Agrupar los resultados que terminan casi a la vez en un solo ack
+            time.sleep(0.2)
+            if self.flush_spool():
+                retry_delay = None
+            else:
+                retry_delay = min((retry_delay or 2.5) * 2, 300)
+                self.logger.warning(f"{len(self.spool)} resultados sin reportar; reintento en {retry_delay:.0f} segundos")
+
+    def flush_spool(self) -> bool:
+        """Reenvía la cola; devuelve True si quedó vacía"""
+        while True:
+            results = self.spool.pending(self.batch_size)
+            if not results:
+                return True
+            delivered = self._send_command_results(results)
+            self.spool.remove(delivered)
+            if len(delivered) < len(results):
+                self.spool.mark_attempt([command_id for command_id, _, _ in results if command_id not in delivered])
+                return False
 
-    def _send_command_result(self, command_id: str, result: str, success: bool) -> None:
-        """Envía el resultado del comando al servidor"""
+    def _send_command_result(self, command_id: int, result: str, success: bool) -> bool:
+        """Envía el resultado del comando al servidor.
+
+        Devuelve True si el servidor respondió de forma definitiva (incluido
+        un comando desconocido o inválido, que no tiene sentido reenviar).
+        Cualquier otro 404 deja el resultado en la cola para reintentarlo.
+        """
         try:
-            headers = self._get_headers()
-            response = requests.post(
+            response = self.session.post(
                 f"{self.SERVER_URL}/raspberries/{self.RASPBERRY_ID}/ack-command/", 
-                headers=headers, 
                 json={
                     "command_id": command_id,
-                    "result": result
-                }
+                    "result": result,
+                    "success": success
+                },
+                timeout=30
             )
             
             log_message = f"Command ID {command_id} executed. Success: {success}. Server response: {response.status_code}"
@@ -97,19 +574,135 @@ class Bot:
                 self.logger.info(log_message)
             else:
                 self.logger.warning(log_message)
+            if response.status_code == 404:
+                return response_message(response) == COMMAND_NOT_FOUND
+            return response.status_code in (200, 400)
                 
         except Exception as e:
             self.logger.error(f"Error enviando resultado del comando {command_id}: {e}")
+            return False
+
+    def _send_command_results(self, results: List[Tuple[int, str, bool]]) -> List[int]:
+        """Envía los resultados de un lote con un único ack y devuelve los ids entregados"""
+        if len(results) == 1 or not self.bulk_ack_supported:
+            return [
+                command_id for command_id, result, success in results
+                if self._send_command_result(command_id, result, success)
+            ]
+
+        try:
+            response = self.session.post(
+                f"{self.SERVER_URL}/raspberries/{self.RASPBERRY_ID}/ack-commands/", 
+                json=[
+                    {"command_id": command_id, "result": result, "success": success}
+                    for command_id, result, success in results
+                ],
+                timeout=30
+            )
+
+            if response.status_code == 404:
+                if response_message(response) is not None:
+                    # 404 de la API misma ("Raspberry not found"): reintentar más tarde
+                    self.logger.warning(f"Ack en lote rechazado: {response_message(response)}")
+                    return []
+                # Sin la ruta: servidor anterior al ack en lote, reportar uno por uno
+                self.bulk_ack_supported = False
+                return self._send_command_results(results)
+
+            log_message = f"Commands {[command_id for command_id, _, _ in results]} executed. Server response: {response.status_code}"
+            if response.status_code == 200:
+                self.logger.info(log_message)
+                not_found = response.json().get("not_found")
+                if not_found:
+                    self.logger.warning(f"Comandos no reconocidos por el servidor: {not_found}")
+                return [command_id for command_id, _, _ in results]
+            self.logger.warning(log_message)
+            if response.status_code == 400:
+                # Lote rechazado por una entrada inválida: aislarla enviando uno por uno
+                return [
+                    command_id for command_id, result, success in results
+                    if self._send_command_result(command_id, result, success)
+                ]
+            return []
+
+        except Exception as e:
+            self.logger.error(f"Error enviando resultados del lote: {e}")
+            return []
+
+    def _socket_url(self) -> str:
+        base = self.SERVER_URL.replace("https://", "wss://", 1).replace("http://", "ws://", 1)
+        return f"{base}/raspberries/{self.RASPBERRY_ID}/socket/"
+
+    def run_push(self) -> None:
+        """Mantiene abierto el canal WebSocket y atiende los comandos empujados"""
+        ws = websocket.create_connection(
+            self._socket_url(),
+            header=[f"Authorization: {self.AUTH_SCHEME} {self.SERVER_TOKEN}"],
+            timeout=self.push_heartbeat * 3
+        )
+        # Los hilos de comandos envían acks por el mismo socket
+        send_lock = threading.Lock()
+
+        def send(data: Dict[str, Any]) -> None:
+            with send_lock:
+                ws.send(json.dumps(data))
+
+        def report(command_id: int, result: str, success: bool) -> None:
+            # Primero al disco: se borra cuando llega la respuesta del servidor,
+            # no al escribir en el socket, que puede caerse antes de aplicarlo
+            self.spool.add(command_id, result, success)
+            try:
+                send({"type": "ack", "command_id": command_id, "result": result, "success": success})
+                self.logger.info(f"Command ID {command_id} executed. Success: {success}. Ack enviado por push")
+            except Exception:
+                # El canal se cayó mientras el comando corría: reportar por HTTP
+                self._results_ready.set()
+
+        self.logger.info("Canal push conectado")
+        try:
+            while True:
+                message = json.loads(ws.recv())
+                if message.get("type") == "ping":
+                    send({"type": "pong"})
+                elif message.get("type") == "command":
+                    self._submit(message["id"], message["command"], report)
+                elif message.get("type") == "ack":
+                    if message.get("status") != "success":
+                        self.logger.warning(f"Ack rechazado: {message}")
+                    # Respuesta definitiva, como un 200, 400 o 404 de ack-command
+                    self.spool.remove([message.get("command_id")])
+        finally:
+            ws.close()
+            # Los acks sin respuesta se reenvían por HTTP (reenviarlos no cambia nada)
+            if len(self.spool):
+                self._results_ready.set()
 
     def run(self) -> None:
         """Bucle principal del bot"""
         self.logger.info(f"Iniciando bot para Raspberry ID: {self.RASPBERRY_ID}")
         self.logger.info(f"Conectando a servidor: {self.SERVER_URL}")
         self.logger.info(f"Comandos disponibles: {', '.join(self.commands.keys())}")
+        self._start_reporter()
+        # Desfase inicial: una flota que arranca a la vez no consulta en bloque
+        time.sleep(self.scheduler.initial_delay())
         
         while True:
+            if self.use_push:
+                try:
+                    self.run_push()
+                except websocket.WebSocketBadStatusException as e:
+                    # El servidor no ofrece el canal: quedarse con polling HTTP
+                    self.logger.warning(f"Canal push no disponible: {e}")
+                    self.use_push = False
+                except Exception as e:
+                    self.logger.error(f"Canal push desconectado: {e}")
+
+            # Respaldo por HTTP mientras el canal push no está disponible
             self.check_commands()
-            time.sleep(10)  # Consultar cada 10 segundos
+            delay = self.scheduler.next_delay()
+            if delay:
+                self.logger.info(f"Próxima consulta en {delay:.1f} segundos")
+                time.sleep(delay)
 
     # =============================================================================
     # MÉTODOS DE COMANDOS - AÑADE TUS PROPIOS COMANDOS AQUÍ
@@ -142,17 +735,17 @@ class Bot:
         """Obtiene el estado del sistema"""
         try:
             # Información de memoria
-            memoria = subprocess.check_output("free -h", shell=True, text=True).strip()
+            memoria = self._check_output("free -h", text=True).strip()
             
             # Espacio en disco
-            disco = subprocess.check_output("df -h /", shell=True, text=True).strip()
+            disco = self._check_output("df -h /", text=True).strip()
             
             # Uptime
-            uptime = subprocess.check_output("uptime", shell=True, text=True).strip()
+            uptime = self._check_output("uptime", text=True).strip()
             
             # Temperatura (solo Raspberry Pi)
             try:
-                temperatura = subprocess.check_output("vcgencmd measure_temp", shell=True, text=True).strip()
+                temperatura = self._check_output("vcgencmd measure_temp", text=True).strip()
             except:
                 temperatura = "Temperatura no disponible"
             
@@ -181,9 +774,8 @@ class Bot:
             resultados = []
             for servicio in servicios:
                 try:
-                    resultado = subprocess.check_output(
+                    resultado = self._check_output(
                         f"sudo systemctl restart {servicio}", 
-                        shell=True, 
                         text=True,
                         stderr=subprocess.STDOUT
                     )
@@ -211,9 +803,8 @@ class Bot:
             archivo_respaldo = f"{carpeta_respaldo}/respaldo_{fecha}.tar.gz"
             
             # Crear respaldo comprimido
-            subprocess.check_output(
+            self._check_output(
                 f"tar -czf {archivo_respaldo} {carpeta_origen}", 
-                shell=True,
                 stderr=subprocess.STDOUT
             )
             
@@ -229,6 +820,8 @@ class Bot:
 SERVER_URL = "http://localhost:8000/api/bot"
 SERVER_TOKEN = "auth_token_here"
 RASPBERRY_ID = "raspberry_id_here"
+AUTH_SCHEME = "Token"  # "Device" si SERVER_TOKEN es una clave de dispositivo
+SPOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blueman_spool.sqlite3")
 # =============================================================================
 
 if __name__ == "__main__":
@@ -236,7 +829,9 @@ if __name__ == "__main__":
     bot = Bot(
         server_url=SERVER_URL,
         token=SERVER_TOKEN,
-        raspberry_id=RASPBERRY_ID
+        raspberry_id=RASPBERRY_ID,
+        auth_scheme=AUTH_SCHEME,
+        spool_path=SPOOL_PATH
     )
     
     # Ejecutar el bot